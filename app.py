@@ -1,58 +1,192 @@
-from flask import Flask, render_template, request, Response, stream_with_context, jsonify, session
-from graph_generator import run_story_workflow, download_image, IMAGES_DIR
-from langgraph.types import Command, interrupt
-import json
+from flask import Flask, render_template, request, Response, stream_with_context, jsonify, session, send_file
+from graph_generator import run_story_workflow, download_image, IMAGES_DIR, speculation_stats
+from graph_generator import REVIEW_MODE, start_review_workflow, resume_review_workflow, pending_review
+from image_cache import get_image_cache
+from image_scheduler import get_image_scheduler
+from llm_pool import pool_stats
+from llm_cache import get_llm_cache
+from sse_protocol import StoryDeltaEncoder, format_event, accepts_gzip, gzip_stream, SSE_GZIP
+from jobs import get_job_manager, read_job_log, follow_job_log, job_log_path, job_review_channel, shared_job_status
+from jobs import JOB_ACTIVE_STATUSES, JOB_END_EVENT, JOB_OWNER
+from review_backend import get_review_backend, REVIEW_BACKEND
+from session_store import SessionStore
+from book_store import get_book_store
+from prerender import prerender_book, get_page, select_variant, etag_matches, page_headers
+from image_server import resolve_image, image_headers, sendfile_headers, IMAGE_SENDFILE
+from book_export import export_book, EXPORT_FORMATS
+from image_gc import start_image_gc, last_report
 import os
-import threading
-from queue import Queue
-from datetime import datetime, timedelta
 import secrets
-import time
+import threading
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-replace-in-production'  # 在生产环境中替换为安全的密钥
 
-# 确保存储目录存在
-BOOKS_DIR = "static/books"
-os.makedirs(BOOKS_DIR, exist_ok=True)
-
-# 存储当前工作流状态
-class WorkflowState:
-    def __init__(self):
-        # 使用字典存储每个会话的状态
-        self.sessions = {}
-        # 使用字典存储每个会话的审核队列
-        self.review_queues = {}
-        # 存储会话创建时间
-        self.session_times = {}
+def _session_busy(record):
+    """会话的生成任务仍在运行时不清理，保证审核结果能送达"""
+    job = get_job_manager().get(record.generation_job or '')
+    return job is not None and not job.finished
+
+# 存储每个会话的工作流状态，过期会话由后台线程清理
+session_store = SessionStore(is_active=_session_busy)
+
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background_tasks():
+    """启动会话清理和图片回收等后台线程，只执行一次
+
+    在处理第一个请求时调用而不是在导入时：派生图进程池以 spawn 方式启动，
+    子进程会重新导入主模块，导入时不应产生任何副作用。
+    """
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        session_store.start_reaper()
+        if REVIEW_MODE == "interrupt" and REVIEW_BACKEND != "local":
+            # 中断审核模式的检查点（MemorySaver）只在生成故事的进程中
+            print("警告: 中断审核模式的检查点保存在进程内存中，多进程部署时需要会话粘滞，否则请使用队列审核模式")
+        # 按 IMAGE_GC_INTERVAL 定期回收未被引用的图片
+        start_image_gc()
+        _background_started = True
+
+def session_review_queue(record):
+    """会话级审核队列（非流式生成使用），多进程部署时经由审核后端共享"""
+    if record.review_queue is None:
+        record.review_queue = get_review_backend().channel(f"session:{record.session_id}")
+    return record.review_queue
+
+def find_session_job(session_id, record):
+    """查找会话当前的生成任务，返回 (job_id, 本进程中的任务或 None)
+
+    使用共享审核后端时任务可能运行在其他 worker 上，此时只能拿到 job_id。
+    """
+    backend = get_review_backend()
+    job_id = backend.get_route(session_id) if backend.shared else None
+    if job_id:
+        return job_id, get_job_manager().get(job_id)
+    job = get_job_manager().get(record.generation_job or '')
+    return (job.id if job else None), job
+
+# 任务事件流没有新事件时发送心跳的间隔（秒）
+JOB_KEEPALIVE_INTERVAL = 15
+
+def save_book(result):
+    """把绘本保存到绘本存储，返回 book_id"""
+    book_id = get_book_store().save(result)
+    print(f"保存绘本: {book_id}")
+    try:
+        # 绘本保存后不再变化，保存时预渲染页面
+        prerender_book(book_id, result)
+    except Exception as e:
+        print(f"预渲染绘本 {book_id} 失败，访问时重新渲染: {e}")
+    return book_id
+
+def encode_workflow_events(events):
+    """把工作流事件编码为 (数据, 事件名)，最终结果会先保存为绘本"""
+    # 故事更新以增量方式发送，第一条更新为完整快照
+    story_encoder = StoryDeltaEncoder()
+    for state in events:
+        if state.get("type") in ("review_request", "review_rejected"):
+            yield state, state["type"]
+            continue
         
-    def create_session(self, session_id):
-        """创建新的会话状态"""
-        self.sessions[session_id] = None
-        self.review_queues[session_id] = Queue()
-        self.session_times[session_id] = datetime.now()
+        if state.get("type") == "story_update":
+            yield story_encoder.encode(state), None
+            continue
         
-    def clean_old_sessions(self, max_age_minutes=30):
-        """清理超时的会话"""
-        now = datetime.now()
-        expired = []
-        for session_id, time in self.session_times.items():
-            if now - time > timedelta(minutes=max_age_minutes):
-                expired.append(session_id)
+        if state.get("type") == "regenerate_story":
+            story_encoder.reset()
         
-        for session_id in expired:
-            self.sessions.pop(session_id, None)
-            self.review_queues.pop(session_id, None)
-            self.session_times.pop(session_id, None)
+        if state.get("type") == "final_result":
+            state['book_id'] = save_book(state)
+        
+        yield state, None
+
+def stream_workflow_events(events):
+    """把工作流事件转换为 SSE 文本"""
+    try:
+        for data, event in encode_workflow_events(events):
+            yield format_event(data, event)
+    except Exception as e:
+        print(f"Generate error: {e}")
+        yield format_event({'error': str(e)}, "error")
+
+def follow_job_events(job, last_id=0):
+    """回放编号大于 last_id 的任务事件并持续推送新事件，任务结束后关闭"""
+    cursor = last_id
+    while True:
+        entries = job.events_after(cursor, JOB_KEEPALIVE_INTERVAL)
+        for entry in entries:
+            cursor = entry["id"]
+            yield format_event(entry["data"], entry["event"], entry["id"])
+            if entry["event"] == JOB_END_EVENT:
+                return
+        if not entries:
+            if job.finished:
+                return
+            yield ": keepalive\n\n"
+
+def follow_remote_job_events(job_id, last_id=0):
+    """跟随其他 worker 上运行的任务，从共享的日志文件读取事件"""
+    for entry in follow_job_log(job_id, last_id, JOB_KEEPALIVE_INTERVAL):
+        if entry is None:
+            yield ": keepalive\n\n"
+            continue
+        yield format_event(entry["data"], entry["event"], entry["id"])
+
+def job_state(job_id):
+    """返回 (本进程中的任务或 None, 共享后端中的状态或 None)"""
+    job = get_job_manager().get(job_id)
+    return job, (None if job is not None else shared_job_status(job_id))
 
-workflow_state = WorkflowState()
+def job_active(job, status):
+    return not job.finished if job is not None else bool(status and status["status"] in JOB_ACTIVE_STATUSES)
+
+def remote_job_events(job_id, status, last_id=0):
+    """其他实例上的任务：日志目录共享时跟随日志，否则提示客户端回到任务所在实例"""
+    if os.path.exists(job_log_path(job_id)):
+        return follow_remote_job_events(job_id, last_id)
+    message = f"任务运行在实例 {status['host']} 上，本实例无法读取其事件日志（请共享 JOB_LOG_DIR 或启用会话粘滞）"
+    return iter([format_event({"error": message, "job_id": job_id, "status": status["status"]}, "error")])
+
+def generation_job(job, outline, image_parallelism=None):
+    """生成任务：运行工作流，编码后的事件由任务管理器写入日志"""
+    print(f"开始执行生成任务: {job.id}")
+    events = run_story_workflow(outline, streaming=True, review_queue=job.review_queue,
+                                image_parallelism=image_parallelism, session_id=job.session_id or job.id)
+    yield from encode_workflow_events(events)
+
+def sse_response(body):
+    """构建事件流响应，客户端支持时启用 gzip"""
+    headers = {
+        'Cache-Control': 'no-cache',
+        'Content-Type': 'text/event-stream',
+        'Connection': 'keep-alive'
+    }
+    if SSE_GZIP and accepts_gzip(request.headers.get('Accept-Encoding', '')):
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    
+    return Response(
+        stream_with_context(body),
+        mimetype='text/event-stream',
+        headers=headers
+    )
 
 @app.before_request
 def before_request():
-    """确保每个请求都有会话ID并清理旧会话"""
+    """确保每个请求都有会话ID并刷新会话的访问时间"""
+    start_background_tasks()
+    if request.endpoint in ('static', 'serve_image'):
+        return
     if 'session_id' not in session:
         session['session_id'] = secrets.token_urlsafe(16)
-    workflow_state.clean_old_sessions()
+    session_store.get(session['session_id'])
 
 @app.route('/')
 def index():
@@ -60,18 +194,95 @@ def index():
 
 @app.route('/view_book/<book_id>')
 def view_book(book_id):
+    """返回预渲染的绘本页面，按客户端支持选择压缩版本"""
+    page = get_page(book_id)
+    if page is None:
+        return jsonify({"error": "绘本不存在"}), 404
+    
+    path, encoding, etag = select_variant(page, request.headers.get('Accept-Encoding', ''))
+    headers = page_headers(etag, encoding)
+    if etag_matches(request.headers.get('If-None-Match', ''), etag):
+        return Response(status=304, headers=headers)
+    
+    response = send_file(os.path.abspath(path), mimetype='text/html', conditional=False, etag=False)
+    response.headers.update(headers)
+    return response
+
+@app.route('/static/images/<path:name>')
+def serve_image(name):
+    """图片文件：内容哈希命名的图片永久缓存，支持条件请求和范围请求"""
+    image = resolve_image(name)
+    if image is None:
+        return jsonify({"error": "图片不存在"}), 404
+    
+    headers = image_headers(image)
+    if IMAGE_SENDFILE:
+        # 由前置代理发送文件内容
+        if etag_matches(request.headers.get('If-None-Match', ''), headers['ETag']):
+            return Response(status=304, headers=headers)
+        return Response(headers={**headers, **sendfile_headers(image)}, mimetype=image['mimetype'])
+    
+    response = send_file(image['path'], mimetype=image['mimetype'], conditional=True, etag=image['etag'])
+    response.headers['Cache-Control'] = headers['Cache-Control']
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@app.route('/books')
+def list_books():
+    """按游标分页列出绘本，sort 可选 created_desc / created_asc / title"""
     try:
-        # 从保存的JSON文件中读取绘本数据
-        book_path = os.path.join(BOOKS_DIR, f"book_{book_id}.json")
-        with open(book_path, 'r', encoding='utf-8') as f:
-            result = json.load(f)
-        
-        return render_template('storybook.html',
-                             title=result['title'],
-                             story=result['story'],
-                             scenes=result['scenes'])
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify(get_book_store().list_books(request.args.get('limit', 20, type=int),
+                                                   request.args.get('cursor'),
+                                                   request.args.get('sort', 'created_desc')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/books/<book_id>/export')
+def export_book_file(book_id):
+    """以流的方式导出绘本，format 可选 zip / epub"""
+    export_format = request.args.get('format', 'zip')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"不支持的导出格式: {export_format}"}), 400
+    book = get_book_store().get(book_id)
+    if book is None:
+        return jsonify({"error": "绘本不存在"}), 404
+    
+    mimetype = 'application/epub+zip' if export_format == 'epub' else 'application/zip'
+    return Response(
+        stream_with_context(export_book(book, export_format)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="book_{book_id}.{export_format}"'}
+    )
+
+@app.route('/books/search')
+def search_books():
+    """检索绘本的标题、大纲和故事内容"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "请提供检索词"}), 400
+    try:
+        return jsonify(get_book_store().search(query, request.args.get('limit', 20, type=int),
+                                               request.args.get('cursor')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/metrics')
+def metrics():
+    """返回缓存、调度器、预执行与 LLM 连接池的运行指标"""
+    cache = get_image_cache()
+    llm_cache = get_llm_cache()
+    return jsonify({
+        "image_cache": cache.stats() if cache else None,
+        "llm_cache": llm_cache.stats() if llm_cache else None,
+        "image_scheduler": get_image_scheduler().stats(),
+        "speculation": speculation_stats.snapshot(),
+        "llm_pool": pool_stats(),
+        "jobs": get_job_manager().stats(),
+        "sessions": session_store.stats(),
+        "review_backend": get_review_backend().stats(),
+        "books": get_book_store().stats(),
+        "image_gc": last_report()
+    })
 
 @app.route('/review', methods=['POST'])
 def review_story():
@@ -81,30 +292,102 @@ def review_story():
         if not session_id:
             return jsonify({"error": "No session ID"}), 400
             
-        # 如果会话不存在，创建一个新会话
-        if session_id not in workflow_state.sessions:
-            workflow_state.create_session(session_id)
-            print(f"创建新会话: {session_id}")
-            
+        record = session_store.get(session_id)
         data = request.json
         approved = data.get('approved', False)
         regenerate = data.get('regenerate', False)
         
-        if workflow_state.sessions[session_id] is not None:
+        job_id, job = find_session_job(session_id, record)
+        status = shared_job_status(job_id) if job_id and job is None else None
+        if job_id and job_active(job, status):
+            # 流式生成在任务中执行，审核结果经由审核后端交给该任务（可能在其他 worker 上）
+            print(f"接收到审核结果: approved={approved}, regenerate={regenerate}, 任务: {job_id}")
+            job_review_channel(job_id).put({"approved": approved, "regenerate": regenerate})
+            return jsonify({"status": "success", "approved": approved, "regenerate": regenerate})
+        
+        if REVIEW_MODE == "interrupt":
+            # 从检查点恢复工作流，后续事件直接在本次响应中返回
+            thread_id = record.workflow
+            if not thread_id or not pending_review(thread_id):
+                # 检查点保存在生成故事的进程中，多进程部署需要会话粘滞
+                return jsonify({"error": "没有等待审核的故事（中断审核模式要求审核请求回到生成故事的进程）"}), 409
+            print(f"接收到审核结果: approved={approved}, regenerate={regenerate}, 线程: {thread_id}")
+            return sse_response(stream_workflow_events(
+                resume_review_workflow(thread_id, {"approved": approved, "regenerate": regenerate})
+            ))
+        
+        if record.workflow is not None:
             # 将审核结果放入队列
             print(f"接收到审核结果: approved={approved}, regenerate={regenerate}")
-            workflow_state.review_queues[session_id].put({"approved": approved, "regenerate": regenerate})
+            session_review_queue(record).put({"approved": approved, "regenerate": regenerate})
             return jsonify({"status": "success", "approved": approved, "regenerate": regenerate})
         else:
             # 如果工作流会话不存在，创建一个新的工作流会话
             print(f"工作流会话不存在，创建新会话: {session_id}")
-            workflow_state.sessions[session_id] = session_id
-            workflow_state.review_queues[session_id].put({"approved": approved, "regenerate": regenerate})
+            record.workflow = session_id
+            session_review_queue(record).put({"approved": approved, "regenerate": regenerate})
             return jsonify({"status": "success", "approved": approved, "new_session": True})
     except Exception as e:
         print(f"Review error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """提交生成任务，立即返回 job_id，生成过程与本次连接无关"""
+    data = request.get_json(silent=True) or request.form
+    outline = data.get('outline', '')
+    if not outline:
+        return jsonify({"error": "请提供故事大纲"}), 400
+    try:
+        image_parallelism = int(data['image_parallelism']) if data.get('image_parallelism') else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "image_parallelism 必须是整数"}), 400
+    
+    job = get_job_manager().submit(generation_job, outline, image_parallelism,
+                                   session_id=session.get('session_id'))
+    return jsonify(job.info()), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(job.info())
+
+@app.route('/jobs/<job_id>/review', methods=['POST'])
+def review_job(job_id):
+    """提交任务的审核结果"""
+    # 任务可能运行在其他 worker 上，根据共享后端中的任务状态判断是否仍在运行
+    job, status = job_state(job_id)
+    if not job_active(job, status):
+        return jsonify({"error": "任务不存在或已结束"}), 404
+    data = request.get_json(silent=True) or {}
+    approved = data.get('approved', False)
+    regenerate = data.get('regenerate', False)
+    job_review_channel(job_id).put({"approved": approved, "regenerate": regenerate})
+    return jsonify({"status": "success", "approved": approved, "regenerate": regenerate})
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """订阅任务事件：先回放日志，再实时推送新事件，任务结束后关闭"""
+    last_id = request.headers.get('Last-Event-ID', request.args.get('after', '0'))
+    last_id = int(last_id) if last_id.isdigit() else 0
+    job, status = job_state(job_id)
+    
+    if job is None:
+        if job_active(None, status):
+            return sse_response(remote_job_events(job_id, status, last_id))
+        # 已结束并从内存清理的任务直接回放日志文件
+        entries = read_job_log(job_id)
+        if entries is None:
+            if status is not None:
+                return jsonify({"error": f"任务的事件日志在实例 {status['host']} 上"}), 404
+            return jsonify({"error": "任务不存在"}), 404
+        return sse_response(format_event(entry["data"], entry["event"], entry["id"])
+                            for entry in entries if entry["id"] > last_id)
+    
+    return sse_response(follow_job_events(job, last_id))
+
 @app.route('/generate', methods=['GET', 'POST'])
 def generate_book():
     # 获取会话ID
@@ -113,92 +396,63 @@ def generate_book():
         return "Session error", 400
         
     # 确保会话存在
-    if session_id not in workflow_state.sessions:
-        workflow_state.create_session(session_id)
-        print(f"创建新会话: {session_id}")
+    record = session_store.get(session_id)
     
     # 获取参数
     if request.method == 'GET':
         outline = request.args.get('outline', '')
         streaming = request.args.get('streaming', 'false').lower() == 'true'
+        image_parallelism = request.args.get('image_parallelism', type=int)
     else:
         outline = request.form.get('outline', '')
         streaming = request.form.get('streaming', 'false').lower() == 'true'
+        image_parallelism = request.form.get('image_parallelism', type=int)
     
     if not outline:
         return "请提供故事大纲", 400
     
+    if streaming and REVIEW_MODE == "interrupt":
+        # 请求在审核点结束，审核结果提交后由 /review 从检查点继续
+        thread_id = f"{session_id}_{secrets.token_hex(4)}"
+        record.workflow = thread_id
+        print(f"开始生成故事，会话ID: {session_id}, 线程: {thread_id}")
+        return sse_response(stream_workflow_events(
+            start_review_workflow(outline, thread_id, image_parallelism, session_id)
+        ))
+    
     if streaming:
-        def generate():
-            try:
-                # 使用会话特定的队列
-                review_queue = workflow_state.review_queues[session_id]
-                # 清理队列
-                while not review_queue.empty():
-                    review_queue.get()
-                
-                # 确保会话状态正确
-                workflow_state.sessions[session_id] = session_id
-                print(f"开始生成故事，会话ID: {session_id}")
-                
-                for state in run_story_workflow(outline, streaming=True, review_queue=review_queue):
-                    if state.get("type") == "review_request":
-                        yield f"event: review_request\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
-                        continue
-                    
-                    if state.get("type") == "review_rejected":
-                        yield f"event: review_rejected\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
-                        continue
-                    
-                    if state.get("type") == "final_result":
-                        # 使用时间戳和随机数生成唯一的 book_id
-                        book_id = f"{int(datetime.now().timestamp())}_{secrets.token_hex(4)}"
-                        book_path = os.path.join(BOOKS_DIR, f"book_{book_id}.json")
-                        print('=====book_path==',book_path)
-                        print('=====state==',state)
-
-                        with open(book_path, 'w', encoding='utf-8') as f:
-                            json.dump(state, f, ensure_ascii=False, indent=2)
-                        state['book_id'] = book_id
-                    
-                    yield f"data: {json.dumps(state, ensure_ascii=False)}\n\n"
-                
-            except Exception as e:
-                print(f"Generate error: {e}")
-                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
-            finally:
-                # 等待一定时间，确保前端有足够时间加载图片
-                time.sleep(3)  # 给前端3秒时间加载图片
-                
-                # 清理会话状态
-                workflow_state.sessions[session_id] = None
-                while not workflow_state.review_queues[session_id].empty():
-                    review_queue.get()
-                print(f"故事生成完成，清理会话状态: {session_id}")
+        # 生成在任务中执行，连接断开不影响生成；事件带编号，重连时只补发缺失的部分
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        job_id, job = find_session_job(session_id, record)
+        # 任务状态经由共享后端查询，任务日志可能只在任务所在的机器上
+        status = shared_job_status(job_id) if job_id and job is None else None
+        if job_id and last_event_id.isdigit() and (job is not None or status is not None
+                                                   or os.path.exists(job_log_path(job_id))):
+            print(f"会话 {session_id} 重连，从事件 {last_event_id} 之后续传任务 {job_id}")
+            if job is None:
+                return sse_response(remote_job_events(job_id, status, int(last_event_id)))
+            return sse_response(follow_job_events(job, int(last_event_id)))
         
-        return Response(
-            stream_with_context(generate()),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Content-Type': 'text/event-stream',
-                'Connection': 'keep-alive'
-            }
-        )
+        # 同一会话开始新的绘本，旧任务若仍在等待审核则按拒绝结束；只处理本机的任务，不干预其他机器上的任务
+        if job is not None and not job.finished:
+            job_review_channel(job_id).put({"approved": False, "regenerate": False})
+        elif job_active(None, status) and status["host"] == JOB_OWNER["host"]:
+            job_review_channel(job_id).put({"approved": False, "regenerate": False})
+        job = get_job_manager().submit(generation_job, outline, image_parallelism, session_id=session_id)
+        record.generation_job = job.id
+        print(f"开始生成故事，会话ID: {session_id}, 任务: {job.id}")
+        return sse_response(follow_job_events(job))
     else:
         try:
-            review_queue = workflow_state.review_queues[session_id]
-            result = next(run_story_workflow(outline, streaming=False, review_queue=review_queue))
+            review_queue = session_review_queue(record)
+            result = next(run_story_workflow(outline, streaming=False, review_queue=review_queue,
+                                             session_id=session_id))
             
             for scene in result['scenes']:
                 if not scene['image_url'].startswith('/static/'):
                     scene['image_url'] = download_image(scene['image_url'], IMAGES_DIR)
             
-            # 使用时间戳和随机数生成唯一的 book_id
-            book_id = f"{int(datetime.now().timestamp())}_{secrets.token_hex(4)}"
-            book_path = os.path.join(BOOKS_DIR, f"book_{book_id}.json")
-            with open(book_path, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
+            save_book(result)
             
             return render_template('storybook.html', 
                                  title=result['title'],
@@ -0,0 +1,312 @@
+"""ASGI 服务模式：连接、审核等待和图片等待都是协程，适合大量并发连接
+
+启动方式：uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+提供与 app.py 相同的页面、绘本浏览/检索/导出、图片服务、/review 和 /generate（事件格式一致），
+但不能直接替代 Flask 版本，以下功能目前只有 app.py 支持：
+- /jobs 任务接口，以及 /generate 断线后按 Last-Event-ID 续传（生成与连接绑定，断开即停止）
+- 审核中断模式（REVIEW_MODE=interrupt），以及经由 REVIEW_BACKEND 在多个 worker 间传递审核结果
+- 结构化输出（STRUCTURED_OUTPUT）、审核期间的预执行（SPECULATIVE_MODE）和 STREAMING_SPLIT=false
+"""
+import asyncio
+import contextlib
+import os
+import secrets
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+
+from async_workflow import arun_story_workflow
+from book_export import EXPORT_FORMATS, export_book
+from book_store import get_book_store
+from graph_generator import REVIEW_MODE, SPECULATIVE_MODE, STREAMING_SPLIT, STRUCTURED_OUTPUT, speculation_stats
+from prerender import etag_matches, get_page, page_headers, prerender_book, select_variant
+from image_cache import get_image_cache
+from image_gc import last_report, start_image_gc
+from image_scheduler import get_image_scheduler
+from image_server import IMAGE_SENDFILE, image_headers, resolve_image, sendfile_headers
+from llm_cache import get_llm_cache
+from llm_pool import pool_stats
+from session_store import SessionStore
+from sse_protocol import SSE_GZIP, StoryDeltaEncoder, accepts_gzip, agzip_stream, format_event
+
+SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-replace-in-production")  # 在生产环境中替换为安全的密钥
+
+templates = Jinja2Templates(directory="templates")
+
+# 只在 Flask 版本中生效的配置，在这里提示而不是静默忽略
+_FLASK_ONLY_FLAGS = {
+    "REVIEW_MODE=interrupt": REVIEW_MODE == "interrupt",
+    "STRUCTURED_OUTPUT=true": STRUCTURED_OUTPUT,
+    f"SPECULATIVE_MODE={SPECULATIVE_MODE}": SPECULATIVE_MODE != "off",
+    "STREAMING_SPLIT=false": not STREAMING_SPLIT
+}
+
+
+def _static_url_for(endpoint: str, filename: str = "", **values) -> str:
+    """兼容模板中 Flask 风格的 url_for('static', filename=...)"""
+    return f"/static/{filename}"
+
+
+templates.env.globals["url_for"] = _static_url_for
+
+
+# 每个会话的审核队列与运行状态；过期会话由后台线程清理，正在生成的会话（workflow 不为 None）不清理
+session_store = SessionStore(is_active=lambda record: record.workflow is not None)
+
+
+def get_session(request):
+    """确保每个请求都有会话ID，返回刷新过访问时间的会话记录"""
+    if 'session_id' not in request.session:
+        request.session['session_id'] = secrets.token_urlsafe(16)
+    return session_store.get(request.session['session_id'])
+
+
+def session_review_queue(record) -> asyncio.Queue:
+    if record.review_queue is None:
+        record.review_queue = asyncio.Queue()
+    return record.review_queue
+
+
+def save_book(result: dict) -> str:
+    """把绘本保存到绘本存储并预渲染页面，返回 book_id"""
+    book_id = get_book_store().save(result)
+    try:
+        prerender_book(book_id, result)
+    except Exception as e:
+        print(f"预渲染绘本 {book_id} 失败，访问时重新渲染: {e}")
+    return book_id
+
+
+async def astream_workflow_events(events):
+    """把工作流事件转换为 SSE 文本，最终结果会先保存为绘本"""
+    try:
+        story_encoder = StoryDeltaEncoder()
+        async for state in events:
+            event_type = state.get("type")
+            if event_type in ("review_request", "review_rejected"):
+                yield format_event(state, event_type)
+                continue
+            if event_type == "story_update":
+                yield format_event(story_encoder.encode(state))
+                continue
+            if event_type == "regenerate_story":
+                story_encoder.reset()
+            if event_type == "final_result":
+                state['book_id'] = await asyncio.to_thread(save_book, dict(state))
+            yield format_event(state)
+    except Exception as e:
+        print(f"Generate error: {e}")
+        yield format_event({'error': str(e)}, "error")
+
+
+def sse_response(request, body) -> StreamingResponse:
+    headers = {'Cache-Control': 'no-cache', 'Connection': 'keep-alive'}
+    if SSE_GZIP and accepts_gzip(request.headers.get('accept-encoding', '')):
+        body = agzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    return StreamingResponse(body, media_type='text/event-stream', headers=headers)
+
+
+async def index(request):
+    get_session(request)
+    return templates.TemplateResponse(request, 'index.html')
+
+
+async def view_book(request):
+    """返回预渲染的绘本页面，按客户端支持选择压缩版本"""
+    page = await asyncio.to_thread(get_page, request.path_params['book_id'])
+    if page is None:
+        return JSONResponse({"error": "绘本不存在"}, status_code=404)
+    path, encoding, etag = select_variant(page, request.headers.get('accept-encoding', ''))
+    headers = page_headers(etag, encoding)
+    if etag_matches(request.headers.get('if-none-match', ''), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type='text/html; charset=utf-8', headers=headers)
+
+
+async def serve_image(request):
+    """图片文件：内容哈希命名的图片永久缓存，支持条件请求和范围请求"""
+    image = resolve_image(request.path_params['name'])
+    if image is None:
+        return JSONResponse({"error": "图片不存在"}, status_code=404)
+    headers = image_headers(image)
+    if etag_matches(request.headers.get('if-none-match', ''), headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    if IMAGE_SENDFILE:
+        # 由前置代理发送文件内容
+        return Response(headers={**headers, **sendfile_headers(image)}, media_type=image['mimetype'])
+    return FileResponse(image['path'], media_type=image['mimetype'], headers=headers)
+
+
+def _limit(request) -> int:
+    limit = request.query_params.get('limit', '')
+    return int(limit) if limit.isdigit() else 20
+
+
+async def list_books(request):
+    """按游标分页列出绘本，sort 可选 created_desc / created_asc / title"""
+    try:
+        result = await asyncio.to_thread(get_book_store().list_books, _limit(request),
+                                         request.query_params.get('cursor'),
+                                         request.query_params.get('sort', 'created_desc'))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse(result)
+
+
+async def export_book_file(request):
+    """以流的方式导出绘本，format 可选 zip / epub"""
+    book_id = request.path_params['book_id']
+    export_format = request.query_params.get('format', 'zip')
+    if export_format not in EXPORT_FORMATS:
+        return JSONResponse({"error": f"不支持的导出格式: {export_format}"}, status_code=400)
+    book = await asyncio.to_thread(get_book_store().get, book_id)
+    if book is None:
+        return JSONResponse({"error": "绘本不存在"}, status_code=404)
+    # 同步生成器由 Starlette 在线程池中逐块迭代
+    media_type = 'application/epub+zip' if export_format == 'epub' else 'application/zip'
+    return StreamingResponse(export_book(book, export_format), media_type=media_type, headers={
+        'Content-Disposition': f'attachment; filename="book_{book_id}.{export_format}"'
+    })
+
+
+async def search_books(request):
+    """检索绘本的标题、大纲和故事内容"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return JSONResponse({"error": "请提供检索词"}, status_code=400)
+    try:
+        result = await asyncio.to_thread(get_book_store().search, query, _limit(request),
+                                         request.query_params.get('cursor'))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse(result)
+
+
+async def metrics(request):
+    """返回缓存、调度器、预执行与 LLM 连接池的运行指标"""
+    cache = get_image_cache()
+    llm_cache = get_llm_cache()
+    return JSONResponse({
+        "image_cache": cache.stats() if cache else None,
+        "llm_cache": llm_cache.stats() if llm_cache else None,
+        "image_scheduler": get_image_scheduler().stats(),
+        "speculation": speculation_stats.snapshot(),
+        "llm_pool": pool_stats(),
+        "books": get_book_store().stats(),
+        "sessions": session_store.stats(),
+        "image_gc": last_report()
+    })
+
+
+async def review_story(request):
+    """处理故事审核结果"""
+    try:
+        record = get_session(request)
+        data = await request.json()
+        approved = data.get('approved', False)
+        regenerate = data.get('regenerate', False)
+        review_queue = session_review_queue(record)
+        print(f"接收到审核结果: approved={approved}, regenerate={regenerate}")
+        review_queue.put_nowait({"approved": approved, "regenerate": regenerate})
+        if record.workflow is not None:
+            return JSONResponse({"status": "success", "approved": approved, "regenerate": regenerate})
+        return JSONResponse({"status": "success", "approved": approved, "new_session": True})
+    except Exception as e:
+        print(f"Review error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def generate_book(request):
+    record = get_session(request)
+    session_id = record.session_id
+    params = request.query_params if request.method == 'GET' else await request.form()
+    outline = params.get('outline', '')
+    streaming = params.get('streaming', 'false').lower() == 'true'
+    image_parallelism = params.get('image_parallelism')
+    image_parallelism = int(image_parallelism) if image_parallelism and image_parallelism.isdigit() else None
+
+    if not outline:
+        return PlainTextResponse("请提供故事大纲", status_code=400)
+
+    review_queue = session_review_queue(record)
+    # 清理上一次遗留的审核结果
+    while not review_queue.empty():
+        review_queue.get_nowait()
+    events = arun_story_workflow(outline, review_queue, image_parallelism, session_id)
+
+    if streaming:
+        async def generate():
+            record.workflow = session_id
+            print(f"开始生成故事，会话ID: {session_id}")
+            try:
+                async for event in astream_workflow_events(events):
+                    yield event
+                # 给前端时间加载图片并主动关闭连接
+                await asyncio.sleep(3)
+            finally:
+                record.workflow = None
+                print(f"故事生成完成，清理会话状态: {session_id}")
+
+        return sse_response(request, generate())
+
+    # 非流式：同样在协程中等待审核，完成后直接渲染绘本
+    record.workflow = session_id
+    try:
+        result = None
+        async for event in events:
+            if event.get("type") == "final_result":
+                result = event
+        if result is None:
+            return JSONResponse({"error": "故事未通过审核"}, status_code=400)
+        await asyncio.to_thread(save_book, dict(result))
+        return templates.TemplateResponse(request, 'storybook.html', {
+            "title": result['title'],
+            "story": result['story'],
+            "scenes": result['scenes']
+        })
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        record.workflow = None
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """服务启动时开启后台线程；派生图进程池（spawn）重新导入本模块时不会执行"""
+    for flag, enabled in _FLASK_ONLY_FLAGS.items():
+        if enabled:
+            print(f"警告: ASGI 模式不支持 {flag}，该配置被忽略")
+    session_store.start_reaper()
+    # 按 IMAGE_GC_INTERVAL 定期回收未被引用的图片
+    start_image_gc()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/view_book/{book_id}', view_book),
+        Route('/books', list_books),
+        Route('/books/search', search_books),
+        Route('/books/{book_id}/export', export_book_file),
+        Route('/metrics', metrics),
+        Route('/review', review_story, methods=['POST']),
+        Route('/generate', generate_book, methods=['GET', 'POST']),
+        Route('/static/images/{name:path}', serve_image),
+        Mount('/static', StaticFiles(directory='static'), name='static'),
+    ],
+    middleware=[Middleware(SessionMiddleware, secret_key=SECRET_KEY)],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,264 @@
+import asyncio
+from typing import AsyncGenerator, Dict, Optional
+
+from langchain_core.messages import HumanMessage
+
+from graph_generator import (
+    StoryState, DEFAULT_IMAGE_SESSION, IMAGE_PARALLELISM, QUEUE_STATUS_INTERVAL,
+    STORY_UPDATE_INTERVAL, STORY_UPDATE_MIN_CHARS, SceneImageProgress,
+    build_story_prompt, build_feature_prompt, build_split_prompt, scene_from_data, fallback_scenes,
+    apply_parsed_features, apply_feature_response, apply_default_features,
+    cached_llm_response, store_llm_response, render_scene_image, collect_scene_variants, final_result_event
+)
+from image_scheduler import get_image_scheduler
+from llm_cache import replay_chunks
+from llm_pool import get_llm
+from stream_parsers import SceneStreamParser, StreamFormatError, StoryFeatureParser, UpdateCoalescer
+
+# ASGI 模式下的工作流：故事流、审核等待和图片扇出都是协程，
+# 事件与 graph_generator 的流式工作流保持一致。逐场景的处理复用 graph_generator 的辅助函数，
+# 其中会读写 SQLite 或磁盘的调用通过 asyncio.to_thread 放到线程中执行，不阻塞事件循环。
+
+
+async def _content_chunks(llm, prompt: str, cached_response: Optional[str]) -> AsyncGenerator[str, None]:
+    """命中缓存时按小块回放，否则异步流式请求"""
+    if cached_response is not None:
+        for chunk in replay_chunks(cached_response):
+            yield chunk
+        return
+    async for chunk in llm.astream([HumanMessage(content=prompt)]):
+        yield chunk.content
+
+
+async def astream_story(state: StoryState, use_cache: bool = True) -> AsyncGenerator[Dict, None]:
+    """流式生成故事与角色特征"""
+    llm = get_llm(streaming=True)
+    prompt = build_story_prompt(state)
+    state['story'] = ""
+    state['planned_scenes'] = []
+    cached_response = await asyncio.to_thread(
+        cached_llm_response, llm, prompt, use_cache and not state.get('regenerate', False))
+    if cached_response is not None:
+        print("故事命中 LLM 响应缓存")
+
+    parser = StoryFeatureParser()
+    coalescer = UpdateCoalescer(STORY_UPDATE_INTERVAL, STORY_UPDATE_MIN_CHARS)
+    collected_chunks = []
+    async for content_chunk in _content_chunks(llm, prompt, cached_response):
+        collected_chunks.append(content_chunk)
+        parser.feed(content_chunk)
+        if coalescer.ready(parser.story_length):
+            state['story'] = parser.story
+            yield {"type": "story_update", "content": state['story'], "completed": False}
+
+    parser.finish()
+    if cached_response is None:
+        await asyncio.to_thread(store_llm_response, llm, prompt, "".join(collected_chunks))
+
+    if not apply_parsed_features(state, parser):
+        # 没有分隔符时补充一次调用获取角色特征
+        try:
+            feature_llm = get_llm(streaming=False)
+            feature_response = await feature_llm.ainvoke([HumanMessage(content=build_feature_prompt(state['story']))])
+            apply_feature_response(state, feature_response.content)
+        except Exception as e:
+            print(f"补充提取人物特征时出错: {e}")
+            apply_default_features(state)
+
+    yield {"type": "story_update", "content": state['story'], "completed": True}
+
+
+async def astream_scenes(state: StoryState, use_cache: bool = True) -> AsyncGenerator[Dict, None]:
+    """流式分割场景，解析出一个场景就立即产出，出错时的回退规则与同步版本相同"""
+    state['scenes'] = []
+    state['current_scene_index'] = 0
+    state['completed'] = False
+
+    if state.get('planned_scenes'):
+        for planned_scene in state['planned_scenes']:
+            scene = dict(planned_scene)
+            state['scenes'].append(scene)
+            yield scene
+        return
+
+    llm = get_llm(streaming=True)
+    prompt = build_split_prompt(state)
+    parser = SceneStreamParser()
+    cached_response = await asyncio.to_thread(cached_llm_response, llm, prompt, use_cache)
+    collected_chunks = []
+
+    try:
+        async for content_chunk in _content_chunks(llm, prompt, cached_response):
+            collected_chunks.append(content_chunk)
+            for scene_data in parser.feed(content_chunk):
+                scene = scene_from_data(scene_data)
+                state['scenes'].append(scene)
+                yield scene
+            if parser.done:
+                break
+        if not state['scenes']:
+            raise StreamFormatError("输出中没有解析到场景")
+        if cached_response is None and parser.done:
+            await asyncio.to_thread(store_llm_response, llm, prompt, "".join(collected_chunks))
+    except Exception as e:
+        print(f"流式场景分析出错: {e}")
+        if state['scenes']:
+            return
+        for scene in fallback_scenes(state['story']):
+            state['scenes'].append(scene)
+            yield scene
+
+
+async def agenerate_images(state: StoryState, parallelism: int = None, session_id: str = DEFAULT_IMAGE_SESSION,
+                           scene_source: AsyncGenerator[Dict, None] = None) -> AsyncGenerator[Dict, None]:
+    """把场景提交到全局调度器并以协程等待，按完成顺序产出 image_update 事件
+
+    图片任务仍由调度器统一限流和分配并发，与同步模式共享同一套配额。
+    """
+    max_parallel = max(1, parallelism or IMAGE_PARALLELISM)
+    scheduler = get_image_scheduler()
+    progress = SceneImageProgress([])
+    scenes = progress.scenes
+    arrived = asyncio.Event()
+    source = {"finished": scene_source is None, "error": None}
+
+    async def consume():
+        try:
+            async for scene in scene_source:
+                scenes.append(scene)
+                arrived.set()
+        except Exception as e:
+            source["error"] = e
+        finally:
+            source["finished"] = True
+            arrived.set()
+
+    consumer = asyncio.create_task(consume()) if scene_source is not None else None
+    if consumer is None:
+        scenes.extend(state['scenes'])
+
+    jobs = {}
+    pending = set()
+    submitted_count = 0
+
+    print(f"开始生成图片（异步），会话 {session_id} 并发数: {max_parallel}")
+    try:
+        while True:
+            # 先清除信号再读取状态，之后到达的场景会重新置位
+            arrived.clear()
+            progress.all_scenes_known = source["finished"]
+
+            while submitted_count < len(scenes):
+                index = submitted_count
+                submitted_count += 1
+                if await asyncio.to_thread(progress.use_cached, index):
+                    yield progress.done_event(index, cached=True)
+                    continue
+                job = scheduler.submit(session_id, render_scene_image, scenes[index], check_cache=False,
+                                       max_parallel=max_parallel)
+                future = asyncio.wrap_future(job.future)
+                jobs[future] = (index, job)
+                pending.add(future)
+
+            if not pending and progress.all_scenes_known:
+                break
+
+            for event in progress.position_events(jobs[future] for future in pending):
+                yield event
+
+            waiting = set(pending)
+            arrival = None
+            if not progress.all_scenes_known:
+                arrival = asyncio.ensure_future(arrived.wait())
+                waiting.add(arrival)
+            done, _ = await asyncio.wait(waiting, timeout=QUEUE_STATUS_INTERVAL,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if arrival is not None and not arrival.done():
+                arrival.cancel()
+            for future in done & pending:
+                pending.discard(future)
+                scene_index, job = jobs[future]
+                # 写回结果后要读取图片尺寸并提交派生图任务，在线程中执行
+                await asyncio.to_thread(progress.finish, scene_index, job.future)
+                yield progress.done_event(scene_index)
+    finally:
+        # 出错或客户端断开时撤回尚在排队的任务
+        for future in pending:
+            jobs[future][1].cancel()
+        if consumer is not None and not consumer.done():
+            consumer.cancel()
+
+    if source["error"] is not None:
+        raise source["error"]
+    await asyncio.to_thread(collect_scene_variants, progress.variant_futures)
+    state['scenes'] = scenes
+    state['current_scene_index'] = len(scenes)
+    state['completed'] = True
+
+
+async def ahuman_review(state: StoryState, review_queue: asyncio.Queue) -> StoryState:
+    """等待审核结果，等待期间不占用线程"""
+    review_data = await review_queue.get()
+    if not isinstance(review_data, dict):
+        print(f"Unexpected review data type: {type(review_data)}")
+        review_data = {}
+    state["approved"] = review_data.get("approved", False)
+    state["regenerate"] = review_data.get("regenerate", False)
+    print(f"Review result: {'Approved' if state['approved'] else 'Rejected'}, Regenerate: {state['regenerate']}")
+    return state
+
+
+async def _story_round(state: StoryState, use_cache: bool = True) -> AsyncGenerator[Dict, None]:
+    """生成一轮故事并发出角色特征和审核请求"""
+    async for update in astream_story(state, use_cache):
+        yield update
+    yield {
+        "type": "character_features",
+        "features": state.get("character_features", ""),
+        "name": state.get("character_name", "主角")
+    }
+    yield {
+        "type": "review_request",
+        "story": state["story"],
+        "outline": state["outline"],
+        "character_features": state.get("character_features", ""),
+        "character_name": state.get("character_name", "主角")
+    }
+
+
+async def arun_story_workflow(outline: str, review_queue: asyncio.Queue, image_parallelism: int = None,
+                              session_id: str = DEFAULT_IMAGE_SESSION) -> AsyncGenerator[Dict, None]:
+    """异步流式工作流：生成故事、等待审核（可重新生成一次）、分场景并并发生成图片"""
+    state = StoryState(
+        outline=outline,
+        story="",
+        scenes=[],
+        current_scene_index=0,
+        completed=False,
+        streaming=True,
+        approved=False,
+        regenerate=False,
+        character_features="",
+        character_name=""
+    )
+
+    async for update in _story_round(state):
+        yield update
+    state = await ahuman_review(state, review_queue)
+
+    if not state["approved"]:
+        if not state.get("regenerate", False):
+            yield {"type": "review_rejected", "message": "故事内容未通过审核"}
+            return
+        yield {"type": "regenerate_story", "message": "重新生成故事"}
+        state['regenerate'] = False
+        async for update in _story_round(state, use_cache=False):
+            yield update
+        state = await ahuman_review(state, review_queue)
+        if not state["approved"]:
+            yield {"type": "review_rejected", "message": "新故事内容未通过审核"}
+            return
+
+    async for event in agenerate_images(state, image_parallelism, session_id, scene_source=astream_scenes(state)):
+        yield event
+    yield final_result_event(state)
@@ -0,0 +1,241 @@
+import argparse
+import html
+import io
+import json
+import os
+import time
+import zipfile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from book_store import LEGACY_BOOKS_DIR, get_book_store
+from image_server import IMAGES_DIR, resolve_image
+
+# 导出配置
+EXPORT_CHUNK_SIZE = 64 * 1024  # 从磁盘读取并写出的块大小
+EXPORT_FORMATS = ("zip", "epub")
+IMAGE_URL_PREFIX = "/static/images/"
+# 已经压缩过的图片格式直接存储，不再 deflate
+_STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".avif", ".gif"}
+
+# 条目内容：bytes 为内存中的小文件，str 为磁盘文件路径
+EntrySource = Union[bytes, str]
+
+
+class _StreamBuffer(io.RawIOBase):
+    """只追加、不可回退的输出缓冲区，zipfile 写入后由生成器立即取走"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, EntrySource]]) -> Iterator[bytes]:
+    """边读边写 ZIP，每读入一块就产出压缩后的数据
+
+    输出不可回退，zipfile 会为每个条目写数据描述符，内存中只保留当前块和中央目录。
+    """
+    buffer = _StreamBuffer()
+    now = time.localtime()[:6]
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, source in entries:
+            info = zipfile.ZipInfo(name, date_time=now)
+            extension = os.path.splitext(name)[1].lower()
+            stored = name == "mimetype" or extension in _STORED_EXTENSIONS
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            if isinstance(source, bytes):
+                with archive.open(info, 'w') as dest:
+                    dest.write(source)
+            else:
+                size = os.path.getsize(source)
+                with open(source, 'rb') as f, archive.open(info, 'w', force_zip64=size > zipfile.ZIP64_LIMIT) as dest:
+                    for chunk in iter(lambda: f.read(EXPORT_CHUNK_SIZE), b""):
+                        dest.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    # 关闭时写出中央目录
+    yield buffer.drain()
+
+
+def _book_images(book: Dict) -> List[Tuple[Dict, Optional[Dict]]]:
+    """返回 (场景, 本地图片信息)；远程或缺失的图片为 None"""
+    scenes = []
+    for scene in book.get("scenes", []):
+        image_url = scene.get("image_url") or ""
+        image = resolve_image(image_url[len(IMAGE_URL_PREFIX):]) if image_url.startswith(IMAGE_URL_PREFIX) else None
+        scenes.append((scene, image))
+    return scenes
+
+
+def _image_name(image: Dict) -> str:
+    return os.path.basename(image["name"])
+
+
+def zip_entries(book: Dict) -> Iterator[Tuple[str, EntrySource]]:
+    """ZIP 导出：book.json、story.txt 和场景图片，JSON 中的图片地址改为包内相对路径"""
+    scenes = _book_images(book)
+    exported = dict(book)
+    exported["scenes"] = [
+        {**scene, "image_url": f"images/{_image_name(image)}"} if image else dict(scene)
+        for scene, image in scenes
+    ]
+    yield "book.json", json.dumps(exported, ensure_ascii=False, indent=2).encode("utf-8")
+    yield "story.txt", (book.get("story") or "").encode("utf-8")
+    written = set()
+    for _, image in scenes:
+        if image and _image_name(image) not in written:
+            written.add(_image_name(image))
+            yield f"images/{_image_name(image)}", image["path"]
+
+
+_CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+def _xhtml(title: str, body: str) -> bytes:
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="zh" lang="zh">
+<head><meta charset="utf-8"/><title>{html.escape(title)}</title></head>
+<body>
+{body}
+</body>
+</html>
+""".encode("utf-8")
+
+
+def epub_entries(book: Dict) -> Iterator[Tuple[str, EntrySource]]:
+    """EPUB 3 导出：每个场景一页，图片在前、文字在后"""
+    book_id = book.get("book_id", "")
+    title = book.get("title") or "故事"
+    scenes = _book_images(book)
+
+    yield "mimetype", b"application/epub+zip"
+    yield "META-INF/container.xml", _CONTAINER_XML.encode("utf-8")
+
+    manifest = ['<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>']
+    spine = []
+    nav_items = []
+    images = {}
+    for index, (scene, image) in enumerate(scenes, 1):
+        page = f"scene_{index}.xhtml"
+        body = []
+        if image:
+            images.setdefault(_image_name(image), image)
+            body.append(f'<div><img src="images/{html.escape(_image_name(image))}" alt="场景{index}"/></div>')
+        body.append(f"<p>{html.escape(scene.get('text', ''))}</p>")
+        yield f"OEBPS/{page}", _xhtml(f"{title} - {index}", "\n".join(body))
+        manifest.append(f'<item id="scene_{index}" href="{page}" media-type="application/xhtml+xml"/>')
+        spine.append(f'<itemref idref="scene_{index}"/>')
+        nav_items.append(f'<li><a href="{page}">{index}</a></li>')
+
+    nav = f'<nav epub:type="toc"><h1>{html.escape(title)}</h1><ol>{"".join(nav_items)}</ol></nav>'
+    yield "OEBPS/nav.xhtml", _xhtml(title, nav)
+
+    for number, (name, image) in enumerate(images.items(), 1):
+        properties = ' properties="cover-image"' if number == 1 else ""
+        manifest.append(f'<item id="image_{number}" href="images/{html.escape(name)}" '
+                        f'media-type="{image["mimetype"]}"{properties}/>')
+    modified = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    manifest_xml = "\n    ".join(manifest)
+    opf = f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id" xml:lang="zh">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">urn:storybook:{html.escape(book_id)}</dc:identifier>
+    <dc:title>{html.escape(title)}</dc:title>
+    <dc:language>zh</dc:language>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    {manifest_xml}
+  </manifest>
+  <spine>
+    {''.join(spine)}
+  </spine>
+</package>
+"""
+    yield "OEBPS/content.opf", opf.encode("utf-8")
+
+    # 图片放在最后，逐块从磁盘读取
+    for name, image in images.items():
+        yield f"OEBPS/images/{name}", image["path"]
+
+
+def export_book(book: Dict, export_format: str = "zip") -> Iterator[bytes]:
+    """把单本绘本导出为 ZIP 或 EPUB 字节流"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {export_format}")
+    entries = epub_entries(book) if export_format == "epub" else zip_entries(book)
+    return stream_zip(entries)
+
+
+def archive_entries(include_legacy: bool = True) -> Iterator[Tuple[str, EntrySource]]:
+    """全量归档：绘本存储中的所有绘本（JSON）、旧版绘本文件以及 static/images 下的全部图片"""
+    for book in get_book_store().iter_books():
+        yield f"books/{book['book_id']}.json", json.dumps(book, ensure_ascii=False).encode("utf-8")
+    if include_legacy and os.path.isdir(LEGACY_BOOKS_DIR):
+        with os.scandir(LEGACY_BOOKS_DIR) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".json"):
+                    yield f"legacy_books/{entry.name}", entry.path
+    for root, _, files in os.walk(IMAGES_DIR):
+        for name in files:
+            if name.startswith("."):
+                continue  # 跳过下载中的临时文件
+            path = os.path.join(root, name)
+            yield os.path.join("images", os.path.relpath(path, IMAGES_DIR)).replace(os.sep, "/"), path
+
+
+if __name__ == '__main__':
+    # 用法：python book_export.py archive --output backup.zip
+    #       python book_export.py book <book_id> --format epub --output book.epub
+    parser = argparse.ArgumentParser(description="绘本导出")
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive_parser = commands.add_parser("archive", help="归档所有绘本和图片")
+    archive_parser.add_argument("--output", required=True, help="输出的 ZIP 文件")
+    archive_parser.add_argument("--no-legacy", action="store_true", help="不包含 static/books 下的旧版 JSON 文件")
+    book_parser = commands.add_parser("book", help="导出单本绘本")
+    book_parser.add_argument("book_id")
+    book_parser.add_argument("--format", choices=EXPORT_FORMATS, default="zip")
+    book_parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        chunks = stream_zip(archive_entries(not args.no_legacy))
+    else:
+        book = get_book_store().get(args.book_id)
+        if book is None:
+            parser.error(f"绘本不存在: {args.book_id}")
+        chunks = export_book(book, args.format)
+
+    started = time.time()
+    written = 0
+    with open(args.output, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+    print(f"导出完成: {args.output}，{written / 1024 / 1024:.1f} MB，耗时 {time.time() - started:.1f}s")
@@ -0,0 +1,430 @@
+import argparse
+import base64
+import json
+import math
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 绘本存储配置
+BOOK_DB_PATH = os.getenv("BOOK_DB_PATH", "data/books.sqlite3")
+BOOK_CACHE_SIZE = int(os.getenv("BOOK_CACHE_SIZE", "256"))  # 进程内缓存的已解析绘本数
+# 旧版本每本绘本一个 JSON 文件的目录，未迁移的绘本仍可从这里读取
+LEGACY_BOOKS_DIR = "static/books"
+MIGRATE_BATCH_SIZE = 500
+MAX_PAGE_SIZE = 100
+
+# 列表支持的排序方式：(排序列, 是否倒序)
+BOOK_SORTS = {
+    "created_desc": ("created_at", True),
+    "created_asc": ("created_at", False),
+    "title": ("title", False)
+}
+# 检索时各字段的权重
+FIELD_WEIGHTS = {"title": 5, "outline": 3, "story": 1}
+# 倒排索引格式版本（PRAGMA user_version），切分规则变化时递增，打开旧库时自动重建索引
+INDEX_VERSION = 2
+
+# 新格式的 book_id：时间戳_随机十六进制
+_TIMESTAMP_ID = re.compile(r'^(\d{9,})_[0-9a-f]+$')
+_BOOK_FILE = re.compile(r'^book_(.+)\.json$')
+
+
+def new_book_id() -> str:
+    """使用时间戳和随机数生成唯一的 book_id"""
+    return f"{int(time.time())}_{secrets.token_hex(4)}"
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+# 中文按连续汉字切分，其余按字母数字单词切分
+_TOKEN_RUN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[0-9a-z]+')
+_CJK = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+
+def tokenize(text: str, unigrams: bool = False) -> List[str]:
+    """把文本切分为检索词：汉字取相邻两字（单字时取单字），英文和数字取整词
+
+    建立索引时 unigrams 为 True，额外收录每个汉字，使单字检索也能命中。
+    """
+    tokens = []
+    for run in _TOKEN_RUN.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        if not _CJK.match(run):
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            if unigrams:
+                tokens.extend(run)
+    return tokens
+
+
+def _encode_cursor(values: List) -> str:
+    return base64.urlsafe_b64encode(_dumps(values).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> List:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("无效的分页游标")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("无效的分页游标")
+    return values
+
+
+class BookStore:
+    """基于 SQLite 的绘本存储，按 id、创建时间和标题建立索引
+
+    场景列表以紧凑 JSON 存储；最近读取的绘本解析结果保存在进程内 LRU 中，写入时失效。
+    读取到的绘本字典会被多个请求共享，调用方不应修改。
+    标题、大纲和故事正文在写入时同步更新倒排索引（book_terms），检索不扫描正文。
+    """
+
+    def __init__(self, path: str = BOOK_DB_PATH, cache_size: int = BOOK_CACHE_SIZE,
+                 legacy_dir: Optional[str] = LEGACY_BOOKS_DIR):
+        self.path = path
+        self.cache_size = max(0, cache_size)
+        self.legacy_dir = legacy_dir
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS books (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                story TEXT NOT NULL,
+                scenes TEXT NOT NULL,
+                extra TEXT NOT NULL,
+                outline TEXT NOT NULL DEFAULT ''
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(books)")}
+        if "outline" not in columns:
+            self._conn.execute("ALTER TABLE books ADD COLUMN outline TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_books_created_at ON books (created_at, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_books_title ON books (title)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_books_title_id ON books (title, id)")
+        # 倒排索引：每个 (检索词, 绘本) 一行，weight 为各字段词频乘以字段权重之和
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS book_terms (
+                term TEXT NOT NULL,
+                book_id TEXT NOT NULL,
+                weight INTEGER NOT NULL,
+                PRIMARY KEY (term, book_id)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_book_terms_book ON book_terms (book_id)")
+        self._conn.commit()
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < INDEX_VERSION:
+            if self._conn.execute("SELECT 1 FROM books LIMIT 1").fetchone():
+                print("检索索引格式已更新，正在重建索引...")
+                self.reindex()
+            self._conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        # 新建的绘本库先导入旧版本的 JSON 绘本，否则列表和检索看不到它们；已存在的 id 会跳过
+        if legacy_dir and os.path.isdir(legacy_dir) and not self._conn.execute("SELECT 1 FROM books LIMIT 1").fetchone():
+            result = self.migrate(legacy_dir)
+            print(f"导入旧版本绘本: {result['imported']} 本，失败 {result['failed']} 本")
+
+    @staticmethod
+    def _row(book_id: str, result: Dict, created_at: float) -> Tuple:
+        extra = {key: value for key, value in result.items()
+                 if key not in ("book_id", "title", "outline", "story", "scenes", "created_at")}
+        return (book_id, result.get("title") or "", created_at, result.get("story") or "",
+                _dumps(result.get("scenes") or []), _dumps(extra), result.get("outline") or "")
+
+    @staticmethod
+    def _book(row) -> Dict:
+        book_id, title, created_at, story, scenes, extra, outline = row
+        return {**json.loads(extra), "book_id": book_id, "title": title, "outline": outline, "story": story,
+                "scenes": json.loads(scenes), "created_at": created_at}
+
+    @staticmethod
+    def _term_rows(book_id: str, title: str, outline: str, story: str) -> List[Tuple]:
+        weights = Counter()
+        for field, text in (("title", title), ("outline", outline), ("story", story)):
+            for term in tokenize(text, unigrams=True):
+                weights[term] += FIELD_WEIGHTS[field]
+        return [(term, book_id, weight) for term, weight in weights.items()]
+
+    def _index(self, rows: List[Tuple]):
+        """重建这些绘本的倒排索引（调用方持有锁并负责提交）"""
+        self._conn.executemany("DELETE FROM book_terms WHERE book_id = ?", [(row[0],) for row in rows])
+        for row in rows:
+            self._conn.executemany(
+                "INSERT INTO book_terms (term, book_id, weight) VALUES (?, ?, ?)",
+                self._term_rows(row[0], row[1], row[6], row[3])
+            )
+
+    def _invalidate(self, book_ids: Iterable[str]):
+        for book_id in book_ids:
+            self._cache.pop(book_id, None)
+
+    def save(self, result: Dict, book_id: Optional[str] = None, created_at: Optional[float] = None) -> str:
+        """保存绘本，返回 book_id"""
+        book_id = book_id or new_book_id()
+        row = self._row(book_id, result, created_at or time.time())
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO books (id, title, created_at, story, scenes, extra, outline) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                row
+            )
+            self._index([row])
+            self._conn.commit()
+            self._invalidate([book_id])
+        return book_id
+
+    def get(self, book_id: str) -> Optional[Dict]:
+        """读取绘本，不存在时返回 None；尚未迁移的旧 JSON 文件会在首次读取时导入"""
+        with self._lock:
+            book = self._cache.get(book_id)
+            if book is not None:
+                self._cache.move_to_end(book_id)
+                self.hits += 1
+                return book
+            self.misses += 1
+            row = self._conn.execute(
+                "SELECT id, title, created_at, story, scenes, extra, outline FROM books WHERE id = ?", (book_id,)
+            ).fetchone()
+        if row is None:
+            if not self._import_legacy(book_id):
+                return None
+            return self.get(book_id)
+
+        book = self._book(row)
+        with self._lock:
+            if self.cache_size:
+                self._cache[book_id] = book
+                self._cache.move_to_end(book_id)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return book
+
+    def _import_legacy(self, book_id: str) -> bool:
+        if not self.legacy_dir or os.sep in book_id or '/' in book_id:
+            return False
+        path = os.path.join(self.legacy_dir, f"book_{book_id}.json")
+        if not os.path.isfile(path):
+            return False
+        book_id, result, created_at = self._read_legacy(path)
+        self.save(result, book_id, created_at)
+        return True
+
+    @staticmethod
+    def _read_legacy(path: str) -> Tuple[str, Dict, float]:
+        book_id = _BOOK_FILE.match(os.path.basename(path)).group(1)
+        with open(path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+        # 新格式的 id 自带创建时间，旧的 hash() 形式使用文件修改时间
+        match = _TIMESTAMP_ID.match(book_id)
+        created_at = float(match.group(1)) if match else os.path.getmtime(path)
+        return book_id, result, created_at
+
+    def migrate(self, directory: str = LEGACY_BOOKS_DIR, batch_size: int = MIGRATE_BATCH_SIZE) -> Dict:
+        """把目录中每本绘本一个的 JSON 文件批量导入，已存在的 id 跳过"""
+        imported = skipped = failed = 0
+        batch = []
+
+        def flush():
+            nonlocal imported, skipped
+            with self._lock:
+                existing = {row[0] for row in self._conn.execute(
+                    f"SELECT id FROM books WHERE id IN ({','.join('?' * len(batch))})", [row[0] for row in batch]
+                )}
+                new_rows = [row for row in batch if row[0] not in existing]
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO books (id, title, created_at, story, scenes, extra, outline) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    new_rows
+                )
+                self._index(new_rows)
+                self._conn.commit()
+                changed = len(new_rows)
+                self._invalidate(row[0] for row in batch)
+            imported += changed
+            skipped += len(batch) - changed
+            batch.clear()
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not _BOOK_FILE.match(entry.name):
+                    continue
+                try:
+                    book_id, result, created_at = self._read_legacy(entry.path)
+                except Exception as e:
+                    print(f"读取绘本文件失败 {entry.name}: {e}")
+                    failed += 1
+                    continue
+                batch.append(self._row(book_id, result, created_at))
+                if len(batch) >= batch_size:
+                    flush()
+        if batch:
+            flush()
+        return {"imported": imported, "skipped": skipped, "failed": failed}
+
+    def iter_ids(self, batch_size: int = MIGRATE_BATCH_SIZE) -> Iterator[str]:
+        """按 id 顺序分批遍历所有绘本 id"""
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id FROM books WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for (book_id,) in rows:
+                yield book_id
+            last_id = rows[-1][0]
+
+    def iter_books(self, batch_size: int = MIGRATE_BATCH_SIZE) -> Iterator[Dict]:
+        """按 id 顺序分批遍历所有绘本，不经过也不填充 LRU 缓存"""
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, title, created_at, story, scenes, extra, outline FROM books "
+                    "WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._book(row)
+            last_id = rows[-1][0]
+
+    def reindex(self, batch_size: int = MIGRATE_BATCH_SIZE) -> int:
+        """重建所有绘本的倒排索引，返回处理的绘本数"""
+        count = 0
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, title, created_at, story, scenes, extra, outline FROM books "
+                    "WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    return count
+                self._index(rows)
+                self._conn.commit()
+            count += len(rows)
+            last_id = rows[-1][0]
+
+    def list_books(self, limit: int = 20, cursor: Optional[str] = None, sort: str = "created_desc") -> Dict:
+        """按游标分页列出绘本摘要；游标编码了上一页最后一条的排序值和 id"""
+        if sort not in BOOK_SORTS:
+            raise ValueError(f"不支持的排序方式: {sort}")
+        column, descending = BOOK_SORTS[sort]
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        op, order = ("<", "DESC") if descending else (">", "ASC")
+        where, params = "", []
+        if cursor:
+            where = f"WHERE ({column}, id) {op} (?, ?)"
+            params = _decode_cursor(cursor)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, title, outline, created_at, json_extract(scenes, '$[0].image_url') FROM books "
+                f"{where} ORDER BY {column} {order}, id {order} LIMIT ?",
+                params + [limit + 1]
+            ).fetchall()
+        books = [self._summary(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = books[-1]
+            next_cursor = _encode_cursor([last[column], last["book_id"]])
+        return {"books": books, "next_cursor": next_cursor}
+
+    @staticmethod
+    def _summary(row) -> Dict:
+        book_id, title, outline, created_at, cover = row
+        return {"book_id": book_id, "title": title, "outline": outline, "created_at": created_at, "cover": cover}
+
+    def search(self, query: str, limit: int = 20, cursor: Optional[str] = None) -> Dict:
+        """检索标题、大纲和故事正文，返回包含全部检索词的绘本，按 TF-IDF 得分排序"""
+        terms = sorted(set(tokenize(query)))
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        offset = int(cursor) if cursor and cursor.isdigit() else 0
+        if cursor and not cursor.isdigit():
+            raise ValueError("无效的分页游标")
+        if not terms:
+            return {"books": [], "next_cursor": None, "total": 0}
+
+        placeholders = ",".join("?" * len(terms))
+        with self._lock:
+            total_books = self._conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+            doc_freq = dict(self._conn.execute(
+                f"SELECT term, COUNT(*) FROM book_terms WHERE term IN ({placeholders}) GROUP BY term", terms
+            ).fetchall())
+            if len(doc_freq) < len(terms):
+                # 有检索词没有出现在任何绘本中
+                return {"books": [], "next_cursor": None, "total": 0}
+            idf = [(term, math.log(1 + total_books / doc_freq[term])) for term in terms]
+            values = ",".join(["(?, ?)"] * len(idf))
+            matched = f"""
+                WITH query(term, idf) AS (VALUES {values})
+                SELECT t.book_id, SUM(t.weight * query.idf) AS score
+                FROM book_terms t JOIN query ON t.term = query.term
+                GROUP BY t.book_id HAVING COUNT(*) = ?
+            """
+            params = [value for pair in idf for value in pair] + [len(terms)]
+            total = self._conn.execute(f"SELECT COUNT(*) FROM ({matched})", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT b.id, b.title, b.outline, b.created_at, json_extract(b.scenes, '$[0].image_url'), m.score "
+                f"FROM ({matched}) m JOIN books b ON b.id = m.book_id "
+                f"ORDER BY m.score DESC, b.created_at DESC, b.id LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        books = [{**self._summary(row[:5]), "score": round(row[5], 4)} for row in rows]
+        next_cursor = str(offset + limit) if offset + limit < total else None
+        return {"books": books, "next_cursor": next_cursor, "total": total}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            books = self._conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+            return {"books": books, "cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+_store: Optional[BookStore] = None
+_store_lock = threading.Lock()
+
+
+def get_book_store() -> BookStore:
+    """获取进程内共享的绘本存储"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BookStore()
+        return _store
+
+
+if __name__ == '__main__':
+    # 用法：python book_store.py migrate [--dir static/books] | reindex
+    parser = argparse.ArgumentParser(description="绘本存储管理")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="导入旧版的 JSON 绘本文件")
+    migrate_parser.add_argument("--dir", default=LEGACY_BOOKS_DIR, help="JSON 文件所在目录")
+    commands.add_parser("reindex", help="重建检索用的倒排索引")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        started = time.time()
+        summary = get_book_store().migrate(args.dir)
+        print(f"迁移完成: 导入 {summary['imported']}，已存在 {summary['skipped']}，"
+              f"失败 {summary['failed']}，耗时 {time.time() - started:.1f}s")
+    elif args.command == "reindex":
+        started = time.time()
+        count = get_book_store().reindex()
+        print(f"索引重建完成: {count} 本，耗时 {time.time() - started:.1f}s")
@@ -0,0 +1,227 @@
+import asyncio
+import atexit
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+DASHSCOPE_BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/api/v1")
+IMAGE_SYNTHESIS_URL = f"{DASHSCOPE_BASE_URL}/services/aigc/text2image/image-synthesis"
+
+# 默认图片生成参数
+IMAGE_MODEL = "wanx2.1-t2i-turbo"
+IMAGE_SIZE = "1024*1024"
+IMAGE_N = 1
+
+# 单个任务的总超时时间（秒）
+IMAGE_TASK_TIMEOUT = float(os.getenv("DASHSCOPE_TASK_TIMEOUT", "180"))
+# 连接池大小与保活时间
+DASHSCOPE_MAX_CONNECTIONS = int(os.getenv("DASHSCOPE_MAX_CONNECTIONS", "32"))
+DASHSCOPE_KEEPALIVE_SECONDS = float(os.getenv("DASHSCOPE_KEEPALIVE_SECONDS", "60"))
+
+# 轮询间隔的上下限（秒）
+MIN_POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 5.0
+POLL_BACKOFF = 1.5
+# 轮询请求连续失败的容忍次数
+MAX_POLL_ERRORS = 5
+
+SUCCEEDED = "SUCCEEDED"
+FAILED_STATES = {"FAILED", "CANCELED", "UNKNOWN"}
+
+
+class ImageGenerationError(Exception):
+    """图片生成任务失败、被取消或超时"""
+
+    def __init__(self, message: str, task_id: Optional[str] = None, status: Optional[str] = None):
+        super().__init__(message)
+        self.task_id = task_id
+        self.status = status
+
+
+async def _json_body(response: aiohttp.ClientResponse) -> Dict:
+    """解析响应中的 JSON 对象；网关返回的 HTML 错误页等非 JSON 响应抛出 ValueError"""
+    try:
+        result = await response.json(content_type=None)
+    except ValueError:
+        result = None
+    if not isinstance(result, dict):
+        text = await response.text(errors="replace")
+        raise ValueError(f"HTTP {response.status} 响应不是 JSON 对象: {text[:200]!r}")
+    return result
+
+
+class DashScopeImageClient:
+    """基于 aiohttp 的通义万相异步客户端，复用同一个保活连接池"""
+
+    def __init__(self, timeout: float = IMAGE_TASK_TIMEOUT):
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        # 任务耗时的指数滑动平均，用于估计首次轮询时间
+        self._avg_duration = 8.0
+        self._duration_lock = threading.Lock()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=DASHSCOPE_MAX_CONNECTIONS,
+                keepalive_timeout=DASHSCOPE_KEEPALIVE_SECONDS
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
+
+    def _record_duration(self, duration: float):
+        with self._duration_lock:
+            self._avg_duration = 0.7 * self._avg_duration + 0.3 * duration
+
+    @property
+    def expected_duration(self) -> float:
+        return self._avg_duration
+
+    async def submit_task(self, api_key: str, prompt: str, negative_prompt: str,
+                          model: str = IMAGE_MODEL, size: str = IMAGE_SIZE, n: int = IMAGE_N) -> str:
+        """提交异步生成任务，返回 task_id"""
+        session = await self._get_session()
+        headers = {
+            "X-DashScope-Async": "enable",
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        data = {
+            "model": model,
+            "input": {
+                "prompt": prompt,
+                "negative_prompt": negative_prompt
+            },
+            "parameters": {
+                "size": size,
+                "n": n
+            }
+        }
+        async with session.post(IMAGE_SYNTHESIS_URL, headers=headers, json=data) as response:
+            try:
+                result = await _json_body(response)
+            except ValueError as e:
+                raise ImageGenerationError(f"提交图片任务失败: {e}") from e
+            task_id = result.get("output", {}).get("task_id")
+            if response.status >= 400 or not task_id:
+                raise ImageGenerationError(
+                    f"提交图片任务失败: HTTP {response.status}, {result.get('code')}: {result.get('message')}"
+                )
+            return task_id
+
+    async def wait_for_task(self, api_key: str, task_id: str, started_at: float) -> List[Dict]:
+        """按自适应间隔轮询任务状态，直到成功、失败或超时"""
+        session = await self._get_session()
+        headers = {"Authorization": f"Bearer {api_key}"}
+        deadline = started_at + self.timeout
+
+        # 首次轮询推迟到预计完成时间附近，之后按指数退避
+        delay = max(MIN_POLL_INTERVAL, self.expected_duration * 0.6)
+        interval = MIN_POLL_INTERVAL
+        poll_errors = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ImageGenerationError(f"图片任务超时 ({self.timeout:.0f}s)", task_id, "TIMEOUT")
+            await asyncio.sleep(min(delay, remaining))
+
+            try:
+                async with session.get(f"{DASHSCOPE_BASE_URL}/tasks/{task_id}", headers=headers) as response:
+                    result = await _json_body(response)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                # 网络错误和网关错误页按暂时性失败重试
+                poll_errors += 1
+                print(f"查询图片任务状态失败({poll_errors}/{MAX_POLL_ERRORS}): {e}")
+                if poll_errors >= MAX_POLL_ERRORS:
+                    raise ImageGenerationError(f"查询图片任务状态失败: {e}", task_id) from e
+                delay = interval
+                interval = min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+                continue
+
+            poll_errors = 0
+            output = result.get("output", {})
+            status = output.get("task_status")
+            if status == SUCCEEDED:
+                self._record_duration(time.monotonic() - started_at)
+                return output.get("results", [])
+            if status in FAILED_STATES:
+                raise ImageGenerationError(
+                    f"图片任务状态 {status}: {output.get('code')}: {output.get('message')}",
+                    task_id, status
+                )
+
+            delay = interval
+            interval = min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+
+    async def generate_image(self, api_key: str, prompt: str, negative_prompt: str,
+                             model: str = IMAGE_MODEL, size: str = IMAGE_SIZE, n: int = IMAGE_N) -> str:
+        """生成一张图片，返回远程图片 URL"""
+        started_at = time.monotonic()
+        task_id = await self.submit_task(api_key, prompt, negative_prompt, model, size, n)
+        results = await self.wait_for_task(api_key, task_id, started_at)
+        url = results[0].get("url", "") if results else ""
+        if not url:
+            raise ImageGenerationError("图片任务成功但没有返回图片地址", task_id, SUCCEEDED)
+        return url
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+# 进程内共享的事件循环线程与客户端
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[DashScopeImageClient] = None
+_init_lock = threading.Lock()
+
+
+def _ensure_client():
+    global _loop, _client
+    with _init_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="dashscope-loop", daemon=True)
+            thread.start()
+            _client = DashScopeImageClient()
+            atexit.register(_shutdown)
+    return _loop, _client
+
+
+def _shutdown():
+    """进程退出时关闭连接池"""
+    if _loop is None or not _loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_client.close(), _loop).result(timeout=5)
+    except Exception as e:
+        print(f"关闭图片客户端失败: {e}")
+
+
+def get_image_client() -> DashScopeImageClient:
+    """获取进程内共享的图片客户端"""
+    return _ensure_client()[1]
+
+
+def generate_image_sync(api_key: str, prompt: str, negative_prompt: str, **params) -> str:
+    """同步调用入口，在共享事件循环上执行并阻塞等待结果"""
+    loop, client = _ensure_client()
+    future = asyncio.run_coroutine_threadsafe(
+        client.generate_image(api_key, prompt, negative_prompt, **params), loop
+    )
+    return future.result()
+
+
+async def generate_image_async(api_key: str, prompt: str, negative_prompt: str, **params) -> str:
+    """异步调用入口，可在任意事件循环中 await"""
+    loop, client = _ensure_client()
+    future = asyncio.run_coroutine_threadsafe(
+        client.generate_image(api_key, prompt, negative_prompt, **params), loop
+    )
+    return await asyncio.wrap_future(future)
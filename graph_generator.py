@@ -1,7 +1,9 @@
-from typing import Dict, List, Annotated, TypedDict, Generator
+from typing import Dict, List, Annotated, TypedDict, Generator, Optional
 from langchain_core.messages import HumanMessage
+from langchain_core.utils.json import parse_partial_json
 from langgraph.graph import Graph, StateGraph
-from langchain_openai import ChatOpenAI
+from llm_pool import get_llm
+from llm_cache import get_llm_cache, replay_chunks
 from flask import Response
 import json
 import os
@@ -9,7 +11,21 @@ import requests
 from urllib.parse import urlparse
 from pathlib import Path
 from langgraph.types import Command, interrupt
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.config import get_stream_writer
+from langchain_core.runnables import RunnableConfig
 import re
+import time
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from image_scheduler import get_image_scheduler, ImageJob
+from image_cache import get_image_cache, make_image_key
+from dashscope_client import IMAGE_MODEL, IMAGE_SIZE, IMAGE_N
+from image_variants import existing_variants, submit_variants
+from stream_parsers import SceneStreamParser, StreamFormatError, StoryFeatureParser, UpdateCoalescer
+from story_schema import STORY_TOOL, STORY_TOOL_NAME, build_structured_prompt, format_character_features, validate_storybook
 
 # 定义状态类型
 class StoryState(TypedDict):
@@ -23,41 +39,219 @@ class StoryState(TypedDict):
     regenerate: bool  # 新增重新生成标志
     character_features: str  # 新增人物特征
     character_name: str  # 新增人物名称
+    planned_scenes: List[Dict]  # 结构化输出模式下随故事一起生成的场景
+    review_round: int  # 中断审核模式下已进行的审核轮数
 
 # 添加图片存储目录配置
 IMAGES_DIR = "static/images"
 os.makedirs(IMAGES_DIR, exist_ok=True)
+# 图片生成失败时使用的占位图
+ERROR_IMAGE_URL = "/static/images/error_image.svg"
+
+# 每本绘本同时生成图片的场景数
+IMAGE_PARALLELISM = int(os.getenv("IMAGE_PARALLELISM", "3"))
+# 未指定会话时提交到调度器使用的会话标识
+DEFAULT_IMAGE_SESSION = "default"
+# 推送排队状态的最小间隔（秒）
+QUEUE_STATUS_INTERVAL = 1.0
+# 生成最终结果前等待派生图的最长时间（秒），只影响最后完成的几张图：
+# 超时的场景先使用原图，派生图仍在后台写入，之后命中同一张图时直接使用
+VARIANT_WAIT_TIMEOUT = float(os.getenv("IMAGE_VARIANT_WAIT_TIMEOUT", "2"))
+# 审核期间的预执行模式：off 关闭，scenes 预先分场景，images 同时预生成图片
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "off")
+# 故事流式更新的合并窗口：间隔（秒）或新增字符数，满足其一即推送
+STORY_UPDATE_INTERVAL = float(os.getenv("STORY_UPDATE_INTERVAL_MS", "50")) / 1000
+STORY_UPDATE_MIN_CHARS = int(os.getenv("STORY_UPDATE_MIN_CHARS", "64"))
+# 是否流式分割场景，让第一张图片尽早开始生成
+STREAMING_SPLIT = os.getenv("STREAMING_SPLIT", "true").lower() == "true"
+# 是否用一次结构化输出调用同时生成故事、角色特征和场景，失败时回退到多次调用
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "false").lower() == "true"
+# 审核方式：queue 阻塞等待审核队列，interrupt 在审核点中断、由 /review 从检查点恢复
+REVIEW_MODE = os.getenv("REVIEW_MODE", "queue")
+# 中断后等待审核的最长时间（秒），超时的检查点会被清理
+REVIEW_THREAD_TTL = float(os.getenv("REVIEW_THREAD_TTL", "1800"))
+
+# 图片下载配置
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_MAX_RETRIES = 3
+IMAGE_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp"
+}
+
+# 复用连接的下载会话
+_download_session = requests.Session()
+
+def _expected_length(response: requests.Response, offset: int) -> Optional[int]:
+    """从响应头推算完整文件大小，未知时返回 None"""
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    content_length = response.headers.get('Content-Length')
+    return offset + int(content_length) if content_length and content_length.isdigit() else None
 
 def download_image(url: str, save_dir: str) -> str:
-    """下载图片并返回本地路径"""
+    """流式下载图片，按内容哈希命名并原子写入，返回本地路径"""
+    os.makedirs(save_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=save_dir, prefix=".download-", suffix=".part")
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        # 从URL生成文件名
-        filename = f"{hash(url)}.png"
+        hasher = hashlib.sha256()
+        received = 0
+        content_type = ""
+        with os.fdopen(fd, 'wb') as f:
+            attempt = 0
+            while True:
+                attempt += 1
+                # 已收到部分数据时通过 Range 断点续传
+                headers = {"Range": f"bytes={received}-"} if received else {}
+                try:
+                    with _download_session.get(url, headers=headers, stream=True, timeout=(5, 30)) as response:
+                        if received and response.status_code != 206:
+                            # 服务端不支持续传，丢弃已下载部分重新开始
+                            f.seek(0)
+                            f.truncate()
+                            hasher = hashlib.sha256()
+                            received = 0
+                            if response.status_code == 416:
+                                raise IOError("断点续传范围无效")
+                        response.raise_for_status()
+                        content_type = response.headers.get('Content-Type', content_type).split(';')[0].strip()
+                        expected = _expected_length(response, received)
+
+                        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                            hasher.update(chunk)
+                            received += len(chunk)
+
+                    if expected is not None and received < expected:
+                        raise IOError(f"下载不完整: {received}/{expected} 字节")
+                    break
+                except (requests.RequestException, IOError) as e:
+                    if attempt >= DOWNLOAD_MAX_RETRIES:
+                        raise
+                    print(f"下载图片出错，重试({attempt}/{DOWNLOAD_MAX_RETRIES}): {e}")
+                    time.sleep(0.5 * attempt)
+
+        # 按内容哈希命名，相同内容只保留一份
+        extension = IMAGE_EXTENSIONS.get(content_type, ".png")
+        filename = f"{hasher.hexdigest()[:32]}{extension}"
         local_path = os.path.join(save_dir, filename)
-        
-        # 保存图片
-        with open(local_path, 'wb') as f:
-            f.write(response.content)
-        
+        if os.path.exists(local_path):
+            os.remove(tmp_path)
+            # 刷新修改时间，避免图片回收把刚被复用的旧文件当作过期文件删除
+            os.utime(local_path)
+        else:
+            os.replace(tmp_path, local_path)
+
         # 返回相对路径（用于Web访问）
         return f"/static/images/{filename}"
     except Exception as e:
         print(f"下载图片失败: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         return url  # 如果下载失败，返回原始URL
 
-# 故事生成节点
-def generate_story_and_features(state: StoryState) -> Generator[StoryState, None, None]:
-    llm = ChatOpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL"),
-        model="gpt-3.5-turbo",
-        streaming=True
-    )
+def cached_llm_response(llm, prompt: str, use_cache: bool = True) -> Optional[str]:
+    """查询 LLM 响应缓存，未启用或绕过缓存时返回 None"""
+    cache = get_llm_cache()
+    if cache is None or not use_cache:
+        return None
+    return cache.get(llm.model_name, llm.temperature, prompt)
+
+def store_llm_response(llm, prompt: str, response: str):
+    """写入 LLM 响应缓存"""
+    cache = get_llm_cache()
+    if cache is not None and response:
+        cache.put(llm.model_name, llm.temperature, prompt, response)
+
+def stream_structured_args(llm, prompt: str) -> Generator[str, None, None]:
+    """以强制工具调用的方式流式请求，逐块产出工具参数的 JSON 文本"""
+    tool_llm = llm.bind_tools([STORY_TOOL], tool_choice=STORY_TOOL_NAME)
+    for chunk in tool_llm.stream([HumanMessage(content=prompt)]):
+        for tool_chunk in chunk.tool_call_chunks:
+            if tool_chunk.get("index") in (0, None) and tool_chunk.get("args"):
+                yield tool_chunk["args"]
+
+def apply_structured_result(state: StoryState, content: str):
+    """解析完整的工具参数并写入状态，格式不完整时抛出 StreamFormatError"""
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise StreamFormatError(f"结构化输出无法解析: {e}") from e
+    problems = validate_storybook(data) if isinstance(data, dict) else ["结果不是对象"]
+    if problems:
+        raise StreamFormatError("结构化输出不完整: " + "，".join(problems))
     
-    prompt = f"""
+    state['story'] = data['story'].strip()
+    state['character_features'] = format_character_features(data['character'])
+    state['character_name'] = data['character']['name'].strip()
+    state['planned_scenes'] = [scene_from_data(scene_data) for scene_data in data['scenes']]
+
+def generate_story_structured(state: StoryState, use_cache: bool = True) -> Generator[Dict, None, None]:
+    """结构化输出模式：一次调用同时得到故事、角色特征和各场景的图像提示词"""
+    llm = get_llm(streaming=state['streaming'])
+    prompt = build_structured_prompt(state['outline'])
+    state['story'] = ""
+    state['planned_scenes'] = []
+    
+    cached_response = cached_llm_response(llm, prompt, use_cache and not state.get('regenerate', False))
+    
+    if state['streaming']:
+        if cached_response is not None:
+            print("结构化故事命中 LLM 响应缓存")
+            args_chunks = replay_chunks(cached_response)
+        else:
+            args_chunks = stream_structured_args(llm, prompt)
+        
+        # 按合并窗口对已收到的参数做一次宽松解析，取出目前为止的故事正文
+        coalescer = UpdateCoalescer(STORY_UPDATE_INTERVAL, STORY_UPDATE_MIN_CHARS)
+        collected_chunks = []
+        received = 0
+        for args_chunk in args_chunks:
+            collected_chunks.append(args_chunk)
+            received += len(args_chunk)
+            if not coalescer.ready(received):
+                continue
+            partial = parse_partial_json("".join(collected_chunks))
+            story = partial.get("story") if isinstance(partial, dict) else None
+            if isinstance(story, str) and story.strip() and story.strip() != state['story']:
+                state['story'] = story.strip()
+                yield {
+                    "type": "story_update",
+                    "content": state['story'],
+                    "completed": False
+                }
+        content = "".join(collected_chunks)
+    elif cached_response is not None:
+        content = cached_response
+    else:
+        response = llm.bind_tools([STORY_TOOL], tool_choice=STORY_TOOL_NAME).invoke([HumanMessage(content=prompt)])
+        if not response.tool_calls:
+            raise StreamFormatError("模型没有调用结构化输出工具")
+        content = json.dumps(response.tool_calls[0]["args"], ensure_ascii=False)
+    
+    apply_structured_result(state, content)
+    if cached_response is None:
+        store_llm_response(llm, prompt, content)
+    print(f"结构化输出完成: {state['character_name']}, {len(state['planned_scenes'])} 个场景")
+    
+    if state['streaming']:
+        yield {
+            "type": "story_update",
+            "content": state['story'],
+            "completed": True
+        }
+    else:
+        yield state
+
+# 角色特征缺失时使用的默认描述
+DEFAULT_CHARACTER_FEATURES = "主要人物：主角\n- 基础外观：小动物，可爱，幼年\n- 颜色特征：彩色\n- 服装配饰：简单服装\n- 表情姿态：微笑，活泼"
+
+def build_story_prompt(state: StoryState) -> str:
+    """构建故事与角色特征的生成提示词"""
+    return f"""
     你是一个专业的儿童绘本创作者。请根据以下大纲同时完成两项任务:
     
     任务1: 创作一个适合儿童的故事，要求：
@@ -80,75 +274,109 @@ def generate_story_and_features(state: StoryState) -> Generator[StoryState, None
     
     请先提供故事内容，然后在故事后面添加角色特征部分。
     """
+
+def build_feature_prompt(story: str) -> str:
+    """构建补充提取角色特征的提示词"""
+    return f"""
+    基于以下故事内容，提供主要角色的详细特征描述:
+    
+    故事内容:
+    {story}
+    
+    请按以下格式描述主要角色:
+    主要人物：[人物名称]
+    - 基础外观：[物种]，[体型]，[年龄特征]
+    - 颜色特征：[主体颜色]，[局部颜色]，[花纹特征]
+    - 服装配饰：[服装类型]，[配饰细节]，[服装风格]
+    - 表情姿态：[表情特征]，[姿态特点]，[动作特征]
+    """
+
+def apply_parsed_features(state: StoryState, parser: StoryFeatureParser) -> bool:
+    """写入解析出的故事与角色特征，返回输出中是否包含特征部分"""
+    state['story'] = parser.story
+    if parser.has_features:
+        state['character_features'] = parser.character_features
+        state['character_name'] = parser.character_name
+    return parser.has_features
+
+def apply_feature_response(state: StoryState, content: str):
+    """写入补充调用得到的角色特征并提取人物名称"""
+    state['character_features'] = content.strip()
+    name_match = re.search(r'主要人物：([^\n]+)', state['character_features'])
+    state['character_name'] = name_match.group(1).strip() if name_match else "主角"
+
+def apply_default_features(state: StoryState):
+    """角色特征缺失时使用默认描述"""
+    state['character_features'] = DEFAULT_CHARACTER_FEATURES
+    state['character_name'] = "主角"
+
+# 故事生成节点
+def generate_story_and_features(state: StoryState, use_cache: bool = True) -> Generator[StoryState, None, None]:
+    if STRUCTURED_OUTPUT:
+        try:
+            yield from generate_story_structured(state, use_cache)
+            return
+        except Exception as e:
+            print(f"结构化输出失败，回退到多次调用: {e}")
+    state['planned_scenes'] = []
+    
+    llm = get_llm(streaming=True)
+    
+    prompt = build_story_prompt(state)
     
     state['story'] = ""
     collected_content = ""
     
+    # 重新生成时必须绕过缓存
+    cached_response = cached_llm_response(llm, prompt, use_cache and not state.get('regenerate', False))
+    
     if state['streaming']:
-        for chunk in llm.stream([HumanMessage(content=prompt)]):
-            content_chunk = chunk.content
-            collected_content += content_chunk
-            
-            # 分离故事和特征
-            parts = collected_content.split('---角色特征---', 1)
-            state['story'] = parts[0].strip()
-            
-            # 提取特征部分(如果已生成)
-            if len(parts) > 1:
-                state['character_features'] = parts[1].strip()
-                # 提取人物名称
-                name_match = re.search(r'主要人物：([^\n]+)', state['character_features'])
-                if name_match:
-                    state['character_name'] = name_match.group(1).strip()
-                else:
-                    state['character_name'] = "主角"
+        if cached_response is not None:
+            # 命中缓存时按小块回放，前端收到的事件与实时生成一致
+            print("故事命中 LLM 响应缓存")
+            content_chunks = replay_chunks(cached_response)
+        else:
+            content_chunks = (chunk.content for chunk in llm.stream([HumanMessage(content=prompt)]))
+        
+        # 增量分离故事和特征，并按时间窗口合并界面更新
+        parser = StoryFeatureParser()
+        coalescer = UpdateCoalescer(STORY_UPDATE_INTERVAL, STORY_UPDATE_MIN_CHARS)
+        collected_chunks = []
+        for content_chunk in content_chunks:
+            collected_chunks.append(content_chunk)
+            parser.feed(content_chunk)
             
-            yield {
-                "type": "story_update",
-                "content": state['story'],
-                "completed": False
-            }
+            if coalescer.ready(parser.story_length):
+                state['story'] = parser.story
+                yield {
+                    "type": "story_update",
+                    "content": state['story'],
+                    "completed": False
+                }
+        
+        # 流结束后一次性解析特征部分
+        parser.finish()
+        has_features = apply_parsed_features(state, parser)
+        
+        collected_content = "".join(collected_chunks)
+        if cached_response is None:
+            store_llm_response(llm, prompt, collected_content)
         
         # 确保角色特征已提取
-        if '---角色特征---' not in collected_content:
+        if not has_features:
             # 如果没有找到分隔符，尝试使用补充调用获取角色特征
             try:
-                feature_llm = ChatOpenAI(
-                    api_key=os.getenv("OPENAI_API_KEY"),
-                    base_url=os.getenv("OPENAI_BASE_URL"),
-                    model="gpt-3.5-turbo",
-                    streaming=False
-                )
+                feature_llm = get_llm(streaming=False)
                 
-                feature_prompt = f"""
-                基于以下故事内容，提供主要角色的详细特征描述:
-                
-                故事内容:
-                {state['story']}
-                
-                请按以下格式描述主要角色:
-                主要人物：[人物名称]
-                - 基础外观：[物种]，[体型]，[年龄特征]
-                - 颜色特征：[主体颜色]，[局部颜色]，[花纹特征]
-                - 服装配饰：[服装类型]，[配饰细节]，[服装风格]
-                - 表情姿态：[表情特征]，[姿态特点]，[动作特征]
-                """
+                feature_prompt = build_feature_prompt(state['story'])
                 
                 feature_response = feature_llm.invoke([HumanMessage(content=feature_prompt)])
-                state['character_features'] = feature_response.content.strip()
-                
-                # 提取人物名称
-                name_match = re.search(r'主要人物：([^\n]+)', state['character_features'])
-                if name_match:
-                    state['character_name'] = name_match.group(1).strip()
-                else:
-                    state['character_name'] = "主角"
+                apply_feature_response(state, feature_response.content)
                 
                 print(f"补充提取的人物特征: {state['character_features']}")
             except Exception as e:
                 print(f"补充提取人物特征时出错: {e}")
-                state['character_features'] = "主要人物：主角\n- 基础外观：小动物，可爱，幼年\n- 颜色特征：彩色\n- 服装配饰：简单服装\n- 表情姿态：微笑，活泼"
-                state['character_name'] = "主角"
+                apply_default_features(state)
         
         # 最后一次更新，标记完成
         yield {
@@ -157,48 +385,30 @@ def generate_story_and_features(state: StoryState) -> Generator[StoryState, None
             "completed": True
         }
     else:
-        response = llm.invoke([HumanMessage(content=prompt)])
-        collected_content = response.content
+        if cached_response is not None:
+            collected_content = cached_response
+        else:
+            collected_content = llm.invoke([HumanMessage(content=prompt)]).content
+            store_llm_response(llm, prompt, collected_content)
         
         # 分离故事和特征
-        parts = collected_content.split('---角色特征---', 1)
-        state['story'] = parts[0].strip()
+        parser = StoryFeatureParser()
+        parser.feed(collected_content)
+        parser.finish()
         
-        # 提取特征部分(如果已生成)
-        if len(parts) > 1:
-            state['character_features'] = parts[1].strip()
-            # 提取人物名称
-            name_match = re.search(r'主要人物：([^\n]+)', state['character_features'])
-            if name_match:
-                state['character_name'] = name_match.group(1).strip()
-            else:
-                state['character_name'] = "主角"
-        else:
-            # 如果没有找到分隔符，设置默认特征
-            state['character_features'] = "主要人物：主角\n- 基础外观：小动物，可爱，幼年\n- 颜色特征：彩色\n- 服装配饰：简单服装\n- 表情姿态：微笑，活泼"
-            state['character_name'] = "主角"
+        # 提取特征部分(如果已生成)，没有找到分隔符时设置默认特征
+        if not apply_parsed_features(state, parser):
+            apply_default_features(state)
             
         yield state
 
-# 场景分割节点
-def split_scenes(state: StoryState) -> StoryState:
-    # 清理现有场景列表，确保重新生成时不会累加
-    state['scenes'] = []
-    
-    # 使用单次LLM调用，同时进行场景分割与角色/特征分析
-    llm = ChatOpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL"),
-        model="gpt-3.5-turbo",
-        streaming=False
-    )
-    
+def build_split_prompt(state: StoryState) -> str:
+    """构建场景分割提示词"""
     # 获取已存在的角色特征
     character_features = state.get('character_features', '')
-    character_name = state.get('character_name', '主角')
     
     # 构建更高效的提示词，同时完成多个任务
-    prompt = f"""
+    return f"""
     分析以下儿童故事，并完成这些任务:
     1. 将故事分成3个关键场景（如果场景不足3个，请合理划分）
     2. 为每个场景提取关键角色
@@ -233,13 +443,58 @@ def split_scenes(state: StoryState) -> StoryState:
     - 提示词应该足够详细，便于图像生成
     - 使用英文描述
     """
+
+def scene_from_data(scene_data: Dict) -> Dict:
+    """把模型返回的场景数据转换为内部场景结构"""
+    return {
+        "text": scene_data.get("text", ""),
+        "prompt": scene_data.get("image_prompt", "童话风格的插图，可爱温馨"),
+        "negative_prompt": "人物，黑暗，恐怖，写实风格，与主要人物特征不符的任何形象，低质量，模糊，变形"
+    }
+
+def fallback_scenes(story: str) -> List[Dict]:
+    """使用简单的段落分割作为备选方案"""
+    paragraphs = [p.strip() for p in story.split('\n\n') if p.strip()]
+    
+    # 确保至少有一个场景
+    if not paragraphs:
+        paragraphs = [story]
+        
+    return [
+        {
+            "text": paragraph,
+            "prompt": f"童话风格的插图，可爱温馨，{paragraph}",
+            "negative_prompt": "人物，黑暗，恐怖，写实风格，低质量，模糊，变形"
+        }
+        for paragraph in paragraphs
+    ]
+
+# 场景分割节点
+def split_scenes(state: StoryState, use_cache: bool = True) -> StoryState:
+    # 清理现有场景列表，确保重新生成时不会累加
+    state['scenes'] = []
+    
+    # 结构化输出已给出场景时无需再次调用
+    if state.get('planned_scenes'):
+        state['scenes'] = [dict(scene) for scene in state['planned_scenes']]
+        print(f"使用结构化输出的 {len(state['scenes'])} 个场景")
+        state['current_scene_index'] = 0
+        state['completed'] = False
+        return state
+    
+    # 使用单次LLM调用，同时进行场景分割与角色/特征分析
+    llm = get_llm(streaming=False)
+    prompt = build_split_prompt(state)
     
     try:
-        response = llm.invoke([HumanMessage(content=prompt)])
-        content = response.content.strip()
+        cached_response = cached_llm_response(llm, prompt, use_cache)
+        if cached_response is not None:
+            print("场景分割命中 LLM 响应缓存")
+            content = cached_response
+        else:
+            content = llm.invoke([HumanMessage(content=prompt)]).content.strip()
         
         # 提取JSON部分
-        import re
         json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
         if json_match:
             json_str = json_match.group(1)
@@ -247,17 +502,15 @@ def split_scenes(state: StoryState) -> StoryState:
             # 尝试直接解析整个内容
             json_str = content
             
-        import json
         result = json.loads(json_str)
         
         # 更新场景列表
         for scene_data in result.get("scenes", []):
-            scene = {
-                "text": scene_data.get("text", ""),
-                "prompt": scene_data.get("image_prompt", "童话风格的插图，可爱温馨"),
-                "negative_prompt": "人物，黑暗，恐怖，写实风格，与主要人物特征不符的任何形象，低质量，模糊，变形"
-            }
-            state['scenes'].append(scene)
+            state['scenes'].append(scene_from_data(scene_data))
+        
+        # 只缓存能正确解析的响应
+        if cached_response is None and state['scenes']:
+            store_llm_response(llm, prompt, content)
         
         print(f"一次性分析完成，共 {len(state['scenes'])} 个场景")
         print(f"场景列表: {state['scenes']}")
@@ -265,20 +518,7 @@ def split_scenes(state: StoryState) -> StoryState:
     except Exception as e:
         print(f"场景分析出错: {e}")
         # 出错时使用简单的段落分割作为备选方案
-        paragraphs = [p.strip() for p in state['story'].split('\n\n') if p.strip()]
-        
-        # 确保至少有一个场景
-        if not paragraphs:
-            paragraphs = [state['story']]
-            
-        for paragraph in paragraphs:
-            scene = {
-                "text": paragraph,
-                "prompt": f"童话风格的插图，可爱温馨，{paragraph}",
-                "negative_prompt": "人物，黑暗，恐怖，写实风格，低质量，模糊，变形"
-            }
-            state['scenes'].append(scene)
-            
+        state['scenes'] = fallback_scenes(state['story'])
         print(f"备选方案：分割场景完成，共 {len(state['scenes'])} 个场景")
     
     # 重置场景索引和完成状态
@@ -287,11 +527,63 @@ def split_scenes(state: StoryState) -> StoryState:
     
     return state
 
-# 图片生成节点
-def generate_images(state: StoryState) -> StoryState:
-    from storybook_generator import StorybookGenerator
-    generator = StorybookGenerator()
+def split_scenes_streaming(state: StoryState, use_cache: bool = True) -> Generator[Dict, None, None]:
+    """流式分割场景，每解析出一个完整场景就立即产出
+
+    若在产出任何场景之前输出格式出错，回退到段落分割；已产出的场景不会撤回，
+    此时保留已解析出的部分。
+    """
+    state['scenes'] = []
+    state['current_scene_index'] = 0
+    state['completed'] = False
+    
+    if state.get('planned_scenes'):
+        print(f"使用结构化输出的 {len(state['planned_scenes'])} 个场景")
+        for planned_scene in state['planned_scenes']:
+            scene = dict(planned_scene)
+            state['scenes'].append(scene)
+            yield scene
+        return
     
+    llm = get_llm(streaming=True)
+    prompt = build_split_prompt(state)
+    parser = SceneStreamParser()
+    cached_response = cached_llm_response(llm, prompt, use_cache)
+    if cached_response is not None:
+        print("场景分割命中 LLM 响应缓存")
+        content_chunks = replay_chunks(cached_response)
+    else:
+        content_chunks = (chunk.content for chunk in llm.stream([HumanMessage(content=prompt)]))
+    collected_content = ""
+    
+    try:
+        for content_chunk in content_chunks:
+            collected_content += content_chunk
+            for scene_data in parser.feed(content_chunk):
+                scene = scene_from_data(scene_data)
+                state['scenes'].append(scene)
+                print(f"流式解析出第 {len(state['scenes'])} 个场景")
+                yield scene
+            if parser.done:
+                break
+        if not state['scenes']:
+            raise StreamFormatError("输出中没有解析到场景")
+        print(f"流式分析完成，共 {len(state['scenes'])} 个场景")
+        # 只缓存完整解析的响应
+        if cached_response is None and parser.done:
+            store_llm_response(llm, prompt, collected_content)
+    except Exception as e:
+        print(f"流式场景分析出错: {e}")
+        if state['scenes']:
+            print(f"保留已解析的 {len(state['scenes'])} 个场景")
+            return
+        for scene in fallback_scenes(state['story']):
+            state['scenes'].append(scene)
+            yield scene
+        print(f"备选方案：分割场景完成，共 {len(state['scenes'])} 个场景")
+
+# 图片生成节点
+def generate_images(state: StoryState, config: RunnableConfig) -> StoryState:
     # 检查索引是否有效
     if state['current_scene_index'] >= len(state['scenes']):
         print(f"警告: 场景索引 {state['current_scene_index']} 超出范围，共 {len(state['scenes'])} 个场景")
@@ -301,12 +593,13 @@ def generate_images(state: StoryState) -> StoryState:
     scene = state['scenes'][state['current_scene_index']]
     print(f"生成第 {state['current_scene_index'] + 1}/{len(state['scenes'])} 张图片")
     
-    # 直接使用预先生成的提示词
-    image_url = generator.generate_image(scene['prompt'], scene['negative_prompt'])
-    
-    # 下载并保存图片
-    local_image_path = download_image(image_url, IMAGES_DIR)
-    scene['image_url'] = local_image_path  # 使用本地路径替换远程URL
+    # 直接使用预先生成的提示词，通过全局调度器按调用方的会话生成并保存图片
+    session_id = config.get("configurable", {}).get("image_session", DEFAULT_IMAGE_SESSION)
+    job = get_image_scheduler().submit(session_id, render_scene_image, scene)
+    try:
+        scene['image_url'] = job.result()  # 使用本地路径替换远程URL
+    except Exception as e:
+        mark_image_failed(scene, state['current_scene_index'], e)
     
     # 更新索引
     state['current_scene_index'] += 1
@@ -322,6 +615,272 @@ def generate_images(state: StoryState) -> StoryState:
     print('state====场景信息：',scene['image_url'])
     return state
 
+def scene_image_key(scene: Dict) -> str:
+    """场景图片的缓存键"""
+    return make_image_key(IMAGE_MODEL, scene['prompt'], scene['negative_prompt'], IMAGE_SIZE, IMAGE_N)
+
+def cached_scene_image(scene: Dict) -> Optional[str]:
+    """查询图片缓存，命中时返回本地路径"""
+    cache = get_image_cache()
+    return cache.get(scene_image_key(scene)) if cache else None
+
+def render_scene_image(scene: Dict, check_cache: bool = True) -> str:
+    """为单个场景生成图片并保存到本地，返回本地路径"""
+    if check_cache:
+        cached_path = cached_scene_image(scene)
+        if cached_path:
+            return cached_path
+
+    from storybook_generator import StorybookGenerator
+    generator = StorybookGenerator()
+    image_url = generator.generate_image(scene['prompt'], scene['negative_prompt'])
+    local_image_path = download_image(image_url, IMAGES_DIR)
+
+    # 只缓存成功保存到本地的图片
+    cache = get_image_cache()
+    if cache and local_image_path.startswith('/static/'):
+        cache.put(scene_image_key(scene), local_image_path)
+    return local_image_path
+
+def mark_image_failed(scene: Dict, scene_index: int, error: Exception):
+    """单个场景图片生成失败时改用占位图，不影响其他场景"""
+    print(f"场景 {scene_index + 1} 图片生成失败: {error}")
+    scene['image_url'] = ERROR_IMAGE_URL
+    scene['image_error'] = str(error)
+
+def start_scene_variants(scene: Dict) -> Optional[Future]:
+    """为已保存的场景图片启动派生图任务，已存在时直接记录到场景"""
+    try:
+        variants = existing_variants(scene['image_url'])
+        if variants:
+            scene['image_variants'] = variants
+            return None
+        return submit_variants(scene['image_url'])
+    except Exception as e:
+        print(f"提交派生图任务失败: {e}")
+        return None
+
+def collect_scene_variants(variant_futures: Dict[Future, Dict], timeout: float = VARIANT_WAIT_TIMEOUT):
+    """在限定时间内收集派生图结果，未完成的不阻塞后续流程"""
+    if not variant_futures:
+        return
+    done, not_done = wait(variant_futures, timeout=timeout)
+    for future in done:
+        try:
+            variant_futures[future]['image_variants'] = future.result()
+        except Exception as e:
+            print(f"生成派生图失败: {e}")
+    if not_done:
+        print(f"{len(not_done)} 个场景的派生图未在 {timeout}s 内完成，先使用原图")
+
+class SceneImageProgress:
+    """图片阶段的逐场景进度：缓存命中、结果写回、派生图跟踪和 image_update 事件
+
+    同步与异步工作流共用；其中读缓存和派生图的方法会访问磁盘，异步模式在线程中调用。
+    """
+
+    def __init__(self, scenes: List[Dict]):
+        self.scenes = scenes
+        self.finished_count = 0
+        self.all_scenes_known = True
+        # 派生图在进程池中编码，不阻塞当前线程
+        self.variant_futures: Dict[Future, Dict] = {}
+        self._positions = {}
+
+    def _track_variants(self, scene: Dict):
+        variant_future = start_scene_variants(scene)
+        if variant_future:
+            self.variant_futures[variant_future] = scene
+
+    def use_cached(self, scene_index: int) -> bool:
+        """命中图片缓存时直接记为完成，返回是否命中"""
+        scene = self.scenes[scene_index]
+        cached_path = cached_scene_image(scene)
+        if not cached_path:
+            return False
+        scene['image_url'] = cached_path
+        self.finished_count += 1
+        print(f"场景 {scene_index + 1} 命中图片缓存: {cached_path}")
+        self._track_variants(scene)
+        return True
+
+    def finish(self, scene_index: int, future: Future):
+        """写回已完成任务的结果，失败时改用占位图"""
+        scene = self.scenes[scene_index]
+        self.finished_count += 1
+        try:
+            scene['image_url'] = future.result()
+        except Exception as e:
+            mark_image_failed(scene, scene_index, e)
+            return
+        print(f"场景 {scene_index + 1} 图片完成，已完成 {self.finished_count}/{len(self.scenes)}")
+        self._track_variants(scene)
+
+    def done_event(self, scene_index: int, cached: bool = False) -> Dict:
+        scene = self.scenes[scene_index]
+        event = {
+            "type": "image_update",
+            "scene_index": scene_index,
+            "total_scenes": len(self.scenes),
+            "finished_count": self.finished_count,
+            "completed": self.all_scenes_known and self.finished_count >= len(self.scenes),
+            "status": "done",
+            "image_url": scene['image_url'],
+            "scene_text": scene['text']
+        }
+        if scene.get('image_error'):
+            event["status"] = "failed"
+            event["error"] = scene['image_error']
+        if cached:
+            event["cached"] = True
+        if scene.get('image_variants'):
+            event["image_variants"] = scene['image_variants']
+        return event
+
+    def position_events(self, pending_jobs) -> Generator[Dict, None, None]:
+        """排队位置变化的任务产出等待状态，pending_jobs 为 (场景索引, ImageJob) 序列"""
+        for scene_index, job in pending_jobs:
+            position = job.position()
+            if self._positions.get(scene_index) == position:
+                continue
+            self._positions[scene_index] = position
+            yield {
+                "type": "image_update",
+                "scene_index": scene_index,
+                "total_scenes": len(self.scenes),
+                "finished_count": self.finished_count,
+                "completed": False,
+                "status": "queued" if position > 0 else "running",
+                "queue_position": position
+            }
+
+class _SceneArrivals:
+    """在后台线程中消费流式场景，新场景到达时唤醒图片阶段的等待
+
+    图片阶段结束（出错或客户端断开）时调用 stop()，后台线程在收到下一个场景后关闭场景流，
+    不再继续读取 LLM 的输出。
+    """
+
+    def __init__(self, scene_source):
+        self._lock = threading.Lock()
+        self._scenes = []
+        self._signal = Future()
+        self._stopped = threading.Event()
+        self.finished = False
+        self.error = None
+        self._thread = threading.Thread(target=self._consume, args=(scene_source,), name="scene-stream", daemon=True)
+        self._thread.start()
+
+    def _consume(self, scene_source):
+        try:
+            for scene in scene_source:
+                if self._stopped.is_set():
+                    break
+                with self._lock:
+                    self._scenes.append(scene)
+                    self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            # 生成器只能在迭代它的线程中关闭
+            if self._stopped.is_set() and hasattr(scene_source, "close"):
+                scene_source.close()
+            with self._lock:
+                self.finished = True
+                self._notify()
+
+    def _notify(self):
+        if not self._signal.done():
+            self._signal.set_result(None)
+
+    def stop(self):
+        """通知后台线程停止消费场景流"""
+        self._stopped.set()
+
+    def signal(self) -> Future:
+        """新场景到达或流结束时完成的 Future"""
+        with self._lock:
+            return self._signal
+
+    def take(self):
+        """取出已到达的场景并重置信号，同时返回此刻流是否已结束"""
+        with self._lock:
+            scenes, self._scenes = self._scenes, []
+            if not self.finished:
+                self._signal = Future()
+            return scenes, self.finished
+
+def generate_images_concurrently(state: StoryState, parallelism: int = None,
+                                 session_id: str = DEFAULT_IMAGE_SESSION,
+                                 prestarted_jobs: Dict[int, ImageJob] = None,
+                                 scene_source=None) -> Generator[Dict, None, None]:
+    """把场景提交到全局调度器，按完成顺序产出 image_update 事件
+
+    scene_source 为流式场景迭代器时，每个场景到达后立即提交，场景总数在流结束后才确定；
+    否则使用 state['scenes'] 中的全部场景。
+    """
+    max_parallel = max(1, parallelism or IMAGE_PARALLELISM)
+    scheduler = get_image_scheduler()
+    prestarted_jobs = prestarted_jobs or {}
+    arrivals = _SceneArrivals(scene_source) if scene_source is not None else None
+    progress = SceneImageProgress([] if arrivals else list(state['scenes']))
+    progress.all_scenes_known = arrivals is None
+    scenes = progress.scenes
+    jobs = {}
+    pending = set()
+    submitted_count = 0
+
+    print(f"开始生成图片，会话 {session_id} 并发数: {max_parallel}")
+    try:
+        while True:
+            if arrivals is not None:
+                arrived, progress.all_scenes_known = arrivals.take()
+                scenes.extend(arrived)
+
+            # 提交新到达的场景，由调度器负责限流、并发和会话间公平
+            while submitted_count < len(scenes):
+                index = submitted_count
+                submitted_count += 1
+                # 审核期间已预先提交的任务直接沿用
+                job = prestarted_jobs.get(index)
+                if job is None:
+                    # 缓存命中的场景不占用调度器，直接返回
+                    if progress.use_cached(index):
+                        yield progress.done_event(index, cached=True)
+                        continue
+                    job = scheduler.submit(session_id, render_scene_image, scenes[index], check_cache=False, max_parallel=max_parallel)
+                jobs[job.future] = (index, job)
+                pending.add(job.future)
+
+            if not pending and progress.all_scenes_known:
+                break
+
+            # 排队中的任务推送等待状态，位置变化时才发送
+            yield from progress.position_events(jobs[future] for future in pending)
+
+            waiting = set(pending)
+            if not progress.all_scenes_known:
+                waiting.add(arrivals.signal())
+            done, _ = wait(waiting, timeout=QUEUE_STATUS_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done & pending:
+                pending.discard(future)
+                scene_index = jobs[future][0]
+                progress.finish(scene_index, future)
+                yield progress.done_event(scene_index)
+    finally:
+        # 出错或客户端断开时撤回尚在排队的任务，并停止读取场景流
+        for future in pending:
+            jobs[future][1].cancel()
+        if arrivals is not None:
+            arrivals.stop()
+
+    if arrivals is not None and arrivals.error is not None:
+        raise arrivals.error
+    collect_scene_variants(progress.variant_futures)
+    state['scenes'] = scenes
+    state['current_scene_index'] = len(scenes)
+    state['completed'] = True
+
 # 添加人工审核工具
 def human_review(state: StoryState, review_queue=None) -> StoryState:
     """请求人工审核故事内容"""
@@ -354,6 +913,133 @@ def human_review(state: StoryState, review_queue=None) -> StoryState:
     print(f"Review result: {'Approved' if state['approved'] else 'Rejected'}, Regenerate: {state['regenerate']}")
     return state
 
+class SpeculationStats:
+    """预执行指标：启动、采用、丢弃次数及浪费的工作量"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.committed = 0
+        self.discarded = 0
+        self.wasted_split_seconds = 0.0  # 被丢弃的分场景耗时
+        self.wasted_images = 0  # 已开始生成但被丢弃的图片
+        self.cancelled_images = 0  # 排队中即被撤回的图片
+
+    def record(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "committed": self.committed,
+                "discarded": self.discarded,
+                "wasted_split_seconds": round(self.wasted_split_seconds, 2),
+                "wasted_images": self.wasted_images,
+                "cancelled_images": self.cancelled_images
+            }
+
+speculation_stats = SpeculationStats()
+
+class Speculation:
+    """审核等待期间的预执行：后台分场景，images 模式下同时提交图片任务"""
+
+    def __init__(self, story_state: StoryState, mode: str, session_id: str, parallelism: int = None):
+        self.mode = mode
+        self.session_id = session_id
+        self.parallelism = max(1, parallelism or IMAGE_PARALLELISM)
+        self.state = StoryState(**story_state)
+        self.state['scenes'] = []
+        self.jobs: Dict[int, ImageJob] = {}
+        self.error = None
+        self.started_at = time.monotonic()
+        self.split_seconds = None
+        self._lock = threading.Lock()
+        self._finished = False
+        self._discarded = False
+        speculation_stats.record(started=1)
+        self._thread = threading.Thread(target=self._run, name="speculation", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            if self.mode == "images":
+                # 流式分场景，每个场景解析完成即提交图片任务
+                scheduler = get_image_scheduler()
+                for scene in split_scenes_streaming(self.state):
+                    with self._lock:
+                        if self._discarded:
+                            return
+                        index = len(self.jobs)
+                        self.jobs[index] = scheduler.submit(self.session_id, render_scene_image, scene,
+                                                            max_parallel=self.parallelism)
+                print(f"预执行已提交 {len(self.jobs)} 个图片任务")
+            else:
+                split_scenes(self.state)
+        except Exception as e:
+            print(f"预执行分场景出错: {e}")
+            self.error = e
+        finally:
+            self.split_seconds = time.monotonic() - self.started_at
+
+    def commit(self, review_state: StoryState) -> Optional[StoryState]:
+        """审核通过后采用预执行结果，失败时返回 None 由调用方正常执行"""
+        self._thread.join()
+        if self.error is not None or not self.state['scenes']:
+            self.discard()
+            return None
+        with self._lock:
+            if self._finished:
+                return None
+            self._finished = True
+        speculation_stats.record(committed=1)
+        self.state['approved'] = review_state.get('approved', True)
+        self.state['regenerate'] = review_state.get('regenerate', False)
+        print(f"采用预执行结果: {len(self.state['scenes'])} 个场景, {len(self.jobs)} 个图片任务")
+        return self.state
+
+    def discard(self):
+        """丢弃预执行结果，撤回尚未开始的图片任务"""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            self._discarded = True
+            jobs = list(self.jobs.values())
+        cancelled = sum(1 for job in jobs if job.cancel())
+        split_seconds = self.split_seconds if self.split_seconds is not None else time.monotonic() - self.started_at
+        speculation_stats.record(
+            discarded=1,
+            wasted_split_seconds=split_seconds,
+            wasted_images=len(jobs) - cancelled,
+            cancelled_images=cancelled
+        )
+        print(f"丢弃预执行结果: 撤回 {cancelled} 个图片任务, 浪费 {len(jobs) - cancelled} 个")
+
+def start_speculation(story_state: StoryState, mode: str, session_id: str, parallelism: int = None) -> Optional[Speculation]:
+    """按模式启动预执行，关闭时返回 None"""
+    if mode not in ("scenes", "images"):
+        return None
+    print(f"审核期间启动预执行，模式: {mode}")
+    return Speculation(story_state, mode, session_id, parallelism)
+
+def final_result_event(state: StoryState) -> Dict:
+    """构建流式工作流的最终结果事件"""
+    if state['scenes']:
+        title = state['scenes'][0]['text'].split('，')[0] if '，' in state['scenes'][0]['text'] else state['scenes'][0]['text'][:10]
+    else:
+        title = "故事"
+    return {
+        "type": "final_result",
+        "title": title,
+        "outline": state.get('outline', ''),
+        "story": state['story'],
+        "scenes": state['scenes'],
+        "completed": True
+    }
+
 # 添加结束节点
 def end_workflow(state: StoryState) -> StoryState:
     """结束工作流的节点"""
@@ -400,174 +1086,342 @@ def create_story_graph(streaming: bool = False, review_queue=None) -> Graph:
     
     return workflow.compile()
 
-# 修改执行工作流函数
-def run_story_workflow(outline: str, streaming: bool = False, review_queue=None) -> Generator[Dict, None, None]:
-    if streaming:
-        state = StoryState(
-            outline=outline,
-            story="",
-            scenes=[],
-            current_scene_index=0,
-            completed=False,
-            streaming=streaming,
-            approved=False,
-            regenerate=False,
-            character_features="",
-            character_name=""
-        )
+def _run_streaming_workflow(outline: str, review_queue, image_parallelism: int, session_id: str,
+                            speculative: str, speculations: List["Speculation"]) -> Generator[Dict, None, None]:
+    """流式工作流：生成故事、等待审核、分场景并并发生成图片"""
+    state = StoryState(
+        outline=outline,
+        story="",
+        scenes=[],
+        current_scene_index=0,
+        completed=False,
+        streaming=True,
+        approved=False,
+        regenerate=False,
+        character_features="",
+        character_name=""
+    )
+    
+    # 1. 生成故事与特征（流式）
+    story_state = None
+    for update in generate_story_and_features(state):
+        if update.get("completed", False):
+            story_state = state
+            story_state['story'] = update.get("content", "")
+        yield update
+    
+    # 2. 提取人物特征已在故事生成步骤完成
+    if story_state:
+        # 发送角色特征通知
+        yield {
+            "type": "character_features",
+            "features": story_state.get("character_features", ""),
+            "name": story_state.get("character_name", "主角")
+        }
         
-        # 1. 生成故事与特征（流式）
-        story_state = None
-        for update in generate_story_and_features(state):
-            if update.get("completed", False):
-                story_state = state
-                story_state['story'] = update.get("content", "")
-            yield update
+        # 审核期间预先分场景（可选预生成图片）；在发出审核请求前启动，任务挂起等待审核时也在进行
+        speculation = start_speculation(story_state, speculative, session_id, image_parallelism)
+        if speculation:
+            speculations.append(speculation)
         
-        # 2. 提取人物特征已在故事生成步骤完成
-        if story_state:
-            # 发送角色特征通知
-            yield {
-                "type": "character_features",
-                "features": story_state.get("character_features", ""),
-                "name": story_state.get("character_name", "主角")
-            }
-            
-            # 请求人工审核
-            yield {
-                "type": "review_request",
-                "story": story_state["story"],
-                "outline": story_state["outline"],
-                "character_features": story_state.get("character_features", ""),
-                "character_name": story_state.get("character_name", "主角")
-            }
-            
-            # 等待审核结果
-            state = human_review(story_state, review_queue)
-            print(f"审核结果: approved={state['approved']}, regenerate={state.get('regenerate', False)}")
-            
-            if not state["approved"]:
-                if state.get("regenerate", False):
-                    # 如果需要重新生成，重置状态并继续执行
-                    print(f"检测到重新生成标志，开始重新生成故事")
-                    yield {
-                        "type": "regenerate_story",
-                        "message": "重新生成故事"
-                    }
-                    # 重新生成故事
-                    state = StoryState(
-                        outline=outline,
-                        story="",
-                        scenes=[],
-                        current_scene_index=0,
-                        completed=False,
-                        streaming=streaming,
-                        approved=False,
-                        regenerate=False,
-                        character_features="",
-                        character_name=""
-                    )
-                    # 重新启动故事生成流程
-                    print(f"重置状态，准备生成新故事")
-                    for update in generate_story_and_features(state):
-                        if update.get("completed", False):
-                            story_state = state
-                            story_state['story'] = update.get("content", "")
-                        yield update
-                    
-                    # 发送角色特征通知
-                    yield {
-                        "type": "character_features",
-                        "features": story_state.get("character_features", ""),
-                        "name": story_state.get("character_name", "主角")
-                    }
-                        
-                    # 继续请求审核
-                    print(f"新故事生成完成，请求新一轮审核")
-                    yield {
-                        "type": "review_request",
-                        "story": story_state["story"],
-                        "outline": story_state["outline"],
-                        "character_features": story_state.get("character_features", ""),
-                        "character_name": story_state.get("character_name", "主角")
-                    }
-                    
-                    # 等待新的审核结果
-                    state = human_review(story_state, review_queue)
-                    print(f"新审核结果: approved={state['approved']}, regenerate={state.get('regenerate', False)}")
-                    
-                    if not state["approved"]:
-                        print(f"新故事仍被拒绝，结束流程")
-                        yield {
-                            "type": "review_rejected",
-                            "message": "新故事内容未通过审核"
-                        }
-                        return
-                else:
-                    # 正常的拒绝处理
-                    print(f"故事被拒绝，无重新生成标志，结束流程")
-                    yield {
-                        "type": "review_rejected",
-                        "message": "故事内容未通过审核"
-                    }
-                    return
-            
-            # 继续后续流程
-            print(f"故事通过审核，继续处理")
-            state = split_scenes(state)
-            print(f"分场景后的状态: {len(state['scenes'])} 个场景, 当前索引: {state['current_scene_index']}")
-            
-            # 图片生成循环
-            scene_count = len(state['scenes'])
-            processed_scene_count = 0
-            
-            while processed_scene_count < scene_count:
-                # 确保索引在有效范围内
-                if state['current_scene_index'] >= scene_count:
-                    print(f"警告: 索引 {state['current_scene_index']} 超出范围")
-                    break
-                
-                # 生成当前场景的图片
-                print(f"处理场景 {state['current_scene_index']+1}/{scene_count}")
-                state = generate_images(state)
-                processed_scene_count += 1
+        # 请求人工审核
+        yield {
+            "type": "review_request",
+            "story": story_state["story"],
+            "outline": story_state["outline"],
+            "character_features": story_state.get("character_features", ""),
+            "character_name": story_state.get("character_name", "主角")
+        }
+        
+        # 等待审核结果
+        state = human_review(story_state, review_queue)
+        print(f"审核结果: approved={state['approved']}, regenerate={state.get('regenerate', False)}")
+        
+        if not state["approved"]:
+            # 故事未通过，预执行结果作废
+            if speculation:
+                speculation.discard()
+            if state.get("regenerate", False):
+                # 如果需要重新生成，重置状态并继续执行
+                print(f"检测到重新生成标志，开始重新生成故事")
+                yield {
+                    "type": "regenerate_story",
+                    "message": "重新生成故事"
+                }
+                # 重新生成故事
+                state = StoryState(
+                    outline=outline,
+                    story="",
+                    scenes=[],
+                    current_scene_index=0,
+                    completed=False,
+                    streaming=True,
+                    approved=False,
+                    regenerate=False,
+                    character_features="",
+                    character_name=""
+                )
+                # 重新启动故事生成流程
+                print(f"重置状态，准备生成新故事")
+                for update in generate_story_and_features(state, use_cache=False):
+                    if update.get("completed", False):
+                        story_state = state
+                        story_state['story'] = update.get("content", "")
+                    yield update
                 
-                # 发送更新信息
+                # 发送角色特征通知
                 yield {
-                    "type": "image_update",
-                    "scene_index": state['current_scene_index'] - 1,
-                    "total_scenes": scene_count,
-                    "completed": processed_scene_count >= scene_count,
-                    "image_url": state['scenes'][state['current_scene_index'] - 1]['image_url'],
-                    "scene_text": state['scenes'][state['current_scene_index'] - 1]['text']
+                    "type": "character_features",
+                    "features": story_state.get("character_features", ""),
+                    "name": story_state.get("character_name", "主角")
                 }
+                    
+                speculation = start_speculation(story_state, speculative, session_id, image_parallelism)
+                if speculation:
+                    speculations.append(speculation)
                 
-                # 调试信息
-                print(f"场景 {state['current_scene_index']}/{scene_count} 处理完成, 已处理 {processed_scene_count}/{scene_count}")
-                # print(f"场景 {state['scenes'][state['current_scene_index'] - 1]['image_url']}")
-            
-            # 确保完成状态正确设置
-            state['completed'] = True
-            
-            # 返回最终结果
-            if len(state['scenes']) > 0:
-                title = state['scenes'][0]['text'].split('，')[0] if '，' in state['scenes'][0]['text'] else state['scenes'][0]['text'][:10]
+                # 继续请求审核
+                print(f"新故事生成完成，请求新一轮审核")
                 yield {
-                    "type": "final_result",
-                    "title": title,
-                    "story": state['story'],
-                    "scenes": state['scenes'],
-                    "completed": True
+                    "type": "review_request",
+                    "story": story_state["story"],
+                    "outline": story_state["outline"],
+                    "character_features": story_state.get("character_features", ""),
+                    "character_name": story_state.get("character_name", "主角")
                 }
+                
+                # 等待新的审核结果
+                state = human_review(story_state, review_queue)
+                print(f"新审核结果: approved={state['approved']}, regenerate={state.get('regenerate', False)}")
+                
+                if not state["approved"]:
+                    print(f"新故事仍被拒绝，结束流程")
+                    yield {
+                        "type": "review_rejected",
+                        "message": "新故事内容未通过审核"
+                    }
+                    return
             else:
-                print("警告: 没有场景数据")
+                # 正常的拒绝处理
+                print(f"故事被拒绝，无重新生成标志，结束流程")
                 yield {
-                    "type": "final_result",
-                    "title": "故事",
-                    "story": state['story'],
-                    "scenes": [],
-                    "completed": True
+                    "type": "review_rejected",
+                    "message": "故事内容未通过审核"
+                }
+                return
+        
+        # 继续后续流程
+        print(f"故事通过审核，继续处理")
+        prestarted_jobs = {}
+        speculative_state = speculation.commit(state) if speculation else None
+        if speculative_state is not None:
+            # 直接采用审核期间预先完成的分场景和图片任务
+            state = speculative_state
+            prestarted_jobs = speculation.jobs
+            print(f"分场景后的状态: {len(state['scenes'])} 个场景, 当前索引: {state['current_scene_index']}")
+            # 并发生成所有场景图片，按完成顺序推送
+            yield from generate_images_concurrently(state, image_parallelism, session_id, prestarted_jobs)
+        elif STREAMING_SPLIT:
+            # 流式分场景，每解析出一个场景就立即开始生成图片
+            yield from generate_images_concurrently(state, image_parallelism, session_id,
+                                                    scene_source=split_scenes_streaming(state))
+        else:
+            state = split_scenes(state)
+            print(f"分场景后的状态: {len(state['scenes'])} 个场景, 当前索引: {state['current_scene_index']}")
+            yield from generate_images_concurrently(state, image_parallelism, session_id)
+        
+        # 确保完成状态正确设置
+        state['completed'] = True
+        
+        # 返回最终结果
+        if not state['scenes']:
+            print("警告: 没有场景数据")
+        yield final_result_event(state)
+
+# 中断审核模式：审核点中断并保存检查点，请求线程随即释放
+def _review_generate_story(state: StoryState) -> StoryState:
+    """生成故事节点，流式更新通过 stream writer 推送"""
+    writer = get_stream_writer()
+    if state.get('regenerate', False):
+        writer({"type": "regenerate_story", "message": "重新生成故事"})
+    state['story'] = ""
+    state['scenes'] = []
+    # regenerate 标志会让故事生成绕过 LLM 缓存
+    for update in generate_story_and_features(state):
+        writer(update)
+    writer({
+        "type": "character_features",
+        "features": state.get("character_features", ""),
+        "name": state.get("character_name", "主角")
+    })
+    return state
+
+def _review_human_review(state: StoryState) -> StoryState:
+    """审核节点：在此中断，审核结果通过 Command(resume=...) 传入
+
+    与队列模式一致，只允许重新生成一次，新故事再被拒绝即结束。
+    """
+    review_round = state.get('review_round', 0) + 1
+    review_data = interrupt({
+        "type": "review_request",
+        "story": state["story"],
+        "outline": state["outline"],
+        "character_features": state.get("character_features", ""),
+        "character_name": state.get("character_name", "主角"),
+        "review_mode": "interrupt"
+    })
+    if not isinstance(review_data, dict):
+        print(f"Unexpected review data type: {type(review_data)}")
+        review_data = {}
+    
+    state['review_round'] = review_round
+    state['approved'] = review_data.get("approved", False)
+    state['regenerate'] = not state['approved'] and review_data.get("regenerate", False) and review_round == 1
+    print(f"审核结果: approved={state['approved']}, regenerate={state['regenerate']}")
+    
+    if not state['approved'] and not state['regenerate']:
+        get_stream_writer()({
+            "type": "review_rejected",
+            "message": "故事内容未通过审核" if review_round == 1 else "新故事内容未通过审核"
+        })
+    return state
+
+def _review_generate_images(state: StoryState, config: RunnableConfig) -> StoryState:
+    """分场景并并发生成图片，按完成顺序推送"""
+    writer = get_stream_writer()
+    configurable = config.get("configurable", {})
+    image_parallelism = configurable.get("image_parallelism")
+    session_id = configurable.get("image_session", DEFAULT_IMAGE_SESSION)
+    
+    if STREAMING_SPLIT:
+        events = generate_images_concurrently(state, image_parallelism, session_id,
+                                              scene_source=split_scenes_streaming(state))
+    else:
+        split_scenes(state)
+        events = generate_images_concurrently(state, image_parallelism, session_id)
+    for event in events:
+        writer(event)
+    
+    state['completed'] = True
+    writer(final_result_event(state))
+    return state
+
+_review_checkpointer = MemorySaver()
+_review_graph = None
+_review_lock = threading.Lock()
+# 正在等待审核的线程：thread_id -> {"config": ..., "interrupted_at": ...}
+_review_threads: Dict[str, Dict] = {}
+
+def _get_review_graph():
+    global _review_graph
+    with _review_lock:
+        if _review_graph is None:
+            workflow = StateGraph(StoryState)
+            workflow.add_node("generate_story", _review_generate_story)
+            workflow.add_node("human_review", _review_human_review)
+            workflow.add_node("generate_images", _review_generate_images)
+            workflow.add_node("end", end_workflow)
+            
+            workflow.set_entry_point("generate_story")
+            workflow.add_edge("generate_story", "human_review")
+            workflow.add_conditional_edges(
+                "human_review",
+                lambda x: "generate_images" if x.get("approved", False)
+                         else "generate_story" if x.get("regenerate", False)
+                         else "end",
+                {
+                    "generate_images": "generate_images",
+                    "generate_story": "generate_story",
+                    "end": "end"
                 }
+            )
+            workflow.add_edge("generate_images", "end")
+            _review_graph = workflow.compile(checkpointer=_review_checkpointer)
+        return _review_graph
+
+def _purge_review_threads():
+    """清理超时未审核的检查点"""
+    now = time.monotonic()
+    with _review_lock:
+        expired = [thread_id for thread_id, entry in _review_threads.items()
+                   if now - entry["interrupted_at"] > REVIEW_THREAD_TTL]
+        for thread_id in expired:
+            _review_threads.pop(thread_id)
+    for thread_id in expired:
+        _review_checkpointer.delete_thread(thread_id)
+        print(f"审核超时，清理检查点: {thread_id}")
+
+def _stream_review_graph(graph_input, config: Dict) -> Generator[Dict, None, None]:
+    """运行图直到中断或结束；中断时登记线程等待恢复，结束时删除检查点"""
+    thread_id = config["configurable"]["thread_id"]
+    interrupted = False
+    try:
+        for mode, chunk in _get_review_graph().stream(graph_input, config, stream_mode=["custom", "updates"]):
+            if mode == "custom":
+                yield chunk
+            elif "__interrupt__" in chunk:
+                interrupted = True
+                for item in chunk["__interrupt__"]:
+                    yield item.value
+    finally:
+        if interrupted:
+            with _review_lock:
+                _review_threads[thread_id] = {"config": config, "interrupted_at": time.monotonic()}
+            print(f"等待审核，释放请求: {thread_id}")
+        else:
+            _review_checkpointer.delete_thread(thread_id)
+
+def start_review_workflow(outline: str, thread_id: str, image_parallelism: int = None,
+                          session_id: str = DEFAULT_IMAGE_SESSION) -> Generator[Dict, None, None]:
+    """中断审核模式：生成故事并在审核点结束，之后由 resume_review_workflow 继续"""
+    _purge_review_threads()
+    config = {"configurable": {
+        "thread_id": thread_id,
+        "image_parallelism": image_parallelism,
+        "image_session": session_id
+    }}
+    initial_state = StoryState(
+        outline=outline,
+        story="",
+        scenes=[],
+        current_scene_index=0,
+        completed=False,
+        streaming=True,
+        approved=False,
+        regenerate=False,
+        character_features="",
+        character_name="",
+        review_round=0
+    )
+    yield from _stream_review_graph(initial_state, config)
+
+def pending_review(thread_id: str) -> bool:
+    """线程是否正停在审核点"""
+    with _review_lock:
+        return thread_id in _review_threads
+
+def resume_review_workflow(thread_id: str, review_data: Dict) -> Generator[Dict, None, None]:
+    """从检查点恢复并传入审核结果；线程不在等待审核时不产出任何事件"""
+    with _review_lock:
+        # 取出登记，防止同一审核被重复提交
+        entry = _review_threads.pop(thread_id, None)
+    if entry is None:
+        print(f"没有等待审核的线程: {thread_id}")
+        return
+    yield from _stream_review_graph(Command(resume=review_data), entry["config"])
+
+# 修改执行工作流函数
+def run_story_workflow(outline: str, streaming: bool = False, review_queue=None, image_parallelism: int = None,
+                       session_id: str = DEFAULT_IMAGE_SESSION, speculative: str = None) -> Generator[Dict, None, None]:
+    if streaming:
+        # 记录审核期间启动的预执行任务，流程结束时统一丢弃未提交的部分
+        speculations = []
+        try:
+            yield from _run_streaming_workflow(outline, review_queue, image_parallelism, session_id,
+                                               speculative or SPECULATIVE_MODE, speculations)
+        finally:
+            for speculation in speculations:
+                speculation.discard()
     else:
         # 非流式处理
         graph = create_story_graph(streaming, review_queue)
@@ -583,31 +1437,30 @@ def run_story_workflow(outline: str, streaming: bool = False, review_queue=None)
             character_features="",
             character_name=""
         )
-        final_state = graph.invoke(initial_state)
+        # 与中断审核模式一样经由 configurable 传入会话，图片任务按会话公平调度
+        final_state = graph.invoke(initial_state, {"configurable": {"image_session": session_id}})
         
         # 确保有场景数据
         if final_state["scenes"]:
             title = final_state["scenes"][0]["text"].split("，")[0] if "，" in final_state["scenes"][0]["text"] else final_state["scenes"][0]["text"][:10]
             yield {
                 "title": title,
+                "outline": outline,
                 "story": final_state["story"],
                 "scenes": final_state["scenes"]
             }
         else:
             yield {
                 "title": "故事",
+                "outline": outline,
                 "story": final_state["story"],
                 "scenes": []
             } 
 
-def generate_scene_image(scene_text: str, characters: List[str], features: str) -> str:
+def generate_scene_image(scene_text: str, characters: List[str], features: str,
+                         session_id: str = DEFAULT_IMAGE_SESSION) -> str:
     """生成场景图片"""
-    llm = ChatOpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL"),
-        model="gpt-3.5-turbo",
-        streaming=False
-    )
+    llm = get_llm(streaming=False)
     
     prompt = f"""
     请根据以下场景描述和角色特征，生成一个详细的图片生成提示词。
@@ -630,18 +1483,14 @@ def generate_scene_image(scene_text: str, characters: List[str], features: str)
         
         print(f"生成的图片提示词: {image_prompt}")
         
-        # 调用实际的图片生成服务
-        from storybook_generator import StorybookGenerator
-        generator = StorybookGenerator()
-        
-        # 调用图像生成API
-        negative_prompt = "低质量, 模糊, 变形, 不相关内容"
-        image_url = generator.generate_image(image_prompt, negative_prompt)
-        
-        # 下载并保存图片
-        local_image_path = download_image(image_url, IMAGES_DIR)
-        return local_image_path
+        # 通过全局调度器调用图像生成API并保存图片
+        scene = {
+            "prompt": image_prompt,
+            "negative_prompt": "低质量, 模糊, 变形, 不相关内容"
+        }
+        job = get_image_scheduler().submit(session_id, render_scene_image, scene)
+        return job.result()
     except Exception as e:
         print(f"图片生成出错: {e}")
         # 出错时返回一个默认图片 URL
-        return "/static/images/error_image.png" 
\ No newline at end of file
+        return ERROR_IMAGE_URL
\ No newline at end of file
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+# 图片缓存配置
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH", "data/image_cache.sqlite3")
+# 旧版本的 JSON 索引，数据库为空时导入一次
+IMAGE_CACHE_INDEX = os.getenv("IMAGE_CACHE_INDEX", "data/image_cache_index.json")
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "5000"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# 命中后访问时间的落盘间隔（秒）
+INDEX_FLUSH_INTERVAL = 30
+
+
+def make_image_key(model: str, prompt: str, negative_prompt: str, size: str, n: int) -> str:
+    """根据生成参数计算缓存键"""
+    payload = json.dumps([model, prompt, negative_prompt, size, n], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """按生成参数寻址的图片缓存，索引保存在 SQLite 中，按 LRU 和总大小淘汰
+
+    多个进程共享同一个数据库文件，一个进程写入的条目其他进程立即可见。
+    命中时的访问时间先记在内存中，每隔 INDEX_FLUSH_INTERVAL 秒批量写入。
+    淘汰只移除索引条目，不删除图片文件（文件可能已被绘本引用）。
+    """
+
+    def __init__(self, path: str = IMAGE_CACHE_PATH, images_dir: str = "static/images",
+                 max_entries: int = IMAGE_CACHE_MAX_ENTRIES, max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+                 legacy_index: Optional[str] = IMAGE_CACHE_INDEX):
+        self.path = path
+        self.images_dir = images_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 尚未写入数据库的访问时间：key -> last_access
+        self._touched: Dict[str, float] = {}
+        self._flushed_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS image_cache (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_image_cache_last_access ON image_cache (last_access)")
+        self._conn.commit()
+        if legacy_index:
+            self._import_legacy(legacy_index)
+
+    def _local_file(self, web_path: str) -> str:
+        return os.path.join(self.images_dir, os.path.basename(web_path))
+
+    def _import_legacy(self, index_path: str):
+        """导入旧版本的 JSON 索引（仅在数据库为空时）"""
+        if not os.path.exists(index_path):
+            return
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM image_cache LIMIT 1").fetchone() is not None:
+                return
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    entries = json.load(f)
+            except Exception as e:
+                print(f"读取旧图片缓存索引失败: {e}")
+                return
+            rows = [(key, entry["path"], entry.get("size", 0), entry.get("last_access", 0))
+                    for key, entry in entries.items() if entry.get("path")]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO image_cache (key, path, size, last_access) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+        print(f"导入旧图片缓存索引: {len(rows)} 条")
+
+    def _write_touched(self):
+        """把内存中的访问时间写入数据库（调用方持有锁，由调用方提交）"""
+        if self._touched:
+            # 只前移访问时间，不覆盖其他进程写入的更新值
+            self._conn.executemany(
+                "UPDATE image_cache SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(last_access, key) for key, last_access in self._touched.items()]
+            )
+            self._touched.clear()
+        self._flushed_at = time.monotonic()
+
+    def get(self, key: str) -> Optional[str]:
+        """命中时返回本地图片路径（/static/images/...）"""
+        with self._lock:
+            row = self._conn.execute("SELECT path FROM image_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and not os.path.exists(self._local_file(row[0])):
+                # 文件已被清理，视为未命中
+                self._conn.execute("DELETE FROM image_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self._touched.pop(key, None)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if time.monotonic() - self._flushed_at > INDEX_FLUSH_INTERVAL:
+                self._write_touched()
+                self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, web_path: str):
+        """记录一张已保存到本地的图片，只写入这一条记录"""
+        try:
+            size = os.path.getsize(self._local_file(web_path))
+        except OSError:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_cache (key, path, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, web_path, size, time.time())
+            )
+            self._touched.pop(key, None)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """超出条目数或总大小上限时按最近访问时间淘汰（调用方持有锁）"""
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM image_cache").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # 淘汰顺序依赖访问时间，先写入内存中的记录
+        self._write_touched()
+        expired = []
+        for key, size in self._conn.execute("SELECT key, size FROM image_cache ORDER BY last_access").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            expired.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM image_cache WHERE key = ?", expired)
+        self.evictions += len(expired)
+
+    def paths(self) -> List[str]:
+        """索引中所有图片的本地路径（/static/images/...）"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT path FROM image_cache")]
+
+    def flush(self):
+        with self._lock:
+            self._write_touched()
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM image_cache"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": total,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+_cache: Optional[ImageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    """获取进程内共享的图片缓存，未启用时返回 None"""
+    global _cache
+    if not IMAGE_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache()
+        return _cache
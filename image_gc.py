@@ -0,0 +1,321 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from book_store import LEGACY_BOOKS_DIR, get_book_store
+from image_cache import IMAGE_CACHE_PATH, ImageCache, get_image_cache
+from image_server import IMAGES_DIR
+
+try:
+    import fcntl  # 多个 worker 同时启用后台回收时只允许一个执行
+except ImportError:
+    fcntl = None
+
+# 图片回收配置
+IMAGE_GC_GRACE = float(os.getenv("IMAGE_GC_GRACE", str(24 * 3600)))  # 未被引用的文件至少保留多久（秒）
+IMAGE_GC_INTERVAL = float(os.getenv("IMAGE_GC_INTERVAL", "0"))  # 后台回收间隔（秒），0 表示不启用
+IMAGE_GC_DEDUPE = os.getenv("IMAGE_GC_DEDUPE", "hardlink").lower()  # 去重方式：hardlink / rewrite / off
+IMAGE_GC_LOCK = os.getenv("IMAGE_GC_LOCK", "data/image_gc.lock")
+IMAGE_URL_PREFIX = "/static/images/"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 只回收程序生成的文件：内容哈希命名和旧的 hash(url) 命名，其余文件（如 error_image.png）保持不动
+_GENERATED_NAME = re.compile(r'^(?P<stem>[0-9a-f]{32}|-?\d+)\.(png|jpe?g|webp|gif)$')
+_VARIANT_NAME = re.compile(r'^(?P<stem>[0-9a-f]{32}|-?\d+)_(w\d+|placeholder)\.(webp|avif)$')
+# 下载和派生图写到一半留下的临时文件
+_TEMP_NAME = re.compile(r'^\.download-.*\.part$|\.tmp$')
+
+
+def _image_name(url: str) -> Optional[str]:
+    """/static/images/ 下的地址转换为相对 images 目录的名称"""
+    if not isinstance(url, str) or not url.startswith(IMAGE_URL_PREFIX):
+        return None
+    return url[len(IMAGE_URL_PREFIX):]
+
+
+def book_image_names(book: Dict) -> Set[str]:
+    """绘本引用的原图和派生图"""
+    names = set()
+    for scene in book.get("scenes") or []:
+        urls = [scene.get("image_url")]
+        variants = scene.get("image_variants") or {}
+        for extension in ("webp", "avif"):
+            urls.extend(variant.get("url") for variant in variants.get(extension) or [])
+        names.update(name for name in map(_image_name, urls) if name)
+    return names
+
+
+def _cached_names(cache_path: str) -> Set[str]:
+    """图片缓存索引中的文件（索引由所有进程共享）"""
+    cache = get_image_cache()
+    if cache is None:
+        if not os.path.exists(cache_path):
+            return set()
+        # 服务进程启用了缓存而当前进程未启用时，直接读取共享的数据库
+        cache = ImageCache(cache_path)
+    return {name for name in map(_image_name, cache.paths()) if name}
+
+
+def referenced_images(keep_cached: bool = True, legacy_dir: str = LEGACY_BOOKS_DIR,
+                      cache_path: str = IMAGE_CACHE_PATH) -> Set[str]:
+    """绘本存储、尚未迁移的旧绘本文件以及（可选）图片缓存引用的所有图片"""
+    names = set()
+    for book in get_book_store().iter_books():
+        names |= book_image_names(book)
+    if legacy_dir and os.path.isdir(legacy_dir):
+        with os.scandir(legacy_dir) as entries:
+            for entry in entries:
+                if not (entry.is_file() and entry.name.endswith(".json")):
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        names |= book_image_names(json.load(f))
+                except (OSError, ValueError) as e:
+                    print(f"读取绘本文件失败 {entry.name}: {e}")
+    if keep_cached:
+        names |= _cached_names(cache_path)
+    return names
+
+
+def _file_digest(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _scan(directory: str, pattern) -> Dict[str, os.stat_result]:
+    files = {}
+    if not os.path.isdir(directory):
+        return files
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False) and pattern.match(entry.name):
+                files[entry.name] = entry.stat(follow_symlinks=False)
+    return files
+
+
+def find_duplicates(images_dir: str, files: Dict[str, os.stat_result],
+                    referenced: Set[str] = frozenset()) -> List[List[str]]:
+    """找出内容完全相同的文件组：先按大小分组，大小相同的再计算内容哈希
+
+    已经是硬链接（同一 inode）的文件只计算一次哈希。每组第一个为保留的文件。
+    """
+    by_size: Dict[int, Dict[tuple, List[str]]] = {}
+    for name, stat in files.items():
+        by_size.setdefault(stat.st_size, {}).setdefault((stat.st_dev, stat.st_ino), []).append(name)
+
+    groups = []
+    for inodes in by_size.values():
+        if len(inodes) < 2 and all(len(names) < 2 for names in inodes.values()):
+            continue
+        by_digest: Dict[str, List[List[str]]] = {}
+        for names in inodes.values():
+            by_digest.setdefault(_file_digest(os.path.join(images_dir, names[0])), []).append(names)
+        for digest, copies in by_digest.items():
+            if len(copies) < 2 and len(copies[0]) < 2:
+                continue
+            # 优先保留按内容哈希命名的文件，其次是被绘本引用的文件
+            copies.sort(key=lambda names: (not any(name.startswith(digest[:32]) for name in names),
+                                           not any(name in referenced for name in names), min(names)))
+            groups.append([name for names in copies for name in sorted(names)])
+    return groups
+
+
+def _hardlink(source: str, target: str):
+    """用指向 source 的硬链接原子替换 target"""
+    tmp_path = f"{target}.{os.getpid()}.gc.tmp"
+    os.link(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def _rewrite_books(mapping: Dict[str, str]) -> int:
+    """把绘本中指向重复文件的地址改为保留的文件，并重新预渲染页面，返回修改的绘本数"""
+    from prerender import prerender_book
+
+    store = get_book_store()
+    changed_books = []
+    for book in store.iter_books():
+        changed = False
+        scenes = []
+        for scene in book.get("scenes") or []:
+            name = _image_name(scene.get("image_url"))
+            if name in mapping:
+                scene = {**scene, "image_url": IMAGE_URL_PREFIX + mapping[name]}
+                changed = True
+            scenes.append(scene)
+        if changed:
+            changed_books.append({**book, "scenes": scenes})
+    for book in changed_books:
+        store.save(book, book["book_id"], book["created_at"])
+        try:
+            prerender_book(book["book_id"], book)
+        except Exception as e:
+            print(f"预渲染绘本 {book['book_id']} 失败，访问时重新渲染: {e}")
+    return len(changed_books)
+
+
+def _freed(stat: os.stat_result) -> int:
+    # 还有其他硬链接时删除不会释放空间
+    return stat.st_size if stat.st_nlink <= 1 else 0
+
+
+def collect(dry_run: bool = False, grace: float = IMAGE_GC_GRACE, dedupe: str = IMAGE_GC_DEDUPE,
+            keep_cached: bool = True, images_dir: str = IMAGES_DIR) -> Dict:
+    """回收图片存储：合并内容相同的文件，删除超过保留期且未被引用的文件，返回统计"""
+    started = time.time()
+    cutoff = started - grace
+    variants_dir = os.path.join(images_dir, "variants")
+    report = {"dry_run": dry_run, "scanned": 0, "duplicates": 0, "deduped_bytes": 0, "rewritten_books": 0,
+              "deleted": 0, "deleted_bytes": 0, "reclaimed_bytes": 0}
+
+    originals = _scan(images_dir, _GENERATED_NAME)
+    variants = _scan(variants_dir, _VARIANT_NAME)
+    report["scanned"] = len(originals) + len(variants)
+    referenced = referenced_images(keep_cached)
+
+    # 1. 内容去重
+    if dedupe != "off":
+        # 只在会保留下来的文件（被引用或仍在保留期内）之间去重，其余文件下面直接删除
+        survivors = {name: stat for name, stat in originals.items() if name in referenced or stat.st_mtime >= cutoff}
+        groups = find_duplicates(images_dir, survivors, referenced)
+        if dedupe == "rewrite" and not dry_run:
+            mapping = {name: group[0] for group in groups for name in group[1:]}
+            report["rewritten_books"] = _rewrite_books(mapping)
+            referenced = referenced_images(keep_cached)
+        for group in groups:
+            keep = group[0]
+            keep_stat = originals[keep]
+            for name in group[1:]:
+                stat = originals[name]
+                if (stat.st_dev, stat.st_ino) == (keep_stat.st_dev, keep_stat.st_ino):
+                    continue  # 已经是硬链接
+                if name not in referenced and stat.st_mtime < cutoff:
+                    continue  # 改写后不再被引用，下面直接删除
+                report["duplicates"] += 1
+                report["deduped_bytes"] += _freed(stat)
+                if not dry_run:
+                    _hardlink(os.path.join(images_dir, keep), os.path.join(images_dir, name))
+                    originals[name] = os.stat(os.path.join(images_dir, name))
+                    originals[keep] = keep_stat = os.stat(os.path.join(images_dir, keep))
+
+    # 2. 删除未被引用且超过保留期的原图，以及原图已不存在的派生图
+    remaining = set(originals)
+    for name, stat in originals.items():
+        if name in referenced or stat.st_mtime >= cutoff:
+            continue
+        report["deleted"] += 1
+        report["deleted_bytes"] += _freed(stat)
+        remaining.discard(name)
+        if not dry_run:
+            _remove(os.path.join(images_dir, name))
+    remaining_stems = {_GENERATED_NAME.match(name).group("stem") for name in remaining}
+    for name, stat in variants.items():
+        if f"variants/{name}" in referenced or stat.st_mtime >= cutoff:
+            continue
+        if _VARIANT_NAME.match(name).group("stem") in remaining_stems:
+            continue
+        report["deleted"] += 1
+        report["deleted_bytes"] += _freed(stat)
+        if not dry_run:
+            _remove(os.path.join(variants_dir, name))
+
+    # 3. 清理中断后遗留的临时文件
+    for directory in (images_dir, variants_dir):
+        for name, stat in _scan(directory, _TEMP_NAME).items():
+            if stat.st_mtime < cutoff:
+                report["deleted"] += 1
+                report["deleted_bytes"] += _freed(stat)
+                if not dry_run:
+                    _remove(os.path.join(directory, name))
+
+    report["reclaimed_bytes"] = report["deduped_bytes"] + report["deleted_bytes"]
+    report["elapsed"] = round(time.time() - started, 2)
+    return report
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_last_report: Optional[Dict] = None
+_gc_thread: Optional[threading.Thread] = None
+_gc_lock = threading.Lock()
+
+
+def run_locked(**kwargs) -> Optional[Dict]:
+    """在文件锁保护下执行一次回收，其他进程正在回收时跳过并返回 None"""
+    global _last_report
+    os.makedirs(os.path.dirname(IMAGE_GC_LOCK) or ".", exist_ok=True)
+    with open(IMAGE_GC_LOCK, 'w') as lock_file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                print("其他进程正在回收图片，跳过本次回收")
+                return None
+        report = collect(**kwargs)
+    _last_report = report
+    return report
+
+
+def last_report() -> Optional[Dict]:
+    return _last_report
+
+
+def _gc_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            report = run_locked()
+            if report:
+                print(f"图片回收完成: 删除 {report['deleted']} 个文件，合并 {report['duplicates']} 个重复文件，"
+                      f"回收 {report['reclaimed_bytes'] / 1024 / 1024:.1f} MB")
+        except Exception as e:
+            print(f"图片回收出错: {e}")
+
+
+def start_image_gc(interval: float = IMAGE_GC_INTERVAL):
+    """按 IMAGE_GC_INTERVAL 启动后台回收线程，间隔为 0 时不启动"""
+    global _gc_thread
+    if interval <= 0:
+        return
+    with _gc_lock:
+        if _gc_thread is None:
+            _gc_thread = threading.Thread(target=_gc_loop, args=(interval,), name="image-gc", daemon=True)
+            _gc_thread.start()
+
+
+def _format_report(report: Dict) -> Iterable[str]:
+    prefix = "（试运行，未修改文件）" if report["dry_run"] else ""
+    yield f"图片回收完成{prefix}: 扫描 {report['scanned']} 个文件，耗时 {report['elapsed']}s"
+    yield f"  重复文件 {report['duplicates']} 个，合并节省 {report['deduped_bytes'] / 1024 / 1024:.1f} MB"
+    if report["rewritten_books"]:
+        yield f"  改写绘本 {report['rewritten_books']} 本"
+    yield f"  删除 {report['deleted']} 个文件，释放 {report['deleted_bytes'] / 1024 / 1024:.1f} MB"
+    yield f"  共回收 {report['reclaimed_bytes'] / 1024 / 1024:.1f} MB"
+
+
+if __name__ == '__main__':
+    # 用法：python image_gc.py [--dry-run] [--grace 86400] [--dedupe hardlink|rewrite|off] [--drop-cached]
+    parser = argparse.ArgumentParser(description="图片存储回收与去重")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不修改任何文件")
+    parser.add_argument("--grace", type=float, default=IMAGE_GC_GRACE, help="未被引用的文件至少保留的秒数")
+    parser.add_argument("--dedupe", choices=("hardlink", "rewrite", "off"), default=IMAGE_GC_DEDUPE,
+                        help="hardlink：重复文件改为硬链接；rewrite：改写绘本指向保留的文件后删除重复文件")
+    parser.add_argument("--drop-cached", action="store_true", help="图片缓存引用的文件也参与回收")
+    args = parser.parse_args()
+
+    result = run_locked(dry_run=args.dry_run, grace=args.grace, dedupe=args.dedupe, keep_cached=not args.drop_cached)
+    if result is not None:
+        for line in _format_report(result):
+            print(line)
@@ -0,0 +1,212 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+# 全局图片任务限流配置
+IMAGE_RATE_LIMIT = float(os.getenv("IMAGE_RATE_LIMIT", "2"))  # 每秒允许提交的任务数
+IMAGE_RATE_BURST = int(os.getenv("IMAGE_RATE_BURST", "4"))  # 令牌桶容量
+IMAGE_MAX_IN_FLIGHT = int(os.getenv("IMAGE_MAX_IN_FLIGHT", "8"))  # 同时执行的任务上限
+
+
+class TokenBucket:
+    """令牌桶限流器（调用方负责加锁）"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> float:
+        """尝试获取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class ImageJob:
+    """提交到调度器的单个图片任务"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, scheduler: "ImageJobScheduler", session_id: str, fn: Callable, args, kwargs):
+        self.id = next(self._ids)
+        self.session_id = session_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.submitted_at = time.monotonic()
+        self._scheduler = scheduler
+
+    def position(self) -> int:
+        """返回排队位置，0 表示已开始执行"""
+        return self._scheduler.position(self)
+
+    def cancel(self) -> bool:
+        """取消尚未开始的任务"""
+        return self._scheduler.cancel(self)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None):
+        return self.future.result(timeout)
+
+
+class _SessionQueue:
+    def __init__(self, max_parallel: Optional[int]):
+        self.jobs = deque()
+        self.running = 0
+        self.max_parallel = max_parallel
+
+    def can_dispatch(self) -> bool:
+        return bool(self.jobs) and (self.max_parallel is None or self.running < self.max_parallel)
+
+
+class ImageJobScheduler:
+    """进程内的图片任务调度器：令牌桶限流 + 并发上限 + 会话间轮询公平调度"""
+
+    def __init__(self, rate: float = IMAGE_RATE_LIMIT, burst: int = IMAGE_RATE_BURST,
+                 max_in_flight: int = IMAGE_MAX_IN_FLIGHT):
+        self.max_in_flight = max(1, max_in_flight)
+        self._bucket = TokenBucket(rate, burst)
+        self._cond = threading.Condition()
+        # 按轮询顺序排列的会话队列，每次调度后将该会话移到末尾
+        self._sessions: "OrderedDict[str, _SessionQueue]" = OrderedDict()
+        self._in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="image-job")
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0}
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="image-scheduler", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, session_id: str, fn: Callable, *args, max_parallel: Optional[int] = None, **kwargs) -> ImageJob:
+        """提交任务；max_parallel 限制该会话同时执行的任务数"""
+        job = ImageJob(self, session_id, fn, args, kwargs)
+        with self._cond:
+            queue = self._sessions.get(session_id)
+            if queue is None:
+                queue = self._sessions[session_id] = _SessionQueue(max_parallel)
+            elif max_parallel is not None:
+                queue.max_parallel = max_parallel
+            queue.jobs.append(job)
+            self._stats["submitted"] += 1
+            self._cond.notify_all()
+        return job
+
+    def cancel(self, job: ImageJob) -> bool:
+        with self._cond:
+            queue = self._sessions.get(job.session_id)
+            if queue is None or job not in queue.jobs:
+                return False
+            queue.jobs.remove(job)
+            self._drop_if_idle(job.session_id)
+            self._stats["cancelled"] += 1
+        job.future.cancel()
+        return True
+
+    def position(self, job: ImageJob) -> int:
+        """估算任务前面还有多少个任务（按轮询顺序），0 表示已开始执行"""
+        with self._cond:
+            queue = self._sessions.get(job.session_id)
+            if queue is None or job not in queue.jobs:
+                return 0
+            own_index = queue.jobs.index(job)
+            ahead = own_index
+            before_own = True
+            for session_id, other in self._sessions.items():
+                if session_id == job.session_id:
+                    before_own = False
+                    continue
+                # 轮询顺序在本会话之前的会话，在同一轮中会先被调度一次
+                ahead += min(len(other.jobs), own_index + (1 if before_own else 0))
+            return ahead + 1
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return dict(
+                self._stats,
+                in_flight=self._in_flight,
+                queued=sum(len(q.jobs) for q in self._sessions.values()),
+                sessions=len(self._sessions)
+            )
+
+    def _drop_if_idle(self, session_id: str):
+        queue = self._sessions.get(session_id)
+        if queue is not None and not queue.jobs and queue.running == 0:
+            del self._sessions[session_id]
+
+    def _next_job(self) -> Optional[ImageJob]:
+        for session_id, queue in self._sessions.items():
+            if queue.can_dispatch():
+                job = queue.jobs.popleft()
+                queue.running += 1
+                self._sessions.move_to_end(session_id)
+                return job
+        return None
+
+    def _has_dispatchable(self) -> bool:
+        return any(queue.can_dispatch() for queue in self._sessions.values())
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while self._in_flight >= self.max_in_flight or not self._has_dispatchable():
+                    self._cond.wait()
+                wait = self._bucket.try_acquire()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                job = self._next_job()
+                if job is None:
+                    continue
+                self._in_flight += 1
+            self._executor.submit(self._run, job)
+
+    def _run(self, job: ImageJob):
+        try:
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.fn(*job.args, **job.kwargs))
+                except BaseException as e:
+                    job.future.set_exception(e)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                queue = self._sessions.get(job.session_id)
+                if queue is not None:
+                    queue.running -= 1
+                    self._drop_if_idle(job.session_id)
+                if job.future.cancelled():
+                    self._stats["cancelled"] += 1
+                elif job.future.exception() is not None:
+                    self._stats["failed"] += 1
+                else:
+                    self._stats["completed"] += 1
+                self._cond.notify_all()
+
+
+_scheduler: Optional[ImageJobScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_image_scheduler() -> ImageJobScheduler:
+    """获取进程内共享的图片任务调度器"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ImageJobScheduler()
+        return _scheduler
@@ -0,0 +1,57 @@
+import mimetypes
+import os
+import re
+from typing import Dict, Optional
+
+# 图片文件服务配置
+IMAGES_DIR = "static/images"
+# 前置代理直接发送文件：""（关闭）/ "x-accel"（nginx）/ "x-sendfile"（Apache、lighttpd）
+IMAGE_SENDFILE = os.getenv("IMAGE_SENDFILE", "").lower()
+# nginx 中 internal location 的前缀，需映射到 static/images 目录
+IMAGE_ACCEL_PREFIX = os.getenv("IMAGE_ACCEL_PREFIX", "/protected-images/")
+IMAGE_MAX_AGE = int(os.getenv("IMAGE_MAX_AGE", "3600"))  # 非内容哈希命名的旧图片的缓存时间
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# 按内容哈希命名的原图及其派生图，内容永远不会变化
+_CONTENT_HASH_NAME = re.compile(r'^(variants/)?[0-9a-f]{32}(_w\d+|_placeholder)?\.[a-z0-9]+$')
+_SAFE_NAME = re.compile(r'^(variants/)?[A-Za-z0-9_-][A-Za-z0-9_.-]*$')
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+
+def resolve_image(name: str, images_dir: str = IMAGES_DIR) -> Optional[Dict]:
+    """把 URL 中的图片名解析为本地文件信息，名称不合法或文件不存在时返回 None"""
+    if not _SAFE_NAME.match(name):
+        return None
+    path = os.path.join(images_dir, name)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    immutable = bool(_CONTENT_HASH_NAME.match(name))
+    return {
+        "name": name,
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mimetype": mimetypes.guess_type(name)[0] or "application/octet-stream",
+        # 内容哈希命名时文件名就是强校验值，无需读取文件
+        "etag": os.path.splitext(os.path.basename(name))[0] if immutable
+        else f"{int(stat.st_mtime):x}-{stat.st_size:x}",
+        "immutable": immutable
+    }
+
+
+def image_headers(image: Dict) -> Dict:
+    if image["immutable"]:
+        cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = f"public, max-age={IMAGE_MAX_AGE}"
+    return {"Cache-Control": cache_control, "ETag": f'"{image["etag"]}"'}
+
+
+def sendfile_headers(image: Dict) -> Dict:
+    """交给前置代理发送文件的响应头，代理负责范围请求和实际传输"""
+    if IMAGE_SENDFILE == "x-accel":
+        return {"X-Accel-Redirect": f"{IMAGE_ACCEL_PREFIX.rstrip('/')}/{image['name']}"}
+    return {"X-Sendfile": image["path"]}
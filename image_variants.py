@@ -0,0 +1,147 @@
+import base64
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+# 派生图配置
+VARIANT_WIDTHS = [int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "320,640,1024").split(",") if w.strip()]
+VARIANT_AVIF = os.getenv("IMAGE_VARIANT_AVIF", "false").lower() == "true"
+VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", "2"))
+VARIANT_QUALITY = 80
+PLACEHOLDER_WIDTH = 16
+
+IMAGES_DIR = "static/images"
+VARIANTS_DIR = os.path.join(IMAGES_DIR, "variants")
+VARIANTS_URL_PREFIX = "/static/images/variants"
+
+
+def _avif_supported() -> bool:
+    try:
+        import pillow_avif  # noqa: F401  可选插件，旧版 Pillow 需要
+    except ImportError:
+        pass
+    Image.init()
+    return "AVIF" in Image.SAVE
+
+
+def _save_atomic(image: Image.Image, path: str, image_format: str, **params):
+    tmp_path = f"{path}.tmp"
+    image.save(tmp_path, image_format, **params)
+    os.replace(tmp_path, path)
+
+
+def _variant_name(stem: str, width: int, extension: str) -> str:
+    return f"{stem}_w{width}.{extension}"
+
+
+def _placeholder_uri(path: str) -> str:
+    with open(path, 'rb') as f:
+        return "data:image/webp;base64," + base64.b64encode(f.read()).decode("ascii")
+
+
+def build_variants(source_path: str, widths: List[int] = VARIANT_WIDTHS, avif: bool = VARIANT_AVIF,
+                   output_dir: str = VARIANTS_DIR) -> Dict:
+    """生成各尺寸的 WebP（可选 AVIF）派生图和占位图，在进程池中执行"""
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    formats = [("webp", "WEBP")]
+    if avif:
+        if _avif_supported():
+            formats.append(("avif", "AVIF"))
+        else:
+            print("当前 Pillow 不支持 AVIF，跳过 AVIF 派生图")
+
+    variants = {extension: [] for extension, _ in formats}
+    with Image.open(source_path) as source:
+        image = source.convert("RGBA" if "A" in source.getbands() else "RGB")
+        for width in sorted(set(widths)):
+            width = min(width, image.width)
+            height = round(image.height * width / image.width)
+            resized = None
+            for extension, image_format in formats:
+                name = _variant_name(stem, width, extension)
+                path = os.path.join(output_dir, name)
+                if not os.path.exists(path):
+                    if resized is None:
+                        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                    _save_atomic(resized, path, image_format, quality=VARIANT_QUALITY)
+                if all(v["width"] != width for v in variants[extension]):
+                    variants[extension].append({"width": width, "url": f"{VARIANTS_URL_PREFIX}/{name}"})
+
+        # 极小的模糊占位图，直接内联到页面
+        placeholder_path = os.path.join(output_dir, f"{stem}_placeholder.webp")
+        if not os.path.exists(placeholder_path):
+            height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+            tiny = image.resize((PLACEHOLDER_WIDTH, height), Image.BILINEAR)
+            _save_atomic(tiny, placeholder_path, "WEBP", quality=30)
+
+    variants["placeholder"] = _placeholder_uri(placeholder_path)
+    return variants
+
+
+def _expected_widths(source_path: str, widths: List[int] = VARIANT_WIDTHS) -> List[int]:
+    """build_variants 会生成的宽度：超过原图宽度的按原图宽度生成"""
+    try:
+        with Image.open(source_path) as source:
+            source_width = source.width  # 只读取文件头
+    except (OSError, ValueError):
+        return sorted(set(widths))
+    return sorted({min(width, source_width) for width in widths})
+
+
+def existing_variants(image_url: str) -> Optional[Dict]:
+    """返回已经生成好的派生图信息，不做任何编码；尚未生成时返回 None"""
+    if not image_url.startswith("/static/images/"):
+        return None
+    stem = os.path.splitext(os.path.basename(image_url))[0]
+    placeholder_path = os.path.join(VARIANTS_DIR, f"{stem}_placeholder.webp")
+    if not os.path.exists(placeholder_path):
+        return None
+
+    variants = {}
+    for extension in ("webp", "avif"):
+        # 只检查按配置应当存在的文件名，不列出整个目录
+        found = []
+        for width in _expected_widths(os.path.join(IMAGES_DIR, os.path.basename(image_url))):
+            name = _variant_name(stem, width, extension)
+            if os.path.exists(os.path.join(VARIANTS_DIR, name)):
+                found.append({"width": width, "url": f"{VARIANTS_URL_PREFIX}/{name}"})
+        if found:
+            variants[extension] = found
+    if not variants.get("webp"):
+        return None
+    variants["placeholder"] = _placeholder_uri(placeholder_path)
+    return variants
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # 使用 spawn 避免在多线程的 Web 进程中 fork
+            _executor = ProcessPoolExecutor(
+                max_workers=VARIANT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def submit_variants(image_url: str) -> Optional[Future]:
+    """为本地图片提交派生图任务，返回 Future；远程图片返回 None"""
+    if not image_url.startswith("/static/images/"):
+        return None
+    source_path = os.path.join(IMAGES_DIR, os.path.basename(image_url))
+    if not os.path.exists(source_path):
+        return None
+    # 子进程使用绝对路径，避免依赖工作目录
+    return _get_executor().submit(
+        build_variants, os.path.abspath(source_path), output_dir=os.path.abspath(VARIANTS_DIR)
+    )
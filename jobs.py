@@ -0,0 +1,341 @@
+import itertools
+import json
+import os
+import secrets
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from typing import Callable, Dict, Iterator, List, Optional
+
+from review_backend import get_review_backend
+
+# 生成任务配置
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "16"))  # 同时执行的生成任务数
+JOB_EVENT_BUFFER = int(os.getenv("JOB_EVENT_BUFFER", "256"))  # 内存中保留的最近事件数
+JOB_LOG_DIR = os.getenv("JOB_LOG_DIR", "data/jobs")
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "3600"))  # 已结束任务在内存中保留的秒数
+JOB_REVIEW_TIMEOUT = float(os.getenv("JOB_REVIEW_TIMEOUT", "1800"))  # 等待审核的最长时间
+JOB_LOG_POLL_INTERVAL = float(os.getenv("JOB_LOG_POLL_INTERVAL", "0.2"))  # 跟随其他进程的任务日志时的轮询间隔
+JOB_REVIEW_POLL_INTERVAL = float(os.getenv("JOB_REVIEW_POLL_INTERVAL", "0.2"))  # 检查挂起任务审核结果的间隔
+
+# 任务结束时写入日志的最后一条事件
+JOB_END_EVENT = "job_end"
+# 任务写入该事件后挂起，收到审核结果再继续执行
+JOB_REVIEW_EVENT = "review_request"
+# 未结束的任务状态
+JOB_ACTIVE_STATUSES = ("queued", "running", "review")
+# 当前实例，写入共享的任务状态，用于判断任务归属
+JOB_OWNER = {"host": socket.gethostname(), "pid": os.getpid()}
+
+
+def job_review_channel_name(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def job_review_channel(job_id: str):
+    """任务的审核通道，任意 worker 收到的审核结果都经由审核后端送达"""
+    return get_review_backend().channel(job_review_channel_name(job_id))
+
+
+class JobReviewQueue:
+    """任务专用的审核队列，超时未审核视为拒绝
+
+    任务挂起等待审核时由任务管理器从审核通道取出结果放入 inbox，恢复执行后工作流直接读到，
+    不在工作线程中阻塞等待。
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.inbox = Queue()
+
+    def put(self, item):
+        self.channel.put(item)
+
+    def empty(self) -> bool:
+        return self.inbox.empty() and self.channel.empty()
+
+    def get(self, block=True, timeout=None):
+        try:
+            return self.inbox.get_nowait()
+        except Empty:
+            pass
+        try:
+            return self.channel.get(block, JOB_REVIEW_TIMEOUT if timeout is None else timeout)
+        except Empty:
+            if not block:
+                raise
+            print(f"审核等待超过 {JOB_REVIEW_TIMEOUT}s，按拒绝处理")
+            return {"approved": False, "regenerate": False}
+
+
+class Job:
+    """一次生成任务及其只追加的事件日志
+
+    最近的事件保存在有界环形缓冲区中，完整日志写入 jsonl 文件；
+    断线重连落后太多、超出缓冲区时从日志文件补齐。
+    """
+
+    def __init__(self, job_id: str, session_id: Optional[str] = None, log_dir: str = JOB_LOG_DIR,
+                 buffer_size: int = JOB_EVENT_BUFFER):
+        self.id = job_id
+        self.session_id = session_id
+        self.status = None
+        self.set_status("queued")  # queued -> running (-> review -> running) -> done / failed
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.review_queue = JobReviewQueue(job_review_channel(job_id))
+        self.log_path = job_log_path(job_id, log_dir)
+        self._entries = deque(maxlen=max(1, buffer_size))
+        self._count = 0
+        self._cond = threading.Condition()
+        os.makedirs(log_dir, exist_ok=True)
+        self._log_file = open(self.log_path, 'a', encoding='utf-8')
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def set_status(self, status: str):
+        """更新任务状态，并同步到共享后端供其他实例查询"""
+        self.status = status
+        backend = get_review_backend()
+        if backend.shared:
+            try:
+                backend.set_job_status(self.id, status, JOB_OWNER)
+            except Exception as e:
+                print(f"同步任务 {self.id} 状态失败: {e}")
+
+    @property
+    def last_event_id(self) -> int:
+        with self._cond:
+            return self._count
+
+    def append(self, data: Dict, event: Optional[str] = None) -> int:
+        """追加一条事件，返回事件编号（从 1 开始）"""
+        with self._cond:
+            self._count += 1
+            entry = {"id": self._count, "event": event, "data": data}
+            self._entries.append(entry)
+            self._log_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._log_file.flush()
+            self._cond.notify_all()
+            return entry["id"]
+
+    def finish(self, status: str, error: Optional[str] = None):
+        """标记任务结束并写入结束事件"""
+        end = {"status": status}
+        if error:
+            end["error"] = error
+        self.append(end, JOB_END_EVENT)
+        with self._cond:
+            self.error = error
+            self.finished_at = time.time()
+            self.set_status(status)
+            self._log_file.close()
+            self._cond.notify_all()
+
+    def events_after(self, last_id: int, timeout: float) -> List[Dict]:
+        """返回编号大于 last_id 的事件，没有新事件时最多等待 timeout 秒"""
+        with self._cond:
+            if self._count <= last_id and not self.finished:
+                self._cond.wait(timeout)
+            first_id = self._count - len(self._entries) + 1
+            if last_id + 1 >= first_id:
+                return list(itertools.islice(self._entries, last_id + 1 - first_id, None))
+            buffered = list(self._entries)
+        # 缺失的事件已移出缓冲区，从日志文件补齐（这些行已写入并刷新）
+        missed = [entry for entry in read_job_log(self.id, os.path.dirname(self.log_path)) or []
+                  if last_id < entry["id"] < first_id]
+        return missed + buffered
+
+    def info(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "events": self.last_event_id,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+def shared_job_status(job_id: str) -> Optional[Dict]:
+    """经由共享后端查询任务状态（任务可能运行在其他实例上），未使用共享后端时返回 None"""
+    backend = get_review_backend()
+    return backend.get_job_status(job_id) if backend.shared else None
+
+
+def job_log_path(job_id: str, log_dir: str = JOB_LOG_DIR) -> str:
+    return os.path.join(log_dir, f"{job_id}.jsonl")
+
+
+def read_job_log(job_id: str, log_dir: str = JOB_LOG_DIR) -> Optional[List[Dict]]:
+    """读取任务的完整日志文件，不存在时返回 None"""
+    path = job_log_path(job_id, log_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def follow_job_log(job_id: str, last_id: int = 0, idle_timeout: float = 15,
+                   log_dir: str = JOB_LOG_DIR) -> Iterator[Optional[Dict]]:
+    """跟随其他进程正在写入的任务日志，读到结束事件后停止
+
+    产出编号大于 last_id 的事件，连续 idle_timeout 秒没有新事件时产出一次 None。
+    """
+    path = job_log_path(job_id, log_dir)
+    offset = 0
+    partial = b""
+    idle = 0.0
+    while True:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read()
+            offset = f.tell()
+        # 只解析完整的行，写到一半的行留到下次
+        *lines, partial = (partial + chunk).split(b"\n")
+        entries = [json.loads(line) for line in lines if line.strip()]
+        for entry in entries:
+            if entry["id"] > last_id:
+                yield entry
+            if entry["event"] == JOB_END_EVENT:
+                return
+        if entries:
+            idle = 0.0
+            continue
+        time.sleep(JOB_LOG_POLL_INTERVAL)
+        idle += JOB_LOG_POLL_INTERVAL
+        if idle >= idle_timeout:
+            idle = 0.0
+            yield None
+
+
+class JobManager:
+    """在有界线程池中执行生成任务，任务与 HTTP 连接解耦
+
+    任务写出审核请求后挂起并归还工作线程，等待审核的任务不占用线程池；
+    由一个后台线程每轮用一次批量查询找出已有结果的审核通道，只从这些通道取结果，
+    收到结果（或超时）后重新提交执行。
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, retention: float = JOB_RETENTION):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        # 等待审核的任务：job_id -> (任务, 事件迭代器, 超时时刻)
+        self._suspended: Dict[str, tuple] = {}
+        self._review_thread: Optional[threading.Thread] = None
+
+    def submit(self, fn: Callable[..., Iterator[Dict]], *args, session_id: Optional[str] = None, **kwargs) -> Job:
+        """提交任务；fn(job, *args, **kwargs) 返回事件迭代器，每项为 (data, event_name)"""
+        self._prune()
+        job = Job(secrets.token_urlsafe(12), session_id)
+        with self._lock:
+            self._jobs[job.id] = job
+        if session_id:
+            get_review_backend().set_route(session_id, job.id)
+        # 生成器在首次取值前不执行任何代码，挂起后可在其他工作线程中继续
+        self._executor.submit(self._run, job, fn(job, *args, **kwargs))
+        print(f"提交生成任务: {job.id}")
+        return job
+
+    def _run(self, job: Job, events: Iterator):
+        job.set_status("running")
+        try:
+            for data, event in events:
+                job.append(data, event)
+                if event == JOB_REVIEW_EVENT:
+                    self._suspend(job, events)
+                    return
+            job.finish("done")
+        except Exception as e:
+            print(f"生成任务 {job.id} 出错: {e}")
+            job.finish("failed", str(e))
+        if job.session_id:
+            get_review_backend().clear_route(job.session_id, job.id)
+
+    def _suspend(self, job: Job, events: Iterator):
+        """挂起等待审核的任务，工作线程随即返回线程池"""
+        job.set_status("review")
+        with self._lock:
+            self._suspended[job.id] = (job, events, time.monotonic() + JOB_REVIEW_TIMEOUT)
+            if self._review_thread is None:
+                self._review_thread = threading.Thread(target=self._poll_reviews, name="job-review", daemon=True)
+                self._review_thread.start()
+        print(f"任务 {job.id} 等待审核，释放工作线程")
+
+    def _poll_reviews(self):
+        """轮询挂起任务的审核通道，收到审核结果或超时后恢复任务"""
+        backend = get_review_backend()
+        while True:
+            # 本地后端在结果发布时立即唤醒，其他后端按间隔轮询
+            backend.wait_published(JOB_REVIEW_POLL_INTERVAL)
+            with self._lock:
+                suspended = list(self._suspended.values())
+            if not suspended:
+                continue
+            now = time.monotonic()
+            try:
+                ready = backend.ready(job_review_channel_name(job.id) for job, _, _ in suspended)
+            except Exception as e:
+                print(f"查询审核结果出错: {e}")
+                continue
+            for job, events, deadline in suspended:
+                review_data = None
+                if job_review_channel_name(job.id) in ready:
+                    try:
+                        review_data = job.review_queue.channel.get_nowait()
+                    except Empty:
+                        pass  # 已被其他进程取走
+                    except Exception as e:
+                        print(f"读取任务 {job.id} 的审核结果出错: {e}")
+                        continue
+                if review_data is None:
+                    if now < deadline:
+                        continue
+                    print(f"任务 {job.id} 审核等待超过 {JOB_REVIEW_TIMEOUT}s，按拒绝处理")
+                    review_data = {"approved": False, "regenerate": False}
+                with self._lock:
+                    self._suspended.pop(job.id, None)
+                job.review_queue.inbox.put(review_data)
+                self._executor.submit(self._run, job, events)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        """从内存中移除过期的已结束任务，日志文件保留"""
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished_at > self.retention]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"jobs": len(jobs), **counts}
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """获取进程内共享的任务管理器"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
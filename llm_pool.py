@@ -0,0 +1,70 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+# 连接池与超时配置
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+_lock = threading.Lock()
+# 每个 base_url 共享一组同步/异步 HTTP 连接池
+_http_clients: Dict[Optional[str], Tuple[httpx.Client, httpx.AsyncClient]] = {}
+# 每个 (model, base_url, streaming) 配置复用一个 ChatOpenAI 实例
+_llms: Dict[Tuple[str, Optional[str], bool], ChatOpenAI] = {}
+
+
+def _get_http_clients(base_url: Optional[str]) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """获取指定服务地址的连接池（调用方持有锁）"""
+    clients = _http_clients.get(base_url)
+    if clients is None:
+        limits = httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+        )
+        timeout = httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+        clients = (
+            httpx.Client(limits=limits, timeout=timeout),
+            httpx.AsyncClient(limits=limits, timeout=timeout)
+        )
+        _http_clients[base_url] = clients
+    return clients
+
+
+def get_llm(model: str = DEFAULT_MODEL, streaming: bool = False) -> ChatOpenAI:
+    """按配置获取共享的 ChatOpenAI 客户端，同步和异步调用都复用连接池"""
+    base_url = os.getenv("OPENAI_BASE_URL")
+    key = (model, base_url, streaming)
+    with _lock:
+        llm = _llms.get(key)
+        if llm is None:
+            http_client, http_async_client = _get_http_clients(base_url)
+            llm = ChatOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=base_url,
+                model=model,
+                streaming=streaming,
+                timeout=LLM_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+                http_client=http_client,
+                http_async_client=http_async_client
+            )
+            _llms[key] = llm
+        return llm
+
+
+def pool_stats() -> Dict:
+    with _lock:
+        return {
+            "llm_clients": len(_llms),
+            "http_pools": len(_http_clients)
+        }
@@ -0,0 +1,186 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from book_store import get_book_store
+from sse_protocol import accepts_encoding
+
+try:
+    import brotli  # 可选依赖，未安装时只生成 gzip 版本
+except ImportError:
+    brotli = None
+
+# 绘本页面预渲染配置
+PRERENDER_DIR = os.getenv("PRERENDER_DIR", "data/pages")
+PAGE_MAX_AGE = int(os.getenv("PAGE_MAX_AGE", "600"))  # 浏览器缓存页面的秒数，之后用 ETag 校验
+TEMPLATE_DIR = "templates"
+BOOK_TEMPLATE = "storybook.html"
+PAGE_GZIP_LEVEL = 9
+PAGE_BROTLI_QUALITY = 11
+
+# 路径中只允许出现的 book_id 字符（旧 id 含负号，新 id 含下划线）
+_SAFE_ID = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def _static_url_for(endpoint: str, filename: str = "", **values) -> str:
+    """预渲染时代替 Flask 的 url_for('static', filename=...)"""
+    return f"/static/{filename}"
+
+
+# 与 Flask 的 render_template 一样对 .html 模板自动转义
+_env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(["html"]))
+_env.globals["url_for"] = _static_url_for
+
+_template_version: Optional[str] = None
+_version_lock = threading.Lock()
+
+
+def template_version() -> str:
+    """模板内容的摘要，模板改动后已预渲染的页面视为过期"""
+    global _template_version
+    with _version_lock:
+        if _template_version is None:
+            with open(os.path.join(TEMPLATE_DIR, BOOK_TEMPLATE), 'rb') as f:
+                _template_version = hashlib.sha256(f.read()).hexdigest()[:16]
+        return _template_version
+
+
+def render_book(book: Dict) -> str:
+    return _env.get_template(BOOK_TEMPLATE).render(title=book['title'], story=book['story'], scenes=book['scenes'])
+
+
+def _page_base(book_id: str, pages_dir: str = PRERENDER_DIR) -> str:
+    # 按 id 摘要分散到子目录，避免单个目录下文件过多
+    shard = hashlib.sha1(book_id.encode("utf-8")).hexdigest()[:2]
+    return os.path.join(pages_dir, shard, book_id)
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def prerender_book(book_id: str, book: Dict, pages_dir: str = PRERENDER_DIR) -> Dict:
+    """渲染绘本页面并写入 html 以及 gzip/brotli 压缩版本，返回页面元数据"""
+    html = render_book(book).encode("utf-8")
+    base = _page_base(book_id, pages_dir)
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+
+    encodings = {"identity": html, "gzip": gzip.compress(html, PAGE_GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        encodings["br"] = brotli.compress(html, quality=PAGE_BROTLI_QUALITY)
+    for encoding, data in encodings.items():
+        _write_atomic(_variant_path(base, encoding), data)
+
+    meta = {
+        "book_id": book_id,
+        "etag": hashlib.sha256(html).hexdigest()[:32],
+        "template": template_version(),
+        "encodings": sorted(encodings),
+        "rendered_at": time.time()
+    }
+    # 元数据最后写入，读到元数据时各版本文件都已就绪
+    _write_atomic(f"{base}.meta.json", json.dumps(meta).encode("utf-8"))
+    return meta
+
+
+def _variant_path(base: str, encoding: str) -> str:
+    return {"identity": f"{base}.html", "gzip": f"{base}.html.gz", "br": f"{base}.html.br"}[encoding]
+
+
+def _load_meta(book_id: str, pages_dir: str) -> Optional[Dict]:
+    try:
+        with open(f"{_page_base(book_id, pages_dir)}.meta.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_page(book_id: str, pages_dir: str = PRERENDER_DIR) -> Optional[Dict]:
+    """返回绘本的预渲染页面元数据；缺失或模板已变化时立即重新渲染，绘本不存在时返回 None"""
+    if not _SAFE_ID.match(book_id):
+        return None
+    meta = _load_meta(book_id, pages_dir)
+    if meta is not None and meta.get("template") == template_version():
+        return meta
+    book = get_book_store().get(book_id)
+    if book is None:
+        return None
+    return prerender_book(book_id, book, pages_dir)
+
+
+def select_variant(meta: Dict, accept_encoding: str, pages_dir: str = PRERENDER_DIR) -> Tuple[str, Optional[str], str]:
+    """按客户端的 Accept-Encoding 选择页面版本，返回 (文件路径, Content-Encoding, 强 ETag)"""
+    base = _page_base(meta["book_id"], pages_dir)
+    for encoding in ("br", "gzip"):
+        if encoding in meta["encodings"] and accepts_encoding(accept_encoding, encoding):
+            # 不同编码是不同的表示，ETag 必须不同
+            return _variant_path(base, encoding), encoding, f'"{meta["etag"]}-{encoding}"'
+    return _variant_path(base, "identity"), None, f'"{meta["etag"]}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 是否命中（弱比较，忽略 W/ 前缀）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def page_headers(etag: str, encoding: Optional[str]) -> Dict:
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={PAGE_MAX_AGE}",
+        "Vary": "Accept-Encoding"
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return headers
+
+
+def rebuild(force: bool = False, pages_dir: str = PRERENDER_DIR) -> Dict:
+    """增量重建：只重新渲染缺失或由旧模板渲染的页面，force 时全部重建"""
+    rendered = unchanged = failed = 0
+    store = get_book_store()
+    version = template_version()
+    for book_id in store.iter_ids():
+        if not _SAFE_ID.match(book_id):
+            failed += 1
+            continue
+        meta = None if force else _load_meta(book_id, pages_dir)
+        if meta is not None and meta.get("template") == version:
+            unchanged += 1
+            continue
+        try:
+            prerender_book(book_id, store.get(book_id), pages_dir)
+            rendered += 1
+        except Exception as e:
+            print(f"预渲染绘本 {book_id} 失败: {e}")
+            failed += 1
+    return {"rendered": rendered, "unchanged": unchanged, "failed": failed}
+
+
+if __name__ == '__main__':
+    # 用法：python prerender.py rebuild [--force]
+    parser = argparse.ArgumentParser(description="绘本页面预渲染")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = commands.add_parser("rebuild", help="重新渲染缺失或模板已变化的页面")
+    rebuild_parser.add_argument("--force", action="store_true", help="忽略模板版本，全部重新渲染")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        started = time.time()
+        summary = rebuild(args.force)
+        print(f"预渲染完成: 渲染 {summary['rendered']}，无需更新 {summary['unchanged']}，"
+              f"失败 {summary['failed']}，耗时 {time.time() - started:.1f}s")
@@ -0,0 +1,400 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from queue import Empty, Queue
+from typing import Dict, Iterable, Optional, Set
+
+# 审核结果与会话路由的存储后端：local 仅限单进程，sqlite 供同机多进程，redis 供多机部署
+REVIEW_BACKEND = os.getenv("REVIEW_BACKEND", "local").lower()
+REVIEW_DB_PATH = os.getenv("REVIEW_DB_PATH", "data/review.sqlite3")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REVIEW_POLL_INTERVAL = float(os.getenv("REVIEW_POLL_INTERVAL", "0.2"))  # sqlite 后端的轮询间隔（秒）
+REVIEW_MESSAGE_TTL = float(os.getenv("REVIEW_MESSAGE_TTL", "3600"))  # 未被取走的审核结果和路由保留时间
+
+
+class ReviewChannel:
+    """跨进程的审核通道，接口与 queue.Queue 的常用部分一致
+
+    每条审核结果只会被一个等待者取走，等待者订阅之前发布的结果不会丢失。
+    """
+
+    def __init__(self, backend: "ReviewBackend", name: str):
+        self.backend = backend
+        self.name = name
+
+    def put(self, decision: Dict):
+        self.backend.publish(self.name, decision)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Dict:
+        decision = self.backend.receive(self.name, timeout if block else 0)
+        if decision is None:
+            raise Empty
+        return decision
+
+    def get_nowait(self) -> Dict:
+        return self.get(False)
+
+    def empty(self) -> bool:
+        return not self.backend.pending(self.name)
+
+
+class ReviewBackend(ABC):
+    """审核后端基类"""
+
+    # 多个进程是否共享同一份数据
+    shared = True
+
+    def channel(self, name: str):
+        return ReviewChannel(self, name)
+
+    @abstractmethod
+    def publish(self, name: str, decision: Dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def receive(self, name: str, timeout: Optional[float]) -> Optional[Dict]:
+        """取走一条审核结果，timeout 为 None 时一直等待，超时返回 None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def pending(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def ready(self, names: Iterable[str]) -> Set[str]:
+        """返回其中有待取审核结果的通道名，供批量轮询使用"""
+        return {name for name in names if self.pending(name)}
+
+    def wait_published(self, timeout: float):
+        """等待新的审核结果发布，最多 timeout 秒；无法得到通知的后端直接休眠"""
+        time.sleep(timeout)
+
+    def set_route(self, session_id: str, job_id: str):
+        """记录会话当前的生成任务，其他进程收到的审核据此转发"""
+
+    def get_route(self, session_id: str) -> Optional[str]:
+        return None
+
+    def clear_route(self, session_id: str, job_id: str):
+        """任务结束后移除路由（仅当路由仍指向该任务时）"""
+
+    def set_job_status(self, job_id: str, status: str, owner: Dict):
+        """记录任务状态和所在实例，其他进程据此判断任务是否仍在运行"""
+
+    def get_job_status(self, job_id: str) -> Optional[Dict]:
+        """返回 {"status", "host", "pid"}，未知的任务返回 None"""
+        return None
+
+    def stats(self) -> Dict:
+        return {"backend": type(self).__name__}
+
+
+class _LocalChannel(Queue):
+    """放入审核结果时通知等待中的轮询方"""
+
+    def __init__(self, published: threading.Event):
+        super().__init__()
+        self._published = published
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self._published.set()
+
+
+class LocalReviewBackend(ReviewBackend):
+    """进程内后端：直接返回 Queue，会话路由由本进程的会话记录保存"""
+
+    shared = False
+
+    def __init__(self):
+        self._queues = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._published = threading.Event()
+
+    def channel(self, name: str) -> Queue:
+        # 队列由持有它的会话或任务保持存活，不再被引用时自动回收
+        with self._lock:
+            queue = self._queues.get(name)
+            if queue is None:
+                queue = _LocalChannel(self._published)
+                self._queues[name] = queue
+            return queue
+
+    def publish(self, name: str, decision: Dict):
+        self.channel(name).put(decision)
+
+    def receive(self, name: str, timeout: Optional[float]) -> Optional[Dict]:
+        try:
+            return self.channel(name).get(timeout != 0, timeout or None)
+        except Empty:
+            return None
+
+    def pending(self, name: str) -> bool:
+        return not self.channel(name).empty()
+
+    def wait_published(self, timeout: float):
+        # 先清除再由调用方检查各通道，清除之后放入的结果会再次置位
+        self._published.wait(timeout)
+        self._published.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"backend": "local", "channels": len(self._queues)}
+
+
+class SQLiteReviewBackend(ReviewBackend):
+    """基于 SQLite 的后端，同一台机器上的多个 worker 共享同一个数据库文件"""
+
+    def __init__(self, path: str = REVIEW_DB_PATH, poll_interval: float = REVIEW_POLL_INTERVAL,
+                 ttl: float = REVIEW_MESSAGE_TTL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+        self.published = 0
+        self.received = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # 手动管理事务，取消息时用 BEGIN IMMEDIATE 保证只被一个进程取走
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS review_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_review_messages_channel ON review_messages (channel, id)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS review_routes (
+                session_id TEXT PRIMARY KEY,
+                job_id TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS review_jobs (
+                job_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def publish(self, name: str, decision: Dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM review_messages WHERE created_at < ?", (now - self.ttl,))
+                self._conn.execute(
+                    "INSERT INTO review_messages (channel, payload, created_at) VALUES (?, ?, ?)",
+                    (name, json.dumps(decision, ensure_ascii=False), now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.published += 1
+
+    def _take(self, name: str) -> Optional[Dict]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, payload FROM review_messages WHERE channel = ? ORDER BY id LIMIT 1", (name,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("DELETE FROM review_messages WHERE id = ?", (row[0],))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if row is None:
+                return None
+            self.received += 1
+            return json.loads(row[1])
+
+    def receive(self, name: str, timeout: Optional[float]) -> Optional[Dict]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            decision = self._take(name)
+            if decision is not None:
+                return decision
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            wait = self.poll_interval if deadline is None else min(self.poll_interval, deadline - time.monotonic())
+            time.sleep(max(0.0, wait))
+
+    def pending(self, name: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM review_messages WHERE channel = ? LIMIT 1", (name,)).fetchone()
+        return row is not None
+
+    def ready(self, names: Iterable[str]) -> Set[str]:
+        # 每批一次查询，避免逐个通道加锁查询；分批以免超出 SQLite 的参数个数上限
+        names = list(names)
+        found = set()
+        with self._lock:
+            for start in range(0, len(names), 500):
+                batch = names[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT DISTINCT channel FROM review_messages WHERE channel IN ({placeholders})", batch
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def set_route(self, session_id: str, job_id: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM review_routes WHERE updated_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO review_routes (session_id, job_id, updated_at) VALUES (?, ?, ?)",
+                (session_id, job_id, now)
+            )
+
+    def get_route(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, updated_at FROM review_routes WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return row[0]
+
+    def clear_route(self, session_id: str, job_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM review_routes WHERE session_id = ? AND job_id = ?", (session_id, job_id))
+
+    def set_job_status(self, job_id: str, status: str, owner: Dict):
+        now = time.time()
+        payload = json.dumps({"status": status, **owner}, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute("DELETE FROM review_jobs WHERE updated_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO review_jobs (job_id, payload, updated_at) VALUES (?, ?, ?)",
+                (job_id, payload, now)
+            )
+
+    def get_job_status(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, updated_at FROM review_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            waiting = self._conn.execute("SELECT COUNT(*) FROM review_messages").fetchone()[0]
+            routes = self._conn.execute("SELECT COUNT(*) FROM review_routes").fetchone()[0]
+            return {
+                "backend": "sqlite",
+                "waiting": waiting,
+                "routes": routes,
+                "published": self.published,
+                "received": self.received
+            }
+
+
+class RedisReviewBackend(ReviewBackend):
+    """基于 Redis 的后端，适用于多机部署
+
+    审核结果写入列表并用 BLPOP 取走，而不是 PUBLISH/SUBSCRIBE：
+    发布时等待者尚未订阅的消息不会丢失，且只会被一个 worker 取走。
+    """
+
+    def __init__(self, url: str = REDIS_URL, ttl: float = REVIEW_MESSAGE_TTL, prefix: str = "storybook:review:"):
+        import redis  # 可选依赖，仅在使用该后端时需要
+
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.published = 0
+        self.received = 0
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}channel:{name}"
+
+    def _route_key(self, session_id: str) -> str:
+        return f"{self.prefix}route:{session_id}"
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}job:{job_id}"
+
+    def publish(self, name: str, decision: Dict):
+        key = self._key(name)
+        pipe = self._redis.pipeline()
+        pipe.rpush(key, json.dumps(decision, ensure_ascii=False))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+        self.published += 1
+
+    def receive(self, name: str, timeout: Optional[float]) -> Optional[Dict]:
+        if timeout == 0:
+            payload = self._redis.lpop(self._key(name))
+        else:
+            item = self._redis.blpop([self._key(name)], timeout=timeout or 0)
+            payload = item[1] if item else None
+        if payload is None:
+            return None
+        self.received += 1
+        return json.loads(payload)
+
+    def pending(self, name: str) -> bool:
+        return self._redis.llen(self._key(name)) > 0
+
+    def ready(self, names: Iterable[str]) -> Set[str]:
+        # 一次往返查询所有通道的长度
+        names = list(names)
+        if not names:
+            return set()
+        pipe = self._redis.pipeline(transaction=False)
+        for name in names:
+            pipe.llen(self._key(name))
+        return {name for name, length in zip(names, pipe.execute()) if length}
+
+    def set_route(self, session_id: str, job_id: str):
+        self._redis.set(self._route_key(session_id), job_id, ex=self.ttl)
+
+    def get_route(self, session_id: str) -> Optional[str]:
+        return self._redis.get(self._route_key(session_id))
+
+    def clear_route(self, session_id: str, job_id: str):
+        key = self._route_key(session_id)
+        if self._redis.get(key) == job_id:
+            self._redis.delete(key)
+
+    def set_job_status(self, job_id: str, status: str, owner: Dict):
+        self._redis.set(self._job_key(job_id), json.dumps({"status": status, **owner}), ex=self.ttl)
+
+    def get_job_status(self, job_id: str) -> Optional[Dict]:
+        payload = self._redis.get(self._job_key(job_id))
+        return json.loads(payload) if payload else None
+
+    def stats(self) -> Dict:
+        return {"backend": "redis", "published": self.published, "received": self.received}
+
+
+_backend: Optional[ReviewBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_review_backend() -> ReviewBackend:
+    """按 REVIEW_BACKEND 创建进程内共享的审核后端"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if REVIEW_BACKEND == "sqlite":
+                _backend = SQLiteReviewBackend()
+            elif REVIEW_BACKEND == "redis":
+                _backend = RedisReviewBackend()
+            else:
+                _backend = LocalReviewBackend()
+            print(f"审核后端: {type(_backend).__name__}")
+        return _backend
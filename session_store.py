@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+# 会话存储配置
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(30 * 60)))  # 会话空闲多久后过期（秒）
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))  # 会话数量上限，超出时淘汰最久未访问的
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "60"))  # 后台清理间隔（秒）
+
+
+class SessionRecord:
+    """单个会话的工作流状态"""
+
+    __slots__ = ("session_id", "workflow", "review_queue", "generation_job", "created_at", "last_access")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.workflow = None  # 正在进行的工作流标识，None 表示空闲
+        self.review_queue = None  # 审核队列，首次使用时从审核后端获取
+        self.generation_job = None  # 当前生成任务的 job_id
+        self.created_at = self.last_access = time.monotonic()
+
+
+class SessionStore:
+    """按最近访问时间排序的会话表，线程安全
+
+    过期时间随访问顺延，因此访问顺序就是过期顺序：过期清理和超量淘汰
+    都只从队头弹出，均摊 O(1)。is_active 判定为运行中的会话不会被清理。
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = SESSION_MAX,
+                 is_active: Optional[Callable[[SessionRecord], bool]] = None):
+        self.ttl = ttl
+        self.max_sessions = max(1, max_sessions)
+        self.is_active = is_active or (lambda record: False)
+        self._sessions: "OrderedDict[str, SessionRecord]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, session_id: str, create: bool = True) -> Optional[SessionRecord]:
+        """获取会话并刷新访问时间，不存在时按需创建"""
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is not None:
+                record.last_access = time.monotonic()
+                self._sessions.move_to_end(session_id)
+                return record
+            if not create:
+                return None
+            record = SessionRecord(session_id)
+            self._sessions[session_id] = record
+            self.created += 1
+            self._evict()
+            return record
+
+    def _evict(self):
+        """超出上限时淘汰最久未访问的空闲会话（调用方持有锁）"""
+        checked = 0
+        while len(self._sessions) > self.max_sessions and checked < len(self._sessions):
+            session_id, record = next(iter(self._sessions.items()))
+            checked += 1
+            if self.is_active(record):
+                self._sessions.move_to_end(session_id)
+                continue
+            del self._sessions[session_id]
+            self.evicted += 1
+
+    def reap(self) -> int:
+        """清理过期会话，返回清理数量"""
+        now = time.monotonic()
+        removed = 0
+        with self._lock:
+            while self._sessions:
+                session_id, record = next(iter(self._sessions.items()))
+                if now - record.last_access <= self.ttl:
+                    break
+                if self.is_active(record):
+                    # 运行中的会话顺延到队尾
+                    record.last_access = now
+                    self._sessions.move_to_end(session_id)
+                    continue
+                del self._sessions[session_id]
+                removed += 1
+            self.expired += removed
+        if removed:
+            print(f"清理过期会话: {removed} 个")
+        return removed
+
+    def start_reaper(self, interval: float = SESSION_REAP_INTERVAL):
+        """启动后台清理线程"""
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, args=(interval,), name="session-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"清理会话出错: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted
+            }
@@ -0,0 +1,85 @@
+import json
+import os
+import zlib
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, Optional
+
+# 事件协议版本：2 起 story_update 以增量方式发送
+SSE_PROTOCOL_VERSION = 2
+# 是否对事件流启用 gzip（客户端需支持）
+SSE_GZIP = os.getenv("SSE_GZIP", "false").lower() == "true"
+GZIP_LEVEL = 6
+
+
+def format_event(payload: Dict, event: Optional[str] = None, event_id: Optional[int] = None) -> str:
+    """把事件序列化为 SSE 文本，带编号时客户端重连会通过 Last-Event-ID 带回"""
+    data = json.dumps(payload, ensure_ascii=False)
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    if event:
+        return f"{prefix}event: {event}\ndata: {data}\n\n"
+    return f"{prefix}data: {data}\n\n"
+
+
+class StoryDeltaEncoder:
+    """把携带完整故事的 story_update 转换为增量事件
+
+    增量事件只包含 offset 和新追加的 delta；连接开始后的第一条、
+    完成时以及内容不再是已发送文本的延续时（如重新生成）发送完整快照。
+    """
+
+    def __init__(self):
+        self._sent = ""
+
+    def reset(self):
+        """丢弃已发送的基准，下一条更新发送快照"""
+        self._sent = ""
+
+    def encode(self, update: Dict) -> Dict:
+        content = update.get("content", "")
+        completed = update.get("completed", False)
+        base = {key: value for key, value in update.items() if key != "content"}
+        base["protocol"] = SSE_PROTOCOL_VERSION
+
+        if completed or not self._sent or not content.startswith(self._sent):
+            self._sent = content
+            return {**base, "mode": "snapshot", "offset": 0, "content": content}
+
+        offset = len(self._sent)
+        self._sent = content
+        return {**base, "mode": "delta", "offset": offset, "delta": content[offset:]}
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """客户端的 Accept-Encoding 是否允许指定的内容编码"""
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() not in (encoding, "*"):
+            continue
+        name, _, value = params.strip().partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """客户端的 Accept-Encoding 是否允许 gzip"""
+    return accepts_encoding(accept_encoding, "gzip")
+
+
+def gzip_stream(events: Iterable[str], level: int = GZIP_LEVEL) -> Iterator[bytes]:
+    """逐条压缩事件，每条之后同步刷新，保证客户端能立即解压出完整事件"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for event in events:
+        yield compressor.compress(event.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush(zlib.Z_FINISH)
+
+
+async def agzip_stream(events: AsyncIterable[str], level: int = GZIP_LEVEL) -> AsyncIterator[bytes]:
+    """gzip_stream 的异步版本"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for event in events:
+        yield compressor.compress(event.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush(zlib.Z_FINISH)
@@ -0,0 +1,102 @@
+from typing import Dict, List
+
+# 结构化输出使用的工具名称
+STORY_TOOL_NAME = "create_storybook"
+
+# 一次调用同时返回故事、角色特征和场景，字段顺序即模型的输出顺序
+STORY_TOOL = {
+    "type": "function",
+    "function": {
+        "name": STORY_TOOL_NAME,
+        "description": "提交完整的儿童绘本：故事正文、主要角色特征和分场景图像提示词",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "story": {
+                    "type": "string",
+                    "description": "完整的故事正文，段落之间用空行分隔"
+                },
+                "character": {
+                    "type": "object",
+                    "description": "故事主要角色的外观特征",
+                    "properties": {
+                        "name": {"type": "string", "description": "人物名称"},
+                        "appearance": {"type": "string", "description": "物种，体型，年龄特征"},
+                        "colors": {"type": "string", "description": "主体颜色，局部颜色，花纹特征"},
+                        "clothing": {"type": "string", "description": "服装类型，配饰细节，服装风格"},
+                        "expression": {"type": "string", "description": "表情特征，姿态特点，动作特征"}
+                    },
+                    "required": ["name", "appearance", "colors", "clothing", "expression"],
+                    "additionalProperties": False
+                },
+                "scenes": {
+                    "type": "array",
+                    "description": "按故事顺序划分的场景",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "text": {"type": "string", "description": "场景对应的故事原文"},
+                            "characters": {"type": "array", "items": {"type": "string"}},
+                            "image_prompt": {"type": "string", "description": "详细的英文图像提示词"}
+                        },
+                        "required": ["text", "characters", "image_prompt"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["story", "character", "scenes"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+def build_structured_prompt(outline: str) -> str:
+    """构建结构化输出模式的提示词"""
+    return f"""
+    你是一个专业的儿童绘本创作者。请根据以下大纲创作绘本，并调用 {STORY_TOOL_NAME} 工具提交结果。
+
+    故事要求：
+    - 故事生动有趣，富有想象力
+    - 语言简单易懂，适合朗读
+    - 适合3-6岁儿童阅读
+    - 故事篇幅适中，200字以内，分3个场景
+    - 每个场景都要有明确的环境描写
+
+    角色要求：
+    - 为主要角色提供详细、稳定的外观特征，保证各场景图片中形象一致
+
+    场景要求：
+    - 将故事分成3个关键场景，text 使用故事原文
+    - image_prompt 使用英文，童话风格，可爱温馨
+    - image_prompt 包含主要角色的外观特征、动作、环境、氛围和关键元素
+
+    大纲：{outline}
+    """
+
+
+def format_character_features(character: Dict) -> str:
+    """把结构化的角色特征转换为原有的文本格式"""
+    return (
+        f"主要人物：{character.get('name', '')}\n"
+        f"- 基础外观：{character.get('appearance', '')}\n"
+        f"- 颜色特征：{character.get('colors', '')}\n"
+        f"- 服装配饰：{character.get('clothing', '')}\n"
+        f"- 表情姿态：{character.get('expression', '')}"
+    )
+
+
+def validate_storybook(data: Dict) -> List[str]:
+    """检查完整结果是否包含必需字段，返回问题列表"""
+    problems = []
+    if not isinstance(data.get("story"), str) or not data["story"].strip():
+        problems.append("缺少故事正文")
+    if not isinstance(data.get("character"), dict) or not data["character"].get("name"):
+        problems.append("缺少角色特征")
+    scenes = data.get("scenes")
+    if not isinstance(scenes, list) or not scenes:
+        problems.append("缺少场景")
+    elif any(not isinstance(scene, dict) or not scene.get("text") or not scene.get("image_prompt")
+             for scene in scenes):
+        problems.append("场景缺少正文或图像提示词")
+    return problems
@@ -1,8 +1,8 @@
 import os
 import json
 import requests
-import time
 from typing import List, Dict
+from dashscope_client import generate_image_sync, IMAGE_MODEL, IMAGE_SIZE, IMAGE_N
 
 class StorybookGenerator:
     def __init__(self):
@@ -77,41 +77,15 @@ class StorybookGenerator:
 
     def generate_image(self, prompt: str, negative_prompt: str) -> str:
         """使用 wanx2.1-t2i-turbo 生成图片"""
-        url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text2image/image-synthesis"
-        
-        headers = {
-            "X-DashScope-Async": "enable",
-            "Authorization": f"Bearer {self.dashscope_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": "wanx2.1-t2i-turbo",
-            "input": {
-                "prompt": prompt,
-                "negative_prompt": negative_prompt
-            },
-            "parameters": {
-                "size": "1024*1024",
-                "n": 1
-            }
-        }
-        
-        response = requests.post(url, headers=headers, json=data)
-        task_id = response.json().get("output", {}).get("task_id")
-        
-        # 轮询检查任务状态
-        while True:
-            status_response = requests.get(
-                f"https://dashscope.aliyuncs.com/api/v1/tasks/{task_id}",
-                headers={"Authorization": f"Bearer {self.dashscope_api_key}"}
-            )
-            result = status_response.json()
-            
-            if result.get("output", {}).get("task_status") == "SUCCEEDED":
-                return result.get("output", {}).get("results", [{}])[0].get("url", "")
-            
-            time.sleep(2)
+        # 通过共享的异步客户端提交任务并自适应轮询，失败或超时抛出 ImageGenerationError
+        return generate_image_sync(
+            self.dashscope_api_key,
+            prompt,
+            negative_prompt,
+            model=IMAGE_MODEL,
+            size=IMAGE_SIZE,
+            n=IMAGE_N
+        )
 
     def create_storybook(self, outline: str) -> Dict:
         """生成完整的绘本"""
@@ -0,0 +1,199 @@
+import json
+import re
+import time
+from typing import Dict, List
+
+
+class StreamFormatError(ValueError):
+    """流式输出的格式无法解析"""
+
+
+class SceneStreamParser:
+    """增量解析 LLM 流式输出中的 {"scenes": [...]}，每个场景对象完整后立即返回
+
+    只扫描新到达的字符，不会重复解析已处理的内容。数组元素之间的逗号、
+    空白和 // 注释会被忽略。
+    """
+
+    SCENES_KEY = '"scenes"'
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._phase = "seek_key"  # seek_key -> seek_array -> array -> done
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._in_comment = False
+        self._object_start = None
+        self.scene_count = 0
+
+    @property
+    def done(self) -> bool:
+        return self._phase == "done"
+
+    def feed(self, text: str) -> List[Dict]:
+        """追加一段输出，返回本次新解析出的完整场景对象"""
+        self._buffer += text
+        scenes = []
+        while self._pos < len(self._buffer) and self._phase != "done":
+            if self._phase == "seek_key":
+                index = self._buffer.find(self.SCENES_KEY, self._pos)
+                if index < 0:
+                    # 保留可能被截断的键名前缀
+                    self._pos = max(self._pos, len(self._buffer) - len(self.SCENES_KEY) + 1)
+                    break
+                self._pos = index + len(self.SCENES_KEY)
+                self._phase = "seek_array"
+            elif self._phase == "seek_array":
+                char = self._buffer[self._pos]
+                self._pos += 1
+                if char == "[":
+                    self._phase = "array"
+                elif char not in " \t\r\n:":
+                    raise StreamFormatError(f"scenes 后应为数组，实际为 {char!r}")
+            else:
+                scene = self._scan_array()
+                if scene is not None:
+                    scenes.append(scene)
+
+        # 已解析的部分不再需要保留
+        if self._object_start is None and self._pos > 0:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        return scenes
+
+    def _scan_array(self):
+        """扫描数组内容，遇到完整对象时返回解析结果"""
+        while self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+            self._pos += 1
+
+            if self._depth == 0:
+                if self._in_comment:
+                    self._in_comment = char != "\n"
+                elif char == "{":
+                    self._depth = 1
+                    self._object_start = self._pos - 1
+                elif char == "]":
+                    self._phase = "done"
+                    return None
+                elif char == "/":
+                    self._in_comment = True
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    text = self._buffer[self._object_start:self._pos]
+                    self._object_start = None
+                    try:
+                        scene = json.loads(text, strict=False)
+                    except json.JSONDecodeError as e:
+                        raise StreamFormatError(f"场景对象无法解析: {e}") from e
+                    self.scene_count += 1
+                    return scene
+        return None
+
+
+STORY_FEATURE_SEPARATOR = '---角色特征---'
+DEFAULT_CHARACTER_NAME = "主角"
+
+
+class StoryFeatureParser:
+    """增量分离故事正文与角色特征，分隔符可以跨块出现
+
+    正文始终只追加：开头的空白被丢弃，结尾的空白和可能是分隔符前缀的内容
+    暂不输出，因此任意时刻的 story 都是最终结果（等价于 strip 后）的前缀。
+    """
+
+    def __init__(self, separator: str = STORY_FEATURE_SEPARATOR):
+        self.separator = separator
+        self._story_parts = []
+        self.story_length = 0
+        self._pending_space = ""
+        self._tail = ""
+        self._feature_parts = []
+        self.has_features = False
+        self.character_features = ""
+        self.character_name = DEFAULT_CHARACTER_NAME
+
+    def feed(self, chunk: str):
+        """追加一块输出"""
+        if self.has_features:
+            self._feature_parts.append(chunk)
+            return
+
+        text = self._tail + chunk
+        index = text.find(self.separator)
+        if index >= 0:
+            self._append_story(text[:index])
+            self._tail = ""
+            self.has_features = True
+            self._feature_parts.append(text[index + len(self.separator):])
+            return
+
+        # 保留末尾可能构成分隔符开头的部分，等下一块再判断
+        keep = 0
+        for size in range(min(len(self.separator) - 1, len(text)), 0, -1):
+            if text.endswith(self.separator[:size]):
+                keep = size
+                break
+        self._append_story(text[:len(text) - keep])
+        self._tail = text[len(text) - keep:]
+
+    @property
+    def story(self) -> str:
+        return "".join(self._story_parts)
+
+    def _append_story(self, text: str):
+        if not self.story_length:
+            text = text.lstrip()
+        combined = self._pending_space + text
+        body = combined.rstrip()
+        self._pending_space = combined[len(body):]
+        if body:
+            self._story_parts.append(body)
+            self.story_length += len(body)
+
+    def finish(self):
+        """输出结束后调用，只在这里解析一次角色特征"""
+        if not self.has_features and self._tail:
+            self._append_story(self._tail)
+            self._tail = ""
+        if self.has_features:
+            self.character_features = "".join(self._feature_parts).strip()
+            name_match = re.search(r'主要人物：([^\n]+)', self.character_features)
+            self.character_name = name_match.group(1).strip() if name_match else DEFAULT_CHARACTER_NAME
+
+
+class UpdateCoalescer:
+    """按时间窗口或新增字符数合并界面更新"""
+
+    def __init__(self, interval: float, min_chars: int):
+        self.interval = interval
+        self.min_chars = min_chars
+        self._last_time = 0.0
+        self._last_length = 0
+
+    def ready(self, length: int) -> bool:
+        """内容有增长且距上次更新超过时间窗口或字符阈值时返回 True"""
+        if length <= self._last_length:
+            return False
+        now = time.monotonic()
+        if now - self._last_time >= self.interval or length - self._last_length >= self.min_chars:
+            self._last_time = now
+            self._last_length = length
+            return True
+        return False
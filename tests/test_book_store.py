@@ -0,0 +1,63 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book_store import BookStore, tokenize
+
+
+def make_store(tmp_path):
+    store = BookStore(str(tmp_path / "books.sqlite3"), legacy_dir=None)
+    store.save({"title": "小白兔找妈妈", "outline": "", "story": "小白兔在森林里迷路了。", "scenes": []}, "b1", 1.0)
+    store.save({"title": "月亮船", "outline": "", "story": "小熊坐着月亮船去旅行。", "scenes": []}, "b2", 2.0)
+    store.save({"title": "兔子的胡萝卜", "outline": "", "story": "兔子种了一根胡萝卜。", "scenes": []}, "b3", 3.0)
+    return store
+
+
+def ids(result):
+    return sorted(book["book_id"] for book in result["books"])
+
+
+def test_tokenize_query_and_index_terms():
+    assert tokenize("小白兔") == ["小白", "白兔"]
+    assert tokenize("兔") == ["兔"]
+    assert sorted(tokenize("小白兔", unigrams=True)) == sorted(["小白", "白兔", "小", "白", "兔"])
+
+
+def test_single_character_query(tmp_path):
+    store = make_store(tmp_path)
+    result = store.search("兔")
+    assert result["total"] == 2
+    assert ids(result) == ["b1", "b3"]
+    assert ids(store.search("船")) == ["b2"]
+
+
+def test_two_character_query(tmp_path):
+    store = make_store(tmp_path)
+    assert ids(store.search("白兔")) == ["b1"]
+    assert ids(store.search("兔子")) == ["b3"]
+    assert ids(store.search("小白兔")) == ["b1"]
+    assert store.search("老虎")["total"] == 0
+
+
+def test_old_index_is_rebuilt_on_open(tmp_path):
+    store = make_store(tmp_path)
+    # 模拟旧版本只收录两字词的索引
+    with store._lock:
+        store._conn.execute("DELETE FROM book_terms WHERE length(term) = 1")
+        store._conn.execute("PRAGMA user_version = 1")
+        store._conn.commit()
+    assert store.search("兔")["total"] == 0
+    reopened = BookStore(store.path, legacy_dir=None)
+    assert ids(reopened.search("兔")) == ["b1", "b3"]
+
+
+def test_new_store_imports_legacy_books(tmp_path):
+    legacy_dir = tmp_path / "legacy"
+    legacy_dir.mkdir()
+    book = {"title": "小猪盖房子", "outline": "", "story": "小猪用砖头盖了房子。", "scenes": []}
+    (legacy_dir / "book_1700000000_ab12.json").write_text(json.dumps(book, ensure_ascii=False), encoding="utf-8")
+    store = BookStore(str(tmp_path / "books.sqlite3"), legacy_dir=str(legacy_dir))
+    assert [b["book_id"] for b in store.list_books()["books"]] == ["1700000000_ab12"]
+    assert ids(store.search("盖房子")) == ["1700000000_ab12"]
@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_cache import ImageCache
+
+
+def make_images(tmp_path, count):
+    images_dir = tmp_path / "images"
+    images_dir.mkdir()
+    for i in range(count):
+        (images_dir / f"{i}.png").write_bytes(b"x" * 100)
+    return str(images_dir)
+
+
+def test_entries_are_shared_between_instances(tmp_path):
+    images_dir = make_images(tmp_path, 1)
+    path = str(tmp_path / "cache.sqlite3")
+    writer = ImageCache(path, images_dir, legacy_index=None)
+    reader = ImageCache(path, images_dir, legacy_index=None)
+    writer.put("k0", "/static/images/0.png")
+    assert reader.get("k0") == "/static/images/0.png"
+
+
+def test_evicts_least_recently_used(tmp_path):
+    images_dir = make_images(tmp_path, 4)
+    cache = ImageCache(str(tmp_path / "cache.sqlite3"), images_dir, max_entries=3, legacy_index=None)
+    for i in range(3):
+        cache.put(f"k{i}", f"/static/images/{i}.png")
+    assert cache.get("k0")
+    cache.put("k3", "/static/images/3.png")
+    assert cache.get("k1") is None
+    assert sorted(cache.paths()) == ["/static/images/0.png", "/static/images/2.png", "/static/images/3.png"]
+
+
+def test_imports_legacy_json_index(tmp_path):
+    images_dir = make_images(tmp_path, 1)
+    legacy = tmp_path / "index.json"
+    legacy.write_text(json.dumps({"k0": {"path": "/static/images/0.png", "size": 100, "last_access": 1}}))
+    cache = ImageCache(str(tmp_path / "cache.sqlite3"), images_dir, legacy_index=str(legacy))
+    assert cache.get("k0") == "/static/images/0.png"
@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobs
+from jobs import JOB_REVIEW_EVENT, JobManager, job_review_channel
+from review_backend import SQLiteReviewBackend
+
+
+def review_workflow(job):
+    """写出审核请求后挂起，恢复后把收到的审核结果作为事件写出"""
+    yield {"step": "story"}, None
+    yield {"story": "..."}, JOB_REVIEW_EVENT
+    yield job.review_queue.get(), "review_result"
+
+
+def wait_finished(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return job.finished
+
+
+def events(job):
+    return [(entry["event"], entry["data"]) for entry in job.events_after(0, 0)]
+
+
+def test_suspended_job_releases_worker_and_resumes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = JobManager(workers=1)
+    job = manager.submit(review_workflow)
+    deadline = time.monotonic() + 5
+    while job.status != "review" and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert job.status == "review"
+
+    # 唯一的工作线程已归还，其他任务不受挂起任务影响
+    done = threading.Event()
+
+    def other(job):
+        done.set()
+        yield {"ok": True}, None
+
+    assert wait_finished(manager.submit(other))
+    assert done.is_set()
+
+    job_review_channel(job.id).put({"approved": True, "regenerate": False})
+    assert wait_finished(job)
+    assert job.status == "done"
+    assert events(job)[2] == ("review_result", {"approved": True, "regenerate": False})
+
+
+def test_review_timeout_rejects(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(jobs, "JOB_REVIEW_TIMEOUT", 0.1)
+    manager = JobManager(workers=1)
+    job = manager.submit(review_workflow)
+    assert wait_finished(job)
+    assert job.status == "done"
+    assert events(job)[2] == ("review_result", {"approved": False, "regenerate": False})
+
+
+def test_sqlite_ready_returns_channels_with_messages(tmp_path):
+    backend = SQLiteReviewBackend(str(tmp_path / "review.sqlite3"))
+    backend.publish("job:a", {"approved": True})
+    backend.publish("job:c", {"approved": False})
+    assert backend.ready(["job:a", "job:b", "job:c"]) == {"job:a", "job:c"}
+    assert backend.receive("job:a", 0) == {"approved": True}
+    assert backend.ready(["job:a", "job:b", "job:c"]) == {"job:c"}